@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from collections import deque
+from time import time
+from typing import Iterable, TypedDict
+
+
+class HeaderDemand(TypedDict):
+    rate: float  # Requests per second over the window
+    mean_wait: float  # Seconds spent waiting for a REPL
+    weight: float
+
+
+class DemandTracker:
+    """
+    Sliding-window record of REPL requests per header: when they arrived and how
+    long they waited in `Manager.get_repl`.
+    """
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self._arrivals: dict[str, deque[float]] = {}
+        self._waits: dict[str, deque[tuple[float, float]]] = {}
+
+    def record_arrival(self, header: str, now: float | None = None) -> None:
+        self._arrivals.setdefault(header, deque()).append(
+            time() if now is None else now
+        )
+
+    def record_wait(self, header: str, wait: float, now: float | None = None) -> None:
+        self._waits.setdefault(header, deque()).append(
+            (time() if now is None else now, wait)
+        )
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window
+        for header, arrivals in list(self._arrivals.items()):
+            while arrivals and arrivals[0] < cutoff:
+                arrivals.popleft()
+            if not arrivals:
+                del self._arrivals[header]
+        for header, waits in list(self._waits.items()):
+            while waits and waits[0][0] < cutoff:
+                waits.popleft()
+            if not waits:
+                del self._waits[header]
+
+    def demand(self, now: float | None = None) -> dict[str, HeaderDemand]:
+        now = time() if now is None else now
+        self._prune(now)
+        demand: dict[str, HeaderDemand] = {}
+        for header, arrivals in self._arrivals.items():
+            waits = self._waits.get(header, ())
+            rate = len(arrivals) / self.window
+            mean_wait = sum(w for _, w in waits) / len(waits) if waits else 0.0
+            # Headers whose requests queue get a larger share than their rate alone.
+            demand[header] = {
+                "rate": rate,
+                "mean_wait": mean_wait,
+                "weight": rate * (1 + mean_wait),
+            }
+        return demand
+
+    def allocate(
+        self,
+        budget: int,
+        min_warm: int,
+        headers: Iterable[str] = (),
+        now: float | None = None,
+    ) -> dict[str, int]:
+        """
+        Splits `budget` REPLs across headers proportionally to their weight, after
+        granting `min_warm` to each header seen in the window or listed in `headers`
+        (most demanded first while the budget lasts).
+        """
+        weights = {h: d["weight"] for h, d in self.demand(now).items()}
+        for header in headers:
+            weights.setdefault(header, 0.0)
+        if not weights or budget <= 0:
+            return {}
+
+        allocation: dict[str, int] = {}
+        remaining = budget
+        for header in sorted(weights, key=lambda h: weights[h], reverse=True):
+            allocation[header] = min(min_warm, remaining)
+            remaining -= allocation[header]
+
+        total = sum(weights.values())
+        if remaining > 0 and total > 0:
+            shares = {h: remaining * w / total for h, w in weights.items()}
+            for header, share in shares.items():
+                allocation[header] += int(share)
+            leftover = remaining - sum(int(share) for share in shares.values())
+            by_remainder = sorted(
+                shares, key=lambda h: shares[h] - int(shares[h]), reverse=True
+            )
+            for header in by_remainder[:leftover]:
+                allocation[header] += 1
+
+        return {h: n for h, n in allocation.items() if n > 0}
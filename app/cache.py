@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time
+from typing import Awaitable, Callable, TypedDict
+
+from loguru import logger
+
+from app import protocol
+from app.schemas import CheckResponse, CommandResponse, Infotree
+
+
+class DiskCacheStats(TypedDict):
+    entries: int
+    bytes: int
+    hits: int
+
+
+class CacheStats(TypedDict):
+    entries: int
+    bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    disk: DiskCacheStats | None
+
+
+class FlightStats(TypedDict):
+    in_flight: int
+    coalesced: int
+
+
+class CacheEntry:
+    __slots__ = ("response", "time")
+
+    def __init__(self, response: bytes, time: float) -> None:
+        # The REPL response is kept serialized: its size is exact and a hit
+        # can never alias (and mutate) the payload of another hit.
+        self.response = response
+        self.time = time
+
+    def __len__(self) -> int:
+        return len(self.response)
+
+
+class DiskCache:
+    """
+    SQLite-backed store of REPL results that survives restarts.
+
+    The database runs in WAL mode so that all uvicorn workers of a host can share
+    one file, and is read through SQLite's page cache / mmap instead of being
+    loaded in memory. All methods are blocking: call them from a worker thread.
+    """
+
+    def __init__(self, path: str, *, max_bytes: int, mmap_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                response BLOB NOT NULL,
+                time REAL NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)"
+        )
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, time FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE key = ?", (time(), key)
+            )
+        self.hits += 1
+        return CacheEntry(bytes(row[0]), float(row[1]))
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, entry.response, entry.time, len(entry), time()),
+            )
+
+    def compact(self) -> int:
+        """Drops least recently accessed results above `max_bytes`, returns the count."""
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()[0]
+            excess = int(total) - self.max_bytes
+            if excess <= 0:
+                return 0
+
+            cutoff: float | None = None
+            freed = 0
+            for size, accessed_at in self._conn.execute(
+                "SELECT size, accessed_at FROM results ORDER BY accessed_at"
+            ):
+                freed += size
+                cutoff = accessed_at
+                if freed >= excess:
+                    break
+            deleted = self._conn.execute(
+                "DELETE FROM results WHERE accessed_at <= ?", (cutoff,)
+            ).rowcount
+            self._conn.execute("PRAGMA incremental_vacuum")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info(f"Compacted disk cache: dropped {deleted} results")
+        return int(deleted)
+
+    async def run_compaction(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.compact)
+            except sqlite3.Error as e:
+                logger.error(f"Disk cache compaction failed: {e}")
+
+    def stats(self) -> DiskCacheStats:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        return {"entries": int(entries), "bytes": int(size), "hits": self.hits}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResultCache:
+    """
+    In-process LRU cache of REPL results, bounded by entry count and size.
+
+    Keys are content hashes of the normalized header (see `split_snippet`), the
+    body, the infotree mode and the Lean version, so snippets that only differ
+    by their id or import order hit the same entry.
+    Misses fall through to the optional `DiskCache`, which is written through.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        max_bytes: int,
+        lean_version: str,
+        disk: DiskCache | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lean_version = lean_version
+        self.disk = disk
+
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, header: str, body: str, infotree: Infotree | None = None) -> str:
+        material = json.dumps(
+            [self.lean_version, header, body, infotree], ensure_ascii=False
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def get(
+        self, key: str, snippet_id: str, raw: bool = False
+    ) -> CheckResponse | None:
+        """With `raw`, the hit is passed through undecoded (see `CheckResponse`)."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        elif self.disk is not None:
+            try:
+                entry = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                logger.error(f"Disk cache read failed: {e}")
+            if entry is not None:
+                self._insert(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.debug(f"Cache hit for {snippet_id} ({key[:8]})")
+        if raw:
+            return CheckResponse.passthrough(snippet_id, entry.response, entry.time)
+        response: CommandResponse = json.loads(entry.response)
+        return CheckResponse(id=snippet_id, time=entry.time, response=response)
+
+    async def put(self, key: str, resp: CheckResponse) -> None:
+        # Only successful REPL round-trips are deterministic enough to be reused:
+        # timeouts and REPL failures depend on the load of the server, and REPL-level
+        # errors on the state of the REPL.
+        data = resp.response_json() if not resp.error else None
+        if data is None or protocol.is_error(data):
+            return
+        entry = CacheEntry(data, resp.time)
+        self._insert(key, entry)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, entry)
+            except sqlite3.Error as e:
+                logger.error(f"Disk cache write failed: {e}")
+
+    def _insert(self, key: str, entry: CacheEntry) -> None:
+        if len(entry) > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = entry
+        self._bytes += len(entry)
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Flights:
+    """
+    Table of the checks running in the process, so that identical snippets checked
+    concurrently are run once (see `single_flight`). Kept apart from `ResultCache`:
+    checks are coalesced even with the cache disabled.
+    """
+
+    def __init__(self) -> None:
+        self._flights: dict[str, asyncio.Future[CheckResponse | None]] = {}
+        self.coalesced = 0
+
+    @staticmethod
+    def key(header: str, body: str, infotree: Infotree | None = None) -> str:
+        material = json.dumps([header, body, infotree], ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def single_flight(
+        self,
+        key: str,
+        snippet_id: str,
+        check: Callable[[], Awaitable[CheckResponse]],
+    ) -> CheckResponse:
+        """
+        Runs `check` unless an identical check is already running, in which case its
+        response is awaited and returned relabeled with `snippet_id`.
+        """
+        while (flight := self._flights.get(key)) is not None:
+            # Shielded: a waiter going away must not cancel the running check.
+            resp = await asyncio.shield(flight)
+            if resp is not None:
+                self.coalesced += 1
+                logger.debug(f"Coalesced {snippet_id} with {resp.id} ({key[:8]})")
+                return resp.model_copy(update={"id": snippet_id}, deep=True)
+            # The running check was cancelled: the first waiter to get here retries.
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            resp = await check()
+        except BaseException:
+            flight.set_result(None)
+            raise
+        finally:
+            del self._flights[key]
+        # A copy: the caller may go on to mutate its response.
+        flight.set_result(resp.model_copy(deep=True))
+        return resp
+
+    def stats(self) -> FlightStats:
+        return {"in_flight": len(self._flights), "coalesced": self.coalesced}
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import os
+from functools import cache
+from typing import IO, NamedTuple
+
+from loguru import logger
+
+# Period of `cpu.max`, in microseconds.
+CPU_PERIOD = 100_000
+
+
+class CgroupSnapshot(NamedTuple):
+    cpu_usec: int
+    memory_peak: int
+
+
+@cache
+def cgroups_available(parent: str) -> bool:
+    """Whether REPL cgroups can be created under `parent`, a cgroup v2 directory."""
+    try:
+        with open(os.path.join(parent, "cgroup.subtree_control")) as f:
+            controllers = f.read().split()
+    except OSError as e:
+        logger.warning(f"Cgroups unavailable under {parent}, using rlimits: {e}")
+        return False
+    if "memory" not in controllers or not os.access(parent, os.W_OK):
+        logger.warning(
+            f"Cgroups unavailable under {parent} (not writable or no memory "
+            "controller in cgroup.subtree_control), using rlimits"
+        )
+        return False
+    return True
+
+
+class ReplCgroup:
+    """
+    Cgroup v2 of a single REPL: caps its actual memory (`memory.max`) rather than
+    its address space, and accounts its CPU and peak memory exactly. The parent
+    must be delegated to the server with the `memory` (and `cpu`, for a CPU cap)
+    controller enabled in its `cgroup.subtree_control`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._peak: IO[str] | None = None
+        # Kernels before 6.12 cannot reset `memory.peak` per command, kernels
+        # before 5.19 have no `memory.peak` at all.
+        self._resettable = True
+        self._has_peak = True
+
+    @classmethod
+    def create(
+        cls, parent: str, name: str, memory_max: int, cpus: float = 0
+    ) -> ReplCgroup | None:
+        """The cgroup `name` under `parent`, None if it cannot be set up."""
+        path = os.path.join(parent, name)
+        try:
+            os.mkdir(path)
+            cgroup = cls(path)
+            cgroup._write("memory.max", str(memory_max))
+        except OSError as e:
+            logger.warning(f"Failed to set up cgroup {path}, using rlimits: {e}")
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+            return None
+        # Refinements only: without swap accounting or `memory.oom.group` (kernels
+        # before 4.19) `memory.max` still caps the REPL.
+        cgroup._try_write("memory.swap.max", "0")
+        # An OOM kill takes the whole cgroup down, so that no process of the REPL
+        # survives it half-killed.
+        cgroup._try_write("memory.oom.group", "1")
+        if cpus > 0 and not cgroup._try_write(
+            "cpu.max", f"{int(cpus * CPU_PERIOD)} {CPU_PERIOD}"
+        ):
+            logger.warning(f"Failed to cap the CPU of cgroup {path}")
+        return cgroup
+
+    def _try_write(self, name: str, value: str) -> bool:
+        try:
+            self._write(name, value)
+        except OSError as e:
+            logger.debug(f"Failed to set {name} of cgroup {self.path}: {e}")
+            return False
+        return True
+
+    def _write(self, name: str, value: str) -> None:
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(value)
+
+    def _read(self, name: str) -> str:
+        with open(os.path.join(self.path, name)) as f:
+            return f.read()
+
+    def attach_self(self) -> None:
+        """Moves the calling process into the cgroup (from `preexec_fn`)."""
+        self._write("cgroup.procs", "0")
+
+    def begin(self) -> CgroupSnapshot:
+        """Snapshot at the start of a command, also restarting the peak if possible."""
+        if self._peak is None and self._has_peak:
+            path = os.path.join(self.path, "memory.peak")
+            try:
+                self._peak = open(path, "r+")
+            except PermissionError:
+                self._resettable = False
+                self._peak = open(path, "r")
+            except FileNotFoundError:
+                self._resettable = self._has_peak = False
+        if self._peak is not None and self._resettable:
+            try:
+                self._peak.seek(0)
+                self._peak.write("reset\n")
+                self._peak.flush()
+            except OSError:
+                self._resettable = False
+        return self.snapshot()
+
+    def snapshot(self) -> CgroupSnapshot:
+        cpu_usec = 0
+        for line in self._read("cpu.stat").splitlines():
+            key, _, value = line.partition(" ")
+            if key == "usage_usec":
+                cpu_usec = int(value)
+        peak = 0
+        if self._peak is not None:
+            self._peak.seek(0)
+            peak = int(self._peak.read())
+        return CgroupSnapshot(cpu_usec, peak)
+
+    def command_usage(self, start: CgroupSnapshot, wall: float) -> tuple[float, int]:
+        """
+        CPU (percentage of a single core, averaged over the command) and peak
+        memory of a command started at `start` that ran for `wall` seconds. The peak
+        is 0 when the kernel cannot tell it apart from those of earlier commands.
+        """
+        end = self.snapshot()
+        cpu = (end.cpu_usec - start.cpu_usec) / (wall * 1e6) * 100 if wall > 0 else 0
+        if self._resettable or end.memory_peak > start.memory_peak:
+            # Exact, including short spikes the sampler misses.
+            return cpu, end.memory_peak
+        return cpu, 0
+
+    def remove(self) -> None:
+        """Deletes the cgroup, once its processes are gone."""
+        if self._peak is not None:
+            self._peak.close()
+            self._peak = None
+        try:
+            os.rmdir(self.path)
+        except OSError as e:
+            logger.warning(f"Failed to remove cgroup {self.path}: {e}")
@@ -6,5 +6,5 @@ class ReplError(Exception):
     pass
 
 
-class NoAvailableReplError(Exception):
+class NoAvailableReplError(TimeoutError):
     pass
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from typing import Iterable, Literal, TypeAlias
+
+from app.autoscale import HeaderDemand
+from app.repl import Repl
+
+EvictionPolicyName: TypeAlias = Literal["oldest", "lru", "lfu", "cost"]
+
+
+class EvictionPolicy:
+    """
+    Scores idle REPLs by the value of keeping them alive: when the pool is full,
+    the lowest scored REPL is evicted. The base policy evicts the oldest REPL.
+    """
+
+    name: EvictionPolicyName = "oldest"
+
+    def score(self, repl: Repl, demand: dict[str, HeaderDemand]) -> float:
+        return repl.created_at.timestamp()
+
+    def select(
+        self, candidates: Iterable[Repl], demand: dict[str, HeaderDemand]
+    ) -> tuple[Repl, float]:
+        score, repl = min(
+            ((self.score(r, demand), r) for r in candidates), key=lambda s: s[0]
+        )
+        return repl, score
+
+
+class LRUPolicy(EvictionPolicy):
+    """Evicts the REPL that has been idle the longest."""
+
+    name: EvictionPolicyName = "lru"
+
+    def score(self, repl: Repl, demand: dict[str, HeaderDemand]) -> float:
+        return repl.last_used_at
+
+
+class LFUPolicy(EvictionPolicy):
+    """Evicts a REPL whose header is the least requested."""
+
+    name: EvictionPolicyName = "lfu"
+
+    def score(self, repl: Repl, demand: dict[str, HeaderDemand]) -> float:
+        header_demand = demand.get(repl.header)
+        return header_demand["rate"] if header_demand else 0.0
+
+
+class CostWeightedPolicy(EvictionPolicy):
+    """
+    Evicts the REPL that is the cheapest to lose: the time to load its header
+    again, weighted by how often that header is requested and by how many uses
+    the REPL has left before being exhausted anyway.
+    """
+
+    name: EvictionPolicyName = "cost"
+
+    def score(self, repl: Repl, demand: dict[str, HeaderDemand]) -> float:
+        header_demand = demand.get(repl.header)
+        rate = header_demand["rate"] if header_demand else 0.0
+        # Unrequested headers still rank by load time and remaining uses.
+        return repl.header_load_time * (1 + rate) * max(repl.remaining_uses, 0)
+
+
+POLICIES: dict[EvictionPolicyName, type[EvictionPolicy]] = {
+    "oldest": EvictionPolicy,
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "cost": CostWeightedPolicy,
+}
+
+
+def get_policy(name: EvictionPolicyName) -> EvictionPolicy:
+    return POLICIES[name]()
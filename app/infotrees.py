@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from time import time
+from typing import TypeAlias, TypedDict
+
+from app import protocol
+from app.schemas import CommandResponse
+
+# Infotrees are very repetitive: the fastest level compresses them about as well as
+# the default one, in half the time.
+COMPRESSION_LEVEL = 1
+
+JSON: TypeAlias = "dict[str, JSON] | list[JSON] | str | int | float | bool | None"
+
+
+class InfotreeStoreStats(TypedDict):
+    entries: int
+    bytes: int  # Compressed
+    stored: int
+    evictions: int
+
+
+def select(data: bytes, path: str) -> bytes:
+    """
+    JSON of the subtree of the infotree `data` at `path`: list indices and object
+    keys separated by `/`, e.g. `0/children/2`. Raises `LookupError`.
+    """
+    if not path.strip("/"):
+        return data
+    node: JSON = protocol.loads(data)
+    for part in path.strip("/").split("/"):
+        if isinstance(node, list):
+            try:
+                node = node[int(part)]
+            except ValueError:
+                raise LookupError(part) from None
+        elif isinstance(node, dict):
+            node = node[part]
+        else:
+            raise LookupError(part)
+    return protocol.dumps(node)
+
+
+class InfotreeStore:
+    """
+    SQLite-backed store of compressed infotrees, bounded in size: the oldest ones
+    are dropped beyond `max_bytes`. Responses then carry a handle to fetch their
+    infotree from, instead of the infotree itself.
+
+    Handles are content hashes, so identical infotrees are stored once. A file is
+    shared by all uvicorn workers of a host (WAL mode). All methods are blocking:
+    call them from a worker thread.
+    """
+
+    def __init__(self, path: str, *, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stored = 0
+        self.evictions = 0
+
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS infotrees (
+                handle TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS infotrees_stored_at ON infotrees (stored_at)"
+        )
+        # Running total of the sizes, kept by triggers for all workers sharing the file.
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS infotrees_size (total INTEGER NOT NULL)"
+        )
+        self._conn.execute("""
+            INSERT INTO infotrees_size SELECT COALESCE(SUM(size), 0) FROM infotrees
+            WHERE NOT EXISTS (SELECT 1 FROM infotrees_size)
+            """)
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS infotrees_insert AFTER INSERT ON infotrees
+            BEGIN UPDATE infotrees_size SET total = total + NEW.size; END
+            """)
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS infotrees_delete AFTER DELETE ON infotrees
+            BEGIN UPDATE infotrees_size SET total = total - OLD.size; END
+            """)
+
+    def put(self, infotree: bytes) -> str | None:
+        """Stores the JSON of an infotree, returns its handle. None if it cannot fit."""
+        handle = hashlib.sha256(infotree).hexdigest()[:32]
+        with self._lock:
+            # Already stored: only its age is reset.
+            if self._conn.execute(
+                "UPDATE infotrees SET stored_at = ? WHERE handle = ?", (time(), handle)
+            ).rowcount:
+                return handle
+
+        data = zlib.compress(infotree, COMPRESSION_LEVEL)
+        if len(data) > self.max_bytes:
+            return None
+        with self._lock:
+            # Ignored if another worker stored it meanwhile.
+            if self._conn.execute(
+                "INSERT OR IGNORE INTO infotrees VALUES (?, ?, ?, ?)",
+                (handle, data, len(data), time()),
+            ).rowcount:
+                self.stored += 1
+                self._evict()
+        return handle
+
+    def _evict(self) -> None:
+        (total,) = self._conn.execute("SELECT total FROM infotrees_size").fetchone()
+        excess = int(total) - self.max_bytes
+        if excess <= 0:
+            return
+        handles: list[str] = []
+        for handle, size in self._conn.execute(
+            "SELECT handle, size FROM infotrees ORDER BY stored_at"
+        ):
+            handles.append(handle)
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany(
+            "DELETE FROM infotrees WHERE handle = ?", [(h,) for h in handles]
+        )
+        self._conn.execute("PRAGMA incremental_vacuum")
+        self.evictions += len(handles)
+
+    def get(self, handle: str) -> bytes | None:
+        """JSON of the infotree of `handle`, None if unknown or dropped."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM infotrees WHERE handle = ?", (handle,)
+            ).fetchone()
+        return zlib.decompress(row[0]) if row is not None else None
+
+    def detach(self, response: bytes) -> tuple[CommandResponse, str | None]:
+        """
+        Stores the infotree of a REPL response (JSON), returns the decoded response
+        without it and the handle of the infotree. The handle is None, and the
+        infotree left in the response, if it has none or it cannot be stored.
+        """
+        resp: CommandResponse = protocol.loads(response)
+        if "infotree" not in resp:
+            return resp, None
+        handle = self.put(protocol.dumps(resp["infotree"]))
+        if handle is not None:
+            del resp["infotree"]
+        return resp, handle
+
+    def stats(self) -> InfotreeStoreStats:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM infotrees), total FROM infotrees_size"
+            ).fetchone()
+        return {
+            "entries": int(entries),
+            "bytes": int(size),
+            "stored": self.stored,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
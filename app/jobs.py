@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+from contextlib import aclosing
+from time import time
+from uuid import uuid4
+
+from loguru import logger
+
+from app.cache import Flights, ResultCache
+from app.infotrees import InfotreeStore
+from app.manager import Manager
+from app.routers.check import iter_checks
+from app.schemas import CheckResponse, ChecksRequest, Job, JobStatus
+from app.settings import settings
+
+
+class JobStore:
+    """
+    SQLite-backed queue of batch checks submitted through the job API.
+
+    Requests and per-snippet results are persisted as they complete, so that a
+    restarted server resumes unfinished jobs where they stopped. A file is shared by
+    all uvicorn workers of a host (WAL mode): a job is run by the worker that claims
+    it, and reclaimed by another one once its lease is not renewed. All methods are
+    blocking: call them from a worker thread.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                done INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                error TEXT,
+                owner TEXT,
+                heartbeat REAL
+            )
+            """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                response TEXT NOT NULL,
+                PRIMARY KEY (job_id, idx)
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+        )
+
+    def create(self, request: ChecksRequest) -> Job:
+        job = Job(
+            id=uuid4().hex,
+            status="queued",
+            total=len(request.snippets),
+            created_at=time(),
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, 0, ?, NULL, NULL, NULL, NULL)",
+                (
+                    job.id,
+                    job.status,
+                    request.model_dump_json(),
+                    job.total,
+                    job.created_at,
+                ),
+            )
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, total, done, created_at, error FROM jobs "
+                "WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return Job(
+            id=row[0],
+            status=row[1],
+            total=row[2],
+            done=row[3],
+            created_at=row[4],
+            error=row[5],
+        )
+
+    def unfinished(self) -> list[str]:
+        """Ids of queued and interrupted jobs, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') "
+                "ORDER BY created_at"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim(self, owner: str, lease: float) -> str | None:
+        """
+        Marks the oldest queued job, or running job whose lease of `lease` seconds
+        expired, as run by `owner`, returns its id. None if there is none.
+        """
+        now = time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND COALESCE(heartbeat, 0) < ?) "
+                "ORDER BY created_at",
+                (now - lease,),
+            ).fetchall()
+            for (job_id,) in rows:
+                # Conditional on the job being still claimable: of several workers
+                # racing for it, a single one updates it.
+                if self._conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ? "
+                    "WHERE id = ? AND (status = 'queued' "
+                    "OR (status = 'running' AND COALESCE(heartbeat, 0) < ?))",
+                    (owner, now, job_id, now - lease),
+                ).rowcount:
+                    return str(job_id)
+        return None
+
+    def renew(self, job_id: str, owner: str) -> bool:
+        """Renews the lease of `owner` on a job, False if it lost it."""
+        with self._lock:
+            return bool(
+                self._conn.execute(
+                    "UPDATE jobs SET heartbeat = ? "
+                    "WHERE id = ? AND owner = ? AND status = 'running'",
+                    (time(), job_id, owner),
+                ).rowcount
+            )
+
+    def release(self, job_id: str, owner: str) -> None:
+        """Puts back in the queue a job of `owner`, for any worker to resume it."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, heartbeat = NULL "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (job_id, owner),
+            )
+
+    def load(self, job_id: str) -> tuple[ChecksRequest, set[int]]:
+        """The request of a job and the indices of its snippets already checked."""
+        with self._lock:
+            (request,) = self._conn.execute(
+                "SELECT request FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            done = self._conn.execute(
+                "SELECT idx FROM job_results WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return ChecksRequest.model_validate_json(request), {row[0] for row in done}
+
+    def add_result(self, job_id: str, index: int, resp: CheckResponse) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO job_results VALUES (?, ?, ?)",
+                    (job_id, index, resp.to_json()),
+                ).rowcount
+                self._conn.execute(
+                    "UPDATE jobs SET done = done + ? WHERE id = ?", (inserted, job_id)
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def set_status(
+        self,
+        job_id: str,
+        status: JobStatus,
+        error: str | None = None,
+        owner: str | None = None,
+    ) -> None:
+        """Sets the status of a job, only if still run by `owner` when given."""
+        finished_at = time() if status in ("done", "failed") else None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND (? IS NULL OR owner = ?)",
+                (status, error, finished_at, job_id, owner, owner),
+            )
+
+    def results_json(self, job_id: str, offset: int, limit: int) -> list[bytes]:
+        """
+        JSON of the checked snippets with a submission index in
+        `[offset, offset + limit)`, as stored.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT response FROM job_results "
+                "WHERE job_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+                (job_id, offset, offset + limit),
+            ).fetchall()
+        return [
+            row[0] if isinstance(row[0], bytes) else row[0].encode("utf-8")
+            for row in rows
+        ]
+
+    def results(self, job_id: str, offset: int, limit: int) -> list[CheckResponse]:
+        """Decoded `results_json`."""
+        return [
+            CheckResponse.model_validate_json(data)
+            for data in self.results_json(job_id, offset, limit)
+        ]
+
+    def purge(self, before: float) -> int:
+        """Deletes jobs finished before `before`, returns the count."""
+        with self._lock:
+            ids = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT id FROM jobs WHERE finished_at < ?", (before,)
+                )
+            ]
+            for job_id in ids:
+                self._conn.execute(
+                    "DELETE FROM job_results WHERE job_id = ?", (job_id,)
+                )
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JobRunner:
+    """
+    Runs queued jobs one after the other, each at the capacity of the pool, and
+    stores every result as soon as its snippet is checked.
+
+    The lease on the running job is renewed every third of `lease` seconds. Jobs
+    submitted to other workers sharing the store, or left by dead ones, are looked
+    for every `lease` seconds.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        manager: Manager,
+        cache: ResultCache | None = None,
+        retention: float = 86400,
+        infotrees: InfotreeStore | None = None,
+        lease: float = 60,
+        flights: Flights | None = None,
+    ) -> None:
+        self.store = store
+        self.manager = manager
+        self.cache = cache
+        self.infotrees = infotrees
+        self.flights = flights
+        self.retention = retention
+        self.lease = lease
+        self.owner = uuid4().hex
+        self._wake = asyncio.Event()
+
+    async def submit(self, request: ChecksRequest) -> Job:
+        job = await asyncio.to_thread(self.store.create, request)
+        logger.info(f"Queued job {job.id} of {job.total} snippets")
+        self._wake.set()
+        return job
+
+    async def run(self) -> None:
+        while True:
+            # Cleared before looking for work: a job submitted meanwhile wakes us up.
+            self._wake.clear()
+            job_id = await asyncio.to_thread(self.store.claim, self.owner, self.lease)
+            if job_id is not None:
+                await self._run_job(job_id)
+                continue
+            purged = await asyncio.to_thread(self.store.purge, time() - self.retention)
+            if purged:
+                logger.info(f"Purged {purged} finished jobs")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.lease)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _renew(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not await asyncio.to_thread(self.store.renew, job_id, self.owner):
+                logger.warning(f"Lost the lease of job {job_id}")
+                return
+
+    async def _run_job(self, job_id: str) -> None:
+        request, done = await asyncio.to_thread(self.store.load, job_id)
+        indices = [i for i in range(len(request.snippets)) if i not in done]
+        if done:
+            logger.info(f"Resuming job {job_id}: {len(indices)} snippets left")
+
+        renewal = asyncio.create_task(self._renew(job_id))
+        checks = iter_checks(
+            [request.snippets[i] for i in indices],
+            float(request.timeout),
+            request.debug,
+            self.manager,
+            request.reuse,
+            request.infotree,
+            self.cache if request.cache else None,
+            request.pack,
+            settings.PASSTHROUGH_RESPONSES,
+            self.infotrees if request.infotree_handle else None,
+            self.flights if request.cache else None,
+        )
+        try:
+            # Closed on leaving early: the checks still running are cancelled.
+            async with aclosing(checks):
+                async for i, resp in checks:
+                    await asyncio.to_thread(
+                        self.store.add_result, job_id, indices[i], resp
+                    )
+                    if renewal.done():
+                        # Reclaimed by another worker, which resumes it.
+                        return
+        except asyncio.CancelledError:
+            # Shutting down: back in the queue, resumed by another worker or on the
+            # next start.
+            await asyncio.to_thread(self.store.release, job_id, self.owner)
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            await asyncio.to_thread(
+                self.store.set_status, job_id, "failed", str(e), self.owner
+            )
+            return
+        finally:
+            renewal.cancel()
+        await asyncio.to_thread(self.store.set_status, job_id, "done", None, self.owner)
+        logger.info(f"Job {job_id} done")
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+
+from loguru import logger
+
+# Files of a Lake project whose changes invalidate its resolved environment.
+PROJECT_FILES = (
+    "lean-toolchain",
+    "lake-manifest.json",
+    "lakefile.lean",
+    "lakefile.toml",
+)
+
+# Prints the environment `lake env` runs commands in.
+_PRINT_ENV = "import json, os, sys; sys.stdout.write(json.dumps(dict(os.environ)))"
+
+_lock = asyncio.Lock()
+# Per project directory: fingerprint of the project and variables set by Lake.
+_resolved: dict[str, tuple[str, dict[str, str]]] = {}
+
+
+def fingerprint(project_dir: str) -> str:
+    """Digest of the toolchain and manifest files of a Lake project."""
+    digest = hashlib.sha256()
+    for name in PROJECT_FILES:
+        try:
+            with open(os.path.join(project_dir, name), "rb") as f:
+                digest.update(name.encode("utf-8") + b"\0" + f.read() + b"\0")
+        except OSError:
+            continue
+    return digest.hexdigest()
+
+
+async def _resolve(project_dir: str) -> dict[str, str]:
+    proc = await asyncio.create_subprocess_exec(
+        "lake",
+        "env",
+        sys.executable,
+        "-c",
+        _PRINT_ENV,
+        cwd=project_dir,
+        env=os.environ,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(
+            f"`lake env` failed ({proc.returncode}): {stderr.decode().strip()}"
+        )
+    env: dict[str, str] = json.loads(stdout)
+    # Only what Lake sets (LEAN_PATH, LEAN_SYSROOT, ...), applied over the server's
+    # environment at each spawn.
+    return {k: v for k, v in env.items() if os.environ.get(k) != v}
+
+
+async def lake_env(project_dir: str) -> dict[str, str] | None:
+    """
+    Environment to exec the REPL binary in directly, as `lake env` would run it.
+    Resolved once per project and cached until its toolchain or manifest
+    changes. None when `lake env` fails: REPLs then go through it.
+    """
+    key = fingerprint(project_dir)
+    cached = _resolved.get(project_dir)
+    if cached is not None and cached[0] == key:
+        return {**os.environ, **cached[1]}
+
+    async with _lock:
+        cached = _resolved.get(project_dir)
+        if cached is None or cached[0] != key:
+            try:
+                variables = await _resolve(project_dir)
+            except Exception as e:
+                logger.error(f"Failed to resolve the Lake environment: {e}")
+                return None
+            logger.info(
+                f"Resolved the Lake environment of {project_dir}: {sorted(variables)}"
+            )
+            cached = _resolved[project_dir] = (key, variables)
+    return {**os.environ, **cached[1]}
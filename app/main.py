@@ -1,3 +1,4 @@
+import asyncio
 import shutil
 from contextlib import asynccontextmanager
 from importlib.metadata import PackageNotFoundError, version
@@ -9,11 +10,17 @@ from pydantic.json_schema import GenerateJsonSchema
 from rich.console import Console
 from rich.logging import RichHandler
 
+from app.cache import DiskCache, Flights, ResultCache
 from app.db import db
+from app.infotrees import InfotreeStore
+from app.jobs import JobRunner, JobStore
 from app.manager import Manager
+from app.pickles import HeaderPickles, detect_toolchain
 from app.routers.backward import router as backward_router
 from app.routers.check import router as check_router
 from app.routers.health import router as health_router
+from app.routers.jobs import router as jobs_router
+from app.routers.tactics import router as tactics_router
 from app.settings import Settings
 
 try:
@@ -49,13 +56,93 @@ def create_app(settings: Settings) -> FastAPI:
             max_uses=settings.MAX_USES,
             max_mem=settings.MAX_MEM,
             init_repls=settings.INIT_REPLS,
+            spare_repls=settings.SPARE_REPLS,
+            autoscale=settings.AUTOSCALE,
+            autoscale_interval=settings.AUTOSCALE_INTERVAL,
+            autoscale_window=settings.AUTOSCALE_WINDOW,
+            autoscale_min_warm=settings.AUTOSCALE_MIN_WARM,
+            eviction=settings.EVICTION_POLICY,
+            prefix_cache_mb=settings.PREFIX_CACHE_MB,
+            recycle_mem_mb=settings.RECYCLE_MEM_MB,
+            recycle_latency_factor=settings.RECYCLE_LATENCY_FACTOR,
+            recycle_max_age=settings.RECYCLE_MAX_AGE,
+            memory_budget_mb=settings.MEMORY_BUDGET_MB,
+            memory_reserve_mb=settings.MEMORY_RESERVE_MB,
+            pickles=(
+                HeaderPickles(
+                    settings.PICKLE_DIR,
+                    detect_toolchain(settings.path_to_mathlib, settings.LEAN_VERSION),
+                )
+                if settings.PICKLE_DIR
+                else None
+            ),
         )
         app.state.manager = manager
+        disk_cache = (
+            DiskCache(
+                settings.CACHE_DB_PATH,
+                max_bytes=settings.CACHE_DB_MAX_MB * 1024 * 1024,
+                mmap_bytes=settings.CACHE_DB_MMAP_MB * 1024 * 1024,
+            )
+            if settings.CACHE_DB_PATH
+            else None
+        )
+        app.state.cache = (
+            ResultCache(
+                max_entries=settings.CACHE_MAX_ENTRIES,
+                max_bytes=settings.CACHE_MAX_MB * 1024 * 1024,
+                lean_version=settings.LEAN_VERSION,
+                disk=disk_cache,
+            )
+            if settings.CACHE_MAX_ENTRIES > 0 or disk_cache is not None
+            else None
+        )
+        app.state.flights = Flights()
+        compaction = (
+            asyncio.create_task(
+                disk_cache.run_compaction(settings.CACHE_DB_COMPACT_INTERVAL)
+            )
+            if disk_cache is not None
+            else None
+        )
+        infotrees = (
+            InfotreeStore(
+                settings.INFOTREE_DB_PATH or ":memory:",
+                max_bytes=settings.INFOTREE_STORE_MB * 1024 * 1024,
+            )
+            if settings.INFOTREE_STORE_MB > 0
+            else None
+        )
+        app.state.infotrees = infotrees
         await app.state.manager.initialize_repls()
 
+        job_store = JobStore(settings.JOBS_DB_PATH)
+        app.state.jobs = JobRunner(
+            job_store,
+            manager,
+            app.state.cache,
+            retention=settings.JOBS_RETENTION,
+            infotrees=infotrees,
+            lease=settings.JOBS_LEASE,
+            flights=app.state.flights,
+        )
+        job_runner = asyncio.create_task(app.state.jobs.run())
+
         yield
 
+        job_runner.cancel()
+        try:
+            await job_runner
+        except asyncio.CancelledError:
+            pass
+        job_store.close()
         await app.state.manager.cleanup()
+        if compaction is not None:
+            compaction.cancel()
+        if disk_cache is not None:
+            disk_cache.close()
+        if infotrees is not None:
+            infotrees.close()
         await db.disconnect()
 
         logger.info("Disconnected from database")
@@ -76,6 +163,16 @@ def create_app(settings: Settings) -> FastAPI:
         prefix="/api",
         tags=["check"],
     )
+    app.include_router(
+        tactics_router,
+        prefix="/api",
+        tags=["tactics"],
+    )
+    app.include_router(
+        jobs_router,
+        prefix="/api",
+        tags=["jobs"],
+    )
     app.include_router(
         health_router,
         tags=["health"],
@@ -1,17 +1,54 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import json
+from collections import deque
 from time import time
+from typing import TypedDict
 
 from loguru import logger
 
+from app.autoscale import DemandTracker, HeaderDemand
 from app.errors import NoAvailableReplError, ReplError
+from app.eviction import EvictionPolicyName, get_policy
+from app.memory import MemoryBudget, MemoryStats
+from app.pickles import HeaderPickles
 from app.repl import Repl
+from app.sampler import SamplerStats, sampler
 from app.schemas import CheckResponse, Snippet
 from app.settings import settings
 from app.utils import is_blank
 
+# All header imports (initialization and spares) should finish in 60 seconds.
+HEADER_TIMEOUT = 60
+
+
+class Waiter:
+    """A request queued in `Manager.get_repl` until a REPL is handed to it."""
+
+    __slots__ = ("header", "snippet_id", "reuse", "seq", "enqueued_at", "future")
+
+    def __init__(self, header: str, snippet_id: str, reuse: bool, seq: int) -> None:
+        self.header = header
+        self.snippet_id = snippet_id
+        self.reuse = reuse
+        self.seq = seq
+        self.enqueued_at = time()
+        self.future: asyncio.Future[Repl] = asyncio.get_running_loop().create_future()
+
+
+class PoolStats(TypedDict):
+    max_repls: int
+    free: int
+    busy: int
+    waiting: dict[str, int]
+    headers: dict[str, int]
+    allocation: dict[str, int]
+    demand: dict[str, HeaderDemand]
+    memory: MemoryStats | None
+    sampler: SamplerStats
+
 
 class Manager:
     def __init__(
@@ -21,17 +58,73 @@ class Manager:
         max_uses: int = settings.MAX_USES,
         max_mem: int = settings.MAX_MEM,
         init_repls: dict[str, int] = settings.INIT_REPLS,
+        pickles: HeaderPickles | None = None,
+        rebind: bool = settings.REBIND_REPLS,
+        spare_repls: dict[str, int] = settings.SPARE_REPLS,
+        autoscale: bool = settings.AUTOSCALE,
+        autoscale_interval: float = settings.AUTOSCALE_INTERVAL,
+        autoscale_window: float = settings.AUTOSCALE_WINDOW,
+        autoscale_min_warm: int = settings.AUTOSCALE_MIN_WARM,
+        eviction: EvictionPolicyName = settings.EVICTION_POLICY,
+        prefix_cache_mb: int = settings.PREFIX_CACHE_MB,
+        recycle_mem_mb: int = settings.RECYCLE_MEM_MB,
+        recycle_latency_factor: float = settings.RECYCLE_LATENCY_FACTOR,
+        recycle_max_age: int = settings.RECYCLE_MAX_AGE,
+        memory_budget_mb: int = settings.MEMORY_BUDGET_MB,
+        memory_reserve_mb: int = settings.MEMORY_RESERVE_MB,
     ) -> None:
 
         self.max_repls = max_repls
         self.max_uses = max_uses
         self.max_mem = max_mem
         self.init_repls = init_repls
+        self.pickles = pickles
+        self.rebind = rebind
+        self.spare_repls = spare_repls
+        self.autoscale = autoscale
+        self.autoscale_interval = autoscale_interval
+        self.autoscale_min_warm = autoscale_min_warm
+        self.eviction = get_policy(eviction)
+        self.prefix_cache_mb = prefix_cache_mb
+        self.recycle_mem_mb = recycle_mem_mb
+        self.recycle_latency_factor = recycle_latency_factor
+        self.recycle_max_age = recycle_max_age
+        # Host-wide memory admission on top of MAX_REPLS, None when disabled.
+        self.memory = (
+            MemoryBudget(
+                memory_budget_mb * 1024 * 1024, memory_reserve_mb * 1024 * 1024
+            )
+            if memory_budget_mb > 0
+            else None
+        )
+        if self.memory is not None:
+            sampler.pss = True
+
+        # Per-header demand, and the share of MAX_REPLS it is currently granted.
+        self.demand = DemandTracker(autoscale_window)
+        self.allocation: dict[str, int] = {}
+        self._autoscaler: asyncio.Task[None] | None = None
+
+        # Headers currently being pickled, to pickle each header only once.
+        self._pickling: set[str] = set()
 
         self._lock = asyncio.Lock()
-        self._cond = asyncio.Condition(self._lock)
         self._free: list[Repl] = []
         self._busy: set[Repl] = set()
+        # FIFO queues of requests waiting for a REPL, per header.
+        self._waiters: dict[str, deque[Waiter]] = {}
+        self._waiter_seq = itertools.count()
+
+        # Background replenishment of started, header-loaded spare REPLs.
+        self._replenish = asyncio.Event()
+        self._replenisher: asyncio.Task[None] | None = None
+        self._warming: dict[str, int] = {}
+        self._warm_backoff: dict[str, float] = {}
+
+        # REPLs whose replacement is warming, and REPLs replaced while busy (closed
+        # on release).
+        self._retiring: set[Repl] = set()
+        self._replaced: set[Repl] = set()
 
         logger.info(
             "[Manager] Initialized with: \n  MAX_REPLS={},\n  MAX_USES={},\n  MAX_MEM={} MB",
@@ -51,14 +144,211 @@ class Manager:
                 initialized_repls.append(await self.get_repl(header=header))
 
         async def _prep_and_release(repl: Repl) -> None:
-            # All initialized imports should finish in 60 seconds.
-            await self.prep(repl, snippet_id="init", timeout=60, debug=False)
+            await self.prep(
+                repl, snippet_id="init", timeout=HEADER_TIMEOUT, debug=False
+            )
             await self.release_repl(repl)
 
         await asyncio.gather(*(_prep_and_release(r) for r in initialized_repls))
 
         logger.info(f"Initialized REPLs with: {json.dumps(self.init_repls, indent=2)}")
 
+        if self.spare_repls or self.autoscale:
+            self._replenisher = asyncio.create_task(self._replenish_loop())
+            self._request_replenish()
+        if self.autoscale:
+            self._autoscaler = asyncio.create_task(self._autoscale_loop())
+
+    def _request_replenish(self) -> None:
+        if self.spare_repls or self.allocation:
+            self._replenish.set()
+
+    def _spare_targets(self) -> dict[str, int]:
+        """Idle REPLs to keep per header: static spares, or what the allocation lacks."""
+        targets = dict(self.spare_repls)
+        for header, allocated in self.allocation.items():
+            # Warming REPLs are busy, but count as spares in `_replenish_loop`.
+            busy = sum(1 for r in self._busy if r.header == header)
+            serving = busy - self._warming.get(header, 0)
+            targets[header] = max(targets.get(header, 0), allocated - serving)
+        return targets
+
+    async def _replenish_loop(self) -> None:
+        while True:
+            await self._replenish.wait()
+            self._replenish.clear()
+
+            warming: list[Repl] = []
+            async with self._lock:
+                now = time()
+                # Waiting requests have priority over spares for free capacity.
+                targets = {} if self._has_waiters() else self._spare_targets()
+                for header, target in targets.items():
+                    if self._warm_backoff.get(header, 0) > now:
+                        continue
+                    idle = sum(
+                        1 for r in self._free if r.header == header and r.is_running
+                    )
+                    missing = target - idle - self._warming.get(header, 0)
+                    while (
+                        missing > 0
+                        and self._total < self.max_repls
+                        and self._admits(header, start=True, spare=True)
+                    ):
+                        warming.append(await self.start_new(header))
+                        self._warming[header] = self._warming.get(header, 0) + 1
+                        missing -= 1
+
+            for repl in warming:
+                asyncio.create_task(self._warm(repl))
+
+    async def _warm(self, repl: Repl) -> bool:
+        header = repl.header
+        try:
+            prep = await self.prep(
+                repl, snippet_id="spare", timeout=HEADER_TIMEOUT, debug=False
+            )
+            failed = prep is not None and prep.error is not None
+        except Exception as e:
+            logger.error(f"\\[{repl.uuid.hex[:8]}] Failed to warm spare REPL: {e}")
+            failed = True
+        finally:
+            self._warming[header] -= 1
+
+        if failed:
+            # Do not respawn a broken header in a tight loop.
+            self._warm_backoff[header] = time() + HEADER_TIMEOUT
+            asyncio.get_running_loop().call_later(HEADER_TIMEOUT, self._replenish.set)
+            if repl in self._busy:
+                await self.destroy_repl(repl)
+            return False
+        logger.info(f"\\[{repl.uuid.hex[:8]}] Spare REPL ready for {header!r}")
+        await self.release_repl(repl)
+        return True
+
+    def _recycle_reason(self, repl: Repl) -> str | None:
+        if repl in self._retiring:
+            return None
+        return repl.recycle_reason(
+            self.recycle_mem_mb * 1024 * 1024,
+            self.recycle_latency_factor,
+            self.recycle_max_age,
+        )
+
+    async def _recycle(self, repl: Repl, reason: str) -> None:
+        """
+        Starts and warms a replacement for `repl`, which keeps serving requests until
+        the replacement is ready. Lock must be held. The pool may exceed MAX_REPLS by
+        the REPLs being replaced, which are closed right after.
+        """
+        if self._warm_backoff.get(repl.header, 0) > time():
+            # The header failed to warm lately: keep the REPL, retried on its next release.
+            return
+        logger.info(f"\\[{repl.uuid.hex[:8]}] Recycling REPL ({reason})")
+        self._retiring.add(repl)
+        replacement = await self.start_new(repl.header)
+        self._warming[repl.header] = self._warming.get(repl.header, 0) + 1
+
+        async def replace() -> None:
+            ready = await self._warm(replacement)
+            async with self._lock:
+                self._retiring.discard(repl)
+                if not ready:
+                    # Keep serving with the old REPL, retried on its next release.
+                    return
+                if repl in self._free:
+                    self._free.remove(repl)
+                    logger.info(f"Recycled REPL {repl.uuid.hex[:8]}, closing it")
+                    await repl.close()
+                    await self._dispatch()
+                elif repl in self._busy:
+                    self._replaced.add(repl)
+
+        asyncio.create_task(replace())
+
+    @property
+    def _total(self) -> int:
+        return len(self._free) + len(self._busy)
+
+    async def _autoscale_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.autoscale_interval)
+            allocation = self.demand.allocate(
+                self.max_repls, self.autoscale_min_warm, self.init_repls
+            )
+            if allocation != self.allocation:
+                logger.info(f"[Manager] REPL allocation: {json.dumps(allocation)}")
+            self.allocation = allocation
+            await self._rebalance()
+            self._request_replenish()
+
+    async def _rebalance(self) -> None:
+        """
+        Hands idle REPLs of over-allocated headers to under-allocated ones when the
+        pool is full: rebound in-process when possible, closed otherwise so that the
+        replenisher can start the right header.
+        """
+        warming: list[Repl] = []
+        async with self._lock:
+            counts: dict[str, int] = {}
+            for r in [*self._free, *self._busy]:
+                counts[r.header] = counts.get(r.header, 0) + 1
+            deficits = [
+                header
+                for header, allocated in self.allocation.items()
+                for _ in range(allocated - counts.get(header, 0))
+            ]
+            for header in deficits:
+                if self._total < self.max_repls:
+                    break
+                surplus = [
+                    r
+                    for r in self._free
+                    if counts[r.header] > self.allocation.get(r.header, 0)
+                ]
+                if not surplus:
+                    break
+                repl, score = self.eviction.select(surplus, self.demand.demand())
+                logger.info(
+                    f"\\[{repl.uuid.hex[:8]}] Selected for rebalancing ({self.eviction.name} score={score:.4g})"
+                )
+                self._free.remove(repl)
+                counts[repl.header] -= 1
+                if self.rebind and self._can_rebind(repl, header):
+                    logger.info(
+                        f"\\[{repl.uuid.hex[:8]}] Rebalancing REPL to header {header!r}"
+                    )
+                    repl.rebind(header)
+                    self._busy.add(repl)
+                    self._warming[header] = self._warming.get(header, 0) + 1
+                    warming.append(repl)
+                else:
+                    logger.info(f"Rebalancing: closing REPL {repl.uuid.hex[:8]}")
+                    await repl.close()
+
+        for repl in warming:
+            asyncio.create_task(self._warm(repl))
+
+    def stats(self) -> PoolStats:
+        headers: dict[str, int] = {}
+        for r in [*self._free, *self._busy]:
+            headers[r.header] = headers.get(r.header, 0) + 1
+        return {
+            "max_repls": self.max_repls,
+            "free": len(self._free),
+            "busy": len(self._busy),
+            "waiting": {h: len(q) for h, q in self._waiters.items()},
+            "headers": headers,
+            "allocation": self.allocation,
+            "demand": self.demand.demand(),
+            "memory": (
+                self.memory.stats([*self._free, *self._busy], self._busy)
+                if self.memory is not None
+                else None
+            ),
+            "sampler": sampler.stats(),
+        }
+
     async def get_repl(
         self,
         header: str = "",
@@ -70,85 +360,247 @@ class Manager:
         Async-safe way to get a `Repl` instance for a given header.
         Immediately raises an Exception if not possible.
         """
-        deadline = time() + timeout
-        async with self._cond:
-            while True:
-                logger.info(
-                    f"# Free = {len(self._free)} | # Busy = {len(self._busy)} | # Max = {self.max_repls}"
-                )
-                if reuse:
-                    for i, r in enumerate(self._free):
-                        if (
-                            r.header == header
-                        ):  # repl shouldn't be exhausted (max age to check)
-                            repl = self._free.pop(i)
-                            self._busy.add(repl)
-
-                            logger.info(
-                                f"\\[{repl.uuid.hex[:8]}] Reusing ({"started" if repl.is_running else "non-started"}) REPL for {snippet_id}"
-                            )
-                            return repl
-                total = len(self._free) + len(self._busy)
-                if total < self.max_repls:
-                    return await self.start_new(header)
+        self.demand.record_arrival(header)
+        start = time()
+        try:
+            return await self._acquire(header, snippet_id, timeout, reuse)
+        finally:
+            self.demand.record_wait(header, time() - start)
 
-                if self._free:
-                    oldest = min(self._free, key=lambda r: r.created_at)
-                    self._free.remove(oldest)
-                    uuid = oldest.uuid
-                    logger.info(f"Destroying REPL {uuid.hex[:8]}")
-                    await oldest.close()
-                    del oldest
-                    logger.info(f"Destroyed REPL {uuid.hex[:8]}")
+    async def _acquire(
+        self, header: str, snippet_id: str, timeout: float, reuse: bool
+    ) -> Repl:
+        async with self._lock:
+            logger.info(
+                f"# Free = {len(self._free)} | # Busy = {len(self._busy)} | # Max = {self.max_repls}"
+            )
+            # Requests already waiting are served first: capacity freed in the
+            # meantime is theirs, and idle REPLs are handed to them on release.
+            if reuse and not self._waiters.get(header):
+                for i, r in enumerate(self._free):
+                    if r.header == header and self._admits(header):
+                        repl = self._free.pop(i)
+                        self._busy.add(repl)
+
+                        logger.info(
+                            f"\\[{repl.uuid.hex[:8]}] Reusing ({"started" if repl.is_running else "non-started"}) REPL for {snippet_id}"
+                        )
+                        self._request_replenish()
+                        return repl
+            if not self._has_waiters():
+                if self._total < self.max_repls and self._admits(header, start=True):
                     return await self.start_new(header)
+                # Pool full or memory tight: an idle REPL makes room.
+                if self._free and self._admits(header):
+                    return await self._evict_for(header, snippet_id, reuse)
+                if self.memory is not None and (
+                    self._free or self._total < self.max_repls
+                ):
+                    # The pool has room, the memory budget does not.
+                    self.memory.throttled += 1
+
+            waiter = Waiter(header, snippet_id, reuse, next(self._waiter_seq))
+            self._waiters.setdefault(header, deque()).append(waiter)
+
+        try:
+            return await asyncio.wait_for(waiter.future, timeout=timeout)
+        except TimeoutError:
+            async with self._lock:
+                self._remove_waiter(waiter)
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Handed a REPL as the wait timed out: it is in `_busy` for us.
+                    return waiter.future.result()
+            raise NoAvailableReplError(f"Timed out after {timeout}s") from None
+
+    async def _evict_for(self, header: str, snippet_id: str, reuse: bool) -> Repl:
+        """
+        Frees an idle REPL for `header`: rebinds it when possible, replaces it
+        otherwise. Requests without `reuse` always get a fresh process.
+        """
+        victim, score = self.eviction.select(self._free, self.demand.demand())
+        logger.info(
+            f"\\[{victim.uuid.hex[:8]}] Evicting REPL for {snippet_id} ({self.eviction.name} score={score:.4g})"
+        )
+        self._free.remove(victim)
+        if reuse and self.rebind and self._can_rebind(victim, header):
+            # Keep the process (and its page cache), only swap the header.
+            logger.info(
+                f"\\[{victim.uuid.hex[:8]}] Rebinding REPL to header {header!r} for {snippet_id}"
+            )
+            victim.rebind(header)
+            self._busy.add(victim)
+            return victim
+
+        uuid = victim.uuid
+        logger.info(f"Destroying REPL {uuid.hex[:8]}")
+        await victim.close()
+        del victim
+        logger.info(f"Destroyed REPL {uuid.hex[:8]}")
+        return await self.start_new(header)
+
+    def _admits(self, header: str, start: bool = False, spare: bool = False) -> bool:
+        """
+        Whether the memory budget has room for a command of `header`, on a new REPL
+        when `start` is true. Requests are always admitted on an otherwise idle pool,
+        as waiting would not free anything; spares are not.
+        """
+        if self.memory is None or (not self._busy and not spare):
+            return True
+        return self.memory.admits(header, start, [*self._free, *self._busy], self._busy)
+
+    def _has_waiters(self) -> bool:
+        return any(self._waiters.values())
+
+    def _remove_waiter(self, waiter: Waiter) -> None:
+        queue = self._waiters.get(waiter.header)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+        if not queue:
+            self._waiters.pop(waiter.header, None)
+
+    def _next_waiter(
+        self, header: str | None = None, start: bool = False
+    ) -> Waiter | None:
+        """
+        Oldest pending waiter for `header` that accepts a reused REPL, or oldest
+        pending waiter across all headers when `header` is None. None as well when
+        the memory budget cannot admit it (on a new REPL when `start` is true).
+        """
+        if header is not None:
+            candidates = [w for w in self._waiters.get(header, ()) if w.reuse]
+        else:
+            candidates = [q[0] for q in self._waiters.values() if q]
+        candidates = [w for w in candidates if not w.future.done()]
+        if not candidates:
+            return None
+        waiter = min(candidates, key=lambda w: w.seq)
+        if not self._admits(waiter.header, start):
+            return None
+        self._remove_waiter(waiter)
+        return waiter
 
-                remaining = deadline - time()
-                if remaining <= 0:
-                    raise NoAvailableReplError(f"Timed out after {timeout}s")
+    def _hand_off(self, waiter: Waiter, repl: Repl) -> None:
+        self._busy.add(repl)
+        waiter.future.set_result(repl)
+        logger.info(
+            f"\\[{repl.uuid.hex[:8]}] Handed to {waiter.snippet_id} after waiting {time() - waiter.enqueued_at:.3f}s"
+        )
 
-                await asyncio.wait_for(self._cond.wait(), timeout=remaining)
+    async def _dispatch(self) -> None:
+        """Hands idle REPLs and free capacity to waiters, oldest first. Lock must be held."""
+        # Cancelled (timed out) waiters are dropped lazily.
+        for header, queue in list(self._waiters.items()):
+            while queue and queue[0].future.done():
+                queue.popleft()
+            if not queue:
+                del self._waiters[header]
+
+        # Idle REPLs go to the oldest waiter that can use them as they are.
+        for repl in list(self._free):
+            waiter = self._next_waiter(repl.header)
+            if waiter is not None:
+                self._free.remove(repl)
+                self._hand_off(waiter, repl)
+
+        # Free capacity goes to the oldest waiters, whatever their header.
+        while self._total < self.max_repls:
+            waiter = self._next_waiter(start=True)
+            if waiter is None:
+                break
+            self._hand_off(waiter, await self.start_new(waiter.header))
+
+        # Pool full (or memory tight): evicting an idle REPL of another header is the
+        # only option left.
+        while self._free:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            repl = await self._evict_for(waiter.header, waiter.snippet_id, waiter.reuse)
+            self._hand_off(waiter, repl)
+
+    @staticmethod
+    def _can_rebind(repl: Repl, header: str) -> bool:
+        # A blank header runs on a fresh environment, which a used REPL cannot offer.
+        if not repl.is_running or is_blank(header):
+            return False
+        # Loading the new header costs one use, at least one must remain after it.
+        return repl.max_uses + 1 - repl.use_count >= 2
 
     async def destroy_repl(self, repl: Repl) -> None:
-        async with self._cond:
+        async with self._lock:
             uuid = repl.uuid
             self._busy.discard(repl)
+            self._retiring.discard(repl)
+            self._replaced.discard(repl)
             if repl in self._free:
                 self._free.remove(repl)
             logger.info(f"Destroying REPL {uuid.hex[:8]}")
             await repl.close()
             del repl
             logger.info(f"Destroyed REPL {uuid.hex[:8]}")
+            await self._dispatch()
+        self._request_replenish()
 
     async def release_repl(self, repl: Repl) -> None:
-        async with self._cond:
+        async with self._lock:
             if repl not in self._busy:
                 logger.error(
                     f"Attempted to release a REPL that is not busy: {repl.uuid.hex[:8]}"
                 )
                 return
 
-            if repl.exhausted:
+            if self.memory is not None and repl.peak_growth is not None:
+                self.memory.record_growth(repl.header, repl.peak_growth)
+                repl.peak_growth = None
+
+            if repl.exhausted or repl in self._replaced:
                 uuid = repl.uuid
-                logger.info(f"REPL {uuid.hex[:8]} is exhausted, closing it")
+                logger.info(
+                    f"REPL {uuid.hex[:8]} is {'replaced' if repl in self._replaced else 'exhausted'}, closing it"
+                )
                 self._busy.discard(repl)
+                self._replaced.discard(repl)
+                self._retiring.discard(repl)
 
                 await repl.close()
                 del repl
                 logger.info(f"Deleted REPL {uuid.hex[:8]}")
+                await self._dispatch()
+                self._request_replenish()
                 return
+            reason = self._recycle_reason(repl)
+            if reason is not None:
+                await self._recycle(repl, reason)
             self._busy.remove(repl)
             self._free.append(repl)
             logger.info(f"\\[{repl.uuid.hex[:8]}] Released!")
-            self._cond.notify(1)
+            await self._dispatch()
 
     async def start_new(self, header: str) -> Repl:
-        repl = await Repl.create(header, max_uses=self.max_uses, max_mem=self.max_mem)
+        repl = await Repl.create(
+            header,
+            max_uses=self.max_uses,
+            max_mem=self.max_mem,
+            prefix_max_bytes=self.prefix_cache_mb * 1024 * 1024,
+        )
         self._busy.add(repl)
         return repl
 
     async def cleanup(self) -> None:
-        async with self._cond:
+        if self._replenisher is not None:
+            self._replenisher.cancel()
+        if self._autoscaler is not None:
+            self._autoscaler.cancel()
+        async with self._lock:
             logger.info("Cleaning up REPL manager...")
+            for queue in self._waiters.values():
+                for waiter in queue:
+                    if not waiter.future.done():
+                        waiter.future.set_exception(
+                            NoAvailableReplError("REPL manager shut down")
+                        )
+            self._waiters.clear()
+
             for repl in self._free:
                 await repl.close()
                 del repl
@@ -159,6 +611,7 @@ class Manager:
                 del repl
             self._busy.clear()
 
+            sampler.stop()
             logger.info("REPL manager cleaned up!")
         pass
 
@@ -166,27 +619,36 @@ class Manager:
         self, repl: Repl, snippet_id: str, timeout: float, debug: bool
     ) -> CheckResponse | None:
         if repl.is_running:
-            return None
-
-        try:
-            await repl.start()
-        except Exception as e:
-            logger.exception("Failed to start REPL: %s", e)
-            raise ReplError("Failed to start REPL") from e
-
-        if not is_blank(repl.header):
+            if repl.loaded_header == repl.header:
+                return None
+        else:
             try:
-                cmd_response = await repl.send_timeout(
-                    Snippet(id=f"{snippet_id}-header", code=repl.header),
-                    timeout=timeout,
-                    is_header=True,
-                )
-            except TimeoutError as e:
-                logger.error("Header command timed out")
-                raise e
+                await repl.start()
             except Exception as e:
-                logger.error("Failed to run header on REPL")
-                raise ReplError("Failed to run header on REPL") from e
+                logger.exception("Failed to start REPL: %s", e)
+                raise ReplError("Failed to start REPL") from e
+
+        if not is_blank(repl.header):
+            cmd_response = None
+            if self.pickles is not None:
+                cmd_response = await self._unpickle_header(repl, snippet_id, timeout)
+
+            if cmd_response is None:
+                try:
+                    cmd_response = await repl.send_timeout(
+                        Snippet(id=f"{snippet_id}-header", code=repl.header),
+                        timeout=timeout,
+                        is_header=True,
+                    )
+                except TimeoutError as e:
+                    logger.error("Header command timed out")
+                    raise e
+                except Exception as e:
+                    logger.error("Failed to run header on REPL")
+                    raise ReplError("Failed to run header on REPL") from e
+
+                if not cmd_response.error and self.pickles is not None:
+                    await self._pickle_header(repl, timeout)
 
             if not debug:
                 cmd_response.diagnostics = None
@@ -196,6 +658,56 @@ class Manager:
                 await self.destroy_repl(repl)
 
             repl.header_cmd_response = cmd_response
+            repl.header_load_time = cmd_response.time
+            repl.loaded_header = repl.header
+            if self.memory is not None and not cmd_response.error:
+                pss = (await repl.measure_memory())["pss"]
+                if pss > 0:
+                    self.memory.record_footprint(repl.header, pss)
 
             return cmd_response
+        repl.loaded_header = repl.header
         return repl.header_cmd_response
+
+    async def _unpickle_header(
+        self, repl: Repl, snippet_id: str, timeout: float
+    ) -> CheckResponse | None:
+        """Restores the header environment from its pickle, None if there is none."""
+        assert self.pickles is not None
+        path = self.pickles.get(repl.header)
+        if path is None:
+            return None
+
+        try:
+            cmd_response = await repl.unpickle_env(path, timeout=timeout)
+        except TimeoutError as e:
+            logger.error("Header unpickling timed out")
+            raise e
+        except Exception as e:
+            # Stale or corrupted pickle: drop it, the header is run (and pickled) again.
+            logger.error(
+                f"\\[{repl.uuid.hex[:8]}] Failed to unpickle {path}, running header: {e}"
+            )
+            self.pickles.discard(path)
+            return None
+
+        logger.info(f"\\[{repl.uuid.hex[:8]}] Unpickled header from {path}")
+        cmd_response.id = f"{snippet_id}-header"
+        return cmd_response
+
+    async def _pickle_header(self, repl: Repl, timeout: float) -> None:
+        assert self.pickles is not None
+        if repl.header in self._pickling or self.pickles.get(repl.header):
+            return
+
+        self._pickling.add(repl.header)
+        tmp_path = self.pickles.tmp_path(repl.header)
+        try:
+            await repl.pickle_env(tmp_path, timeout=timeout)
+            self.pickles.commit(tmp_path, repl.header)
+        except Exception as e:
+            # Pickling is an optimization only, the REPL itself is fine.
+            logger.error(f"\\[{repl.uuid.hex[:8]}] Failed to pickle header: {e}")
+            self.pickles.discard(tmp_path)
+        finally:
+            self._pickling.discard(repl.header)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import TYPE_CHECKING, Iterable, TypedDict
+
+import psutil
+
+if TYPE_CHECKING:
+    from app.repl import Repl
+
+# Recent command peaks kept per header to size its reservation.
+HISTORY = 50
+
+
+class ProcessMemory(TypedDict):
+    uss: int  # Pages private to the process tree
+    pss: int  # Private pages plus a share of the pages mapped by other processes
+
+
+class MemoryStats(TypedDict):
+    budget: int
+    used: int
+    reserved: int
+    footprints: dict[str, int]
+    headroom: dict[str, int]
+    throttled: int
+
+
+def smaps_rollup(pid: int) -> ProcessMemory | None:
+    """USS and PSS of a process from `/proc/<pid>/smaps_rollup` (Linux 4.14+)."""
+    fields: dict[bytes, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "rb") as f:
+            for line in f:
+                key, _, value = line.partition(b":")
+                if key in (b"Pss", b"Private_Clean", b"Private_Dirty"):
+                    fields[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return None
+    if b"Pss" not in fields:
+        return None
+    return {
+        "uss": fields.get(b"Private_Clean", 0) + fields.get(b"Private_Dirty", 0),
+        "pss": fields[b"Pss"],
+    }
+
+
+def process_memory(proc: psutil.Process) -> ProcessMemory:
+    """
+    USS and PSS of a process and its children. Unlike RSS, they do not count the
+    Mathlib `.olean` files every REPL maps more than once: summed over all REPLs,
+    PSS is what they actually take from the host.
+    """
+    total: ProcessMemory = {"uss": 0, "pss": 0}
+    try:
+        procs = [proc, *proc.children(recursive=True)]
+    except psutil.Error:
+        return total
+    for p in procs:
+        measured = smaps_rollup(p.pid)
+        if measured is None:
+            try:
+                info = p.memory_full_info()
+            except psutil.Error:
+                continue
+            # Only RSS outside of Linux: an overestimate, which is the safe side.
+            uss = getattr(info, "uss", info.rss)
+            measured = {"uss": uss, "pss": getattr(info, "pss", uss)}
+        total["uss"] += measured["uss"]
+        total["pss"] += measured["pss"]
+    return total
+
+
+class MemoryBudget:
+    """
+    Host-wide memory budget the manager admits REPL starts and commands against.
+
+    Usage is the PSS of all REPLs, as last sampled. Each busy REPL also holds a reservation for
+    the peak its command may still reach, sized per header from the largest recent
+    growth of commands of that header: a heavy `nlinarith` header reserves more than
+    a light one. Starting a REPL additionally costs the footprint of its header.
+    """
+
+    def __init__(self, budget: int, default_reserve: int) -> None:
+        self.budget = budget
+        # Reservation of headers without any measurement yet.
+        self.default_reserve = default_reserve
+
+        self._footprints: dict[str, int] = {}
+        self._growths: dict[str, deque[int]] = {}
+        # Requests deferred for lack of memory, counted by the manager: `admits` is
+        # also probed by dispatch passes and spare REPLs.
+        self.throttled = 0
+
+    def footprint(self, header: str) -> int:
+        return self._footprints.get(header, self.default_reserve)
+
+    def headroom(self, header: str) -> int:
+        growths = self._growths.get(header)
+        return max(growths) if growths else self.default_reserve
+
+    def record_footprint(self, header: str, pss: int) -> None:
+        """PSS of a REPL right after loading `header`."""
+        self._footprints[header] = pss
+
+    def record_growth(self, header: str, growth: int) -> None:
+        """How much a command of `header` grew its REPL at its peak."""
+        self._growths.setdefault(header, deque(maxlen=HISTORY)).append(growth)
+
+    def usage(self, repl: Repl) -> int:
+        pss = repl.memory()["pss"] if repl.is_running else 0
+        if repl.loaded_header != repl.header:
+            # Still starting or loading its header: counts as a loaded one.
+            return max(pss, self.footprint(repl.header))
+        return pss
+
+    def admits(
+        self, header: str, start: bool, repls: Iterable[Repl], busy: Iterable[Repl]
+    ) -> bool:
+        """
+        Whether a command of `header` fits in the budget, on a newly started REPL
+        when `start` is true, on top of the REPLs of the pool and their commands.
+        """
+        need = self.headroom(header) + (self.footprint(header) if start else 0)
+        return self.used(repls) + self.reserved(busy) + need <= self.budget
+
+    def used(self, repls: Iterable[Repl]) -> int:
+        return sum(self.usage(r) for r in repls)
+
+    def reserved(self, busy: Iterable[Repl]) -> int:
+        return sum(self.headroom(r.header) for r in busy)
+
+    def stats(self, repls: Iterable[Repl], busy: Iterable[Repl]) -> MemoryStats:
+        return {
+            "budget": self.budget,
+            "used": self.used(repls),
+            "reserved": self.reserved(busy),
+            "footprints": dict(self._footprints),
+            "headroom": {h: self.headroom(h) for h in self._growths},
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import re
+from typing import Sequence
+
+from app.prefix import shift_messages, shift_sorries
+from app.schemas import CommandResponse, Message, Pos, Snippet, Sorry
+from app.split import split_snippet
+
+# Commands whose effect outlives a `section` (or that would break the wrapping):
+# snippets using them are always run on their own.
+UNPACKABLE = re.compile(
+    r"\b(?:namespace|section|end|mutual|instance|attribute|deriving|export|"
+    r"notation|infix|infixl|infixr|prefix|postfix|macro|macro_rules|syntax|"
+    r"elab|elab_rules|declare_syntax_cat|initialize|builtin_initialize|_root_)\b"
+    r"|@\[|#exit|^import\b",
+    re.MULTILINE,
+)
+DECLARATION = re.compile(
+    r"^\s*(?:(?:private|protected|noncomputable|partial|unsafe)\s+)*"
+    r"(?:theorem|lemma|def|abbrev|structure|inductive|class|opaque|axiom)\s+"
+    r"([^\s:({\[]+)",
+    re.MULTILINE,
+)
+IDENTIFIER = re.compile(r"[A-Za-z_][\w'!?]*(?:\.[A-Za-z_][\w'!?]*)*")
+
+
+def packable(body: str) -> bool:
+    return bool(body.strip()) and UNPACKABLE.search(body) is None
+
+
+def _names(text: str) -> set[str]:
+    """Dotted names and each of their components."""
+    names: set[str] = set()
+    for name in text.split():
+        names.add(name)
+        names.update(name.split("."))
+    return names
+
+
+class Pack:
+    """
+    Same-header snippets run as one REPL command, each body wrapped in its own
+    `section`. Snippets of a pack never declare a name used by another one, so
+    packed results match the results of running them one by one.
+    """
+
+    def __init__(self, header: str) -> None:
+        self.header = header
+        self.items: list[tuple[int, Snippet, str]] = []
+        self._declared: set[str] = set()
+        # First line of each body in the packed code (1-based) and its line count.
+        self._spans: list[tuple[int, int]] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def accepts(self, body: str) -> bool:
+        declared = _names(" ".join(DECLARATION.findall(body)))
+        used = _names(" ".join(IDENTIFIER.findall(body)))
+        return not (declared | used) & self._declared
+
+    def add(self, index: int, snippet: Snippet, body: str) -> None:
+        self.items.append((index, snippet, body))
+        self._declared |= _names(" ".join(DECLARATION.findall(body)))
+
+    def code(self) -> str:
+        lines: list[str] = []
+        self._spans = []
+        for _, _, body in self.items:
+            body_lines = body.splitlines()
+            lines.append("section")
+            self._spans.append((len(lines) + 1, len(body_lines)))
+            lines.extend(body_lines)
+            lines.append("end")
+        return "\n".join(lines)
+
+    def split(self, resp: CommandResponse) -> tuple[list[CommandResponse], int]:
+        """
+        Splits the response of `code()` per snippet, with positions relative to
+        each body. Also returns the index of the first snippet with an error: its
+        result, and those of the snippets after it, must not be trusted (an error
+        can leak into the following commands, e.g. an unterminated comment).
+        """
+        messages: list[list[Message]] = [[] for _ in self.items]
+        sorries: list[list[Sorry]] = [[] for _ in self.items]
+        failed = len(self.items)
+
+        for message in resp.get("messages", []):
+            k, inside = self._locate(message["pos"], message.get("endPos"))
+            if not inside or message["severity"] == "error":
+                failed = min(failed, k)
+            if inside:
+                messages[k] += shift_messages([message], 1 - self._spans[k][0])
+        for sorry in resp.get("sorries", []):
+            k, inside = self._locate(sorry["pos"], sorry["endPos"])
+            if not inside:
+                failed = min(failed, k)
+            else:
+                sorries[k] += shift_sorries([sorry], 1 - self._spans[k][0])
+
+        responses: list[CommandResponse] = []
+        for k in range(len(self.items)):
+            split: CommandResponse = {"env": resp["env"]}
+            if messages[k]:
+                split["messages"] = messages[k]
+            if sorries[k]:
+                split["sorries"] = sorries[k]
+            responses.append(split)
+        return responses, failed
+
+    def _locate(self, pos: Pos, end_pos: Pos | None) -> tuple[int, bool]:
+        """The snippet a position belongs to, and whether it lies within its body."""
+        for k, (start, count) in enumerate(self._spans):
+            if pos["line"] <= start + count:  # Up to the closing `end`
+                last = end_pos["line"] if end_pos else pos["line"]
+                inside = start <= pos["line"] and last < start + count
+                return k, inside
+        return len(self._spans) - 1, False
+
+
+def make_packs(snippets: Sequence[tuple[int, Snippet]], size: int) -> list[Pack]:
+    """
+    Groups snippets into packs of up to `size` same-header snippets, in submission
+    order. Snippets that cannot be packed end up alone in their pack.
+    """
+    packs: list[Pack] = []
+    open_packs: dict[str, Pack] = {}
+    for index, snippet in snippets:
+        header, body = split_snippet(snippet.code)
+        if not packable(body):
+            pack = Pack(header)
+            pack.add(index, snippet, body)
+            packs.append(pack)
+            continue
+        open_pack = open_packs.get(header)
+        if open_pack is None or len(open_pack) >= size or not open_pack.accepts(body):
+            open_pack = open_packs[header] = Pack(header)
+            packs.append(open_pack)
+        open_pack.add(index, snippet, body)
+    return packs
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from uuid import uuid4
+
+from loguru import logger
+
+
+def detect_toolchain(project_dir: str | None, lean_version: str) -> str:
+    """
+    Identifies the toolchain pickles were produced with: the `lean-toolchain` of
+    the project REPLs run in, falling back to the configured Lean version.
+    """
+    if project_dir:
+        try:
+            with open(os.path.join(project_dir, "lean-toolchain")) as f:
+                return f.read().strip()
+        except OSError:
+            pass
+    return lean_version
+
+
+class HeaderPickles:
+    """
+    Local store of pickled header environments (`.olean` files written by the
+    REPL's `pickleTo`), keyed by header and toolchain.
+    """
+
+    def __init__(self, directory: str, toolchain: str) -> None:
+        self.directory = directory
+        self.toolchain = toolchain
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, header: str) -> str:
+        digest = hashlib.sha256(f"{self.toolchain}\n{header}".encode("utf-8"))
+        return os.path.join(self.directory, f"{digest.hexdigest()[:32]}.olean")
+
+    def get(self, header: str) -> str | None:
+        path = self.path(header)
+        return path if os.path.exists(path) else None
+
+    def tmp_path(self, header: str) -> str:
+        # Unique per writer: concurrent REPLs pickling the same header never
+        # clobber each other and the final rename is atomic.
+        return f"{self.path(header)}.{uuid4().hex[:8]}.tmp.olean"
+
+    def commit(self, tmp_path: str, header: str) -> None:
+        os.replace(tmp_path, self.path(header))
+        logger.info(f"Pickled header environment to {self.path(header)}")
+
+    def discard(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+from collections import OrderedDict
+from typing import TypedDict
+
+from app.schemas import Message, Pos, Sorry
+
+
+class PrefixStats(TypedDict):
+    entries: int
+    bytes: int
+    hits: int
+    misses: int
+    reused_commands: int
+
+
+class PrefixEnv:
+    __slots__ = ("env", "messages", "sorries", "size")
+
+    def __init__(
+        self, env: int, messages: list[Message], sorries: list[Sorry], size: int
+    ) -> None:
+        # Environment after the prefix, with the messages and sorries of the whole
+        # prefix (positions relative to the snippet body).
+        self.env = env
+        self.messages = messages
+        self.sorries = sorries
+        # Memory the REPL grew by while elaborating the last command of the prefix.
+        self.size = size
+
+
+class PrefixEnvs:
+    """
+    LRU table of the environments a REPL reached after elaborating prefixes of
+    top-level commands, so that snippets sharing a prefix resume from its env.
+
+    The Lean REPL cannot drop an environment: evicting an entry only stops its
+    reuse, the process memory is reclaimed when the REPL is recycled.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, PrefixEnv] = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_commands = 0
+
+    @staticmethod
+    def key(parent: str, command: str) -> str:
+        return hashlib.sha256(f"{parent}\0{command}".encode("utf-8")).hexdigest()
+
+    def longest(self, keys: list[str]) -> tuple[int, PrefixEnv | None]:
+        """Number of leading commands covered by the longest known prefix, and its env."""
+        for n in range(len(keys), 0, -1):
+            entry = self._entries.get(keys[n - 1])
+            if entry is not None:
+                self._entries.move_to_end(keys[n - 1])
+                self.hits += 1
+                self.reused_commands += n
+                return n, entry
+        self.misses += 1
+        return 0, None
+
+    def put(self, key: str, entry: PrefixEnv) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> PrefixStats:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_commands": self.reused_commands,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _shift_pos(pos: Pos, lines: int) -> Pos:
+    return {"line": pos["line"] + lines, "column": pos["column"]}
+
+
+def shift_messages(messages: list[Message], lines: int) -> list[Message]:
+    """Moves messages of a command starting `lines` lines into the body."""
+    shifted = copy.deepcopy(messages)
+    for message in shifted:
+        message["pos"] = _shift_pos(message["pos"], lines)
+        if message.get("endPos"):
+            message["endPos"] = _shift_pos(message["endPos"], lines)  # type: ignore[arg-type]
+    return shifted
+
+
+def shift_sorries(sorries: list[Sorry], lines: int) -> list[Sorry]:
+    shifted = copy.deepcopy(sorries)
+    for sorry in shifted:
+        sorry["pos"] = _shift_pos(sorry["pos"], lines)
+        sorry["endPos"] = _shift_pos(sorry["endPos"], lines)
+    return shifted
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any
+
+try:
+    import orjson  # type: ignore[import-not-found, unused-ignore]
+except ImportError:  # Optional: `pip install fast-repl[fast]`
+    orjson = None  # type: ignore[assignment, unused-ignore]
+
+JSON_LIBRARY = "orjson" if orjson is not None else "json"
+
+# Responses of the REPL are JSON documents followed by a blank line.
+FRAME_END = b"\n\n"
+WHITESPACE = b" \t\r\n"
+
+
+def loads(data: bytes | bytearray) -> Any:
+    """Decodes a REPL response, with orjson when installed. Raises `ValueError`."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Encodes a REPL command, non-ASCII characters left as is."""
+    if orjson is not None:
+        return bytes(orjson.dumps(obj))
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _last(data: bytes, end: int | None = None) -> int:
+    """Index of the last non-whitespace byte of `data[:end]`, -1 if there is none."""
+    i = (len(data) if end is None else end) - 1
+    while i >= 0 and data[i] in WHITESPACE:
+        i -= 1
+    return i
+
+
+def is_object(data: bytes) -> bool:
+    """
+    Whether `data` is delimited like a JSON object: what is checked of responses
+    passed through undecoded, to catch a truncated one. Not a validation.
+    """
+    start = 0
+    while start < len(data) and data[start] in WHITESPACE:
+        start += 1
+    end = _last(data)
+    return start < end and data[start] == ord("{") and data[end] == ord("}")
+
+
+def is_error(data: bytes) -> bool:
+    """
+    Whether the response `data` is a REPL-level error (`{"message": ...}`, e.g. for
+    an unknown environment), without decoding it. The REPL sorts object keys, and
+    successful responses have no `message` key (only `messages`).
+    """
+    start = 0
+    while start < len(data) and data[start] in WHITESPACE:
+        start += 1
+    start += 1  # Opening brace
+    while start < len(data) and data[start] in WHITESPACE:
+        start += 1
+    return data.startswith(b'"message"', start)
+
+
+def splice(obj: bytes, key: str, value: bytes) -> bytes:
+    """
+    Adds the member `key` (a plain identifier) with the JSON `value` to the JSON
+    object `obj`, without decoding either. `value` is put on a single line: the REPL pretty-prints its
+    responses, and line breaks never occur in JSON strings, only between tokens.
+    """
+    end = _last(obj)
+    if end < 0 or obj[end] != ord("}"):
+        raise ValueError("not a JSON object")
+    separator = b"" if obj[_last(obj, end)] == ord("{") else b","
+    member = b'"' + key.encode("utf-8") + b'":' + value.replace(b"\n", b" ")
+    return obj[:end] + separator + member + b"}"
+
+
+class FrameReader:
+    """
+    Splits the REPL stdout into responses. Reads large chunks and looks for frame
+    boundaries with `bytearray.find`, so that a response costs a few Python calls
+    whatever its number of lines, and lines of any length are fine (`readline`
+    fails beyond the stream limit, 64 KiB by default).
+    """
+
+    def __init__(self, stream: asyncio.StreamReader, chunk_size: int) -> None:
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        # Bytes of the buffer already searched for a frame end.
+        self._scanned = 0
+
+    async def read_frame(self) -> bytes:
+        """Next response, without its terminating blank line. Empty at EOF."""
+        while True:
+            # Blank lines between responses are skipped.
+            start = 0
+            while start < len(self._buffer) and self._buffer[start] in b"\r\n":
+                start += 1
+            if start:
+                del self._buffer[:start]
+                self._scanned = max(self._scanned - start, 0)
+
+            end = self._buffer.find(FRAME_END, max(self._scanned - 1, 0))
+            if end != -1:
+                frame = bytes(self._buffer[:end])
+                del self._buffer[: end + len(FRAME_END)]
+                self._scanned = 0
+                return frame
+            self._scanned = len(self._buffer)
+
+            chunk = await self.stream.read(self.chunk_size)
+            if not chunk:
+                # EOF: a last response may lack its blank line.
+                frame = bytes(self._buffer).strip()
+                self._buffer.clear()
+                self._scanned = 0
+                return frame
+            self._buffer += chunk
+
+
+class StderrRing:
+    """
+    Last `max_bytes` the REPL wrote to stderr. Offsets count every byte written,
+    so that what a command wrote can be told apart from earlier output.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._buffer = bytearray()
+        # Bytes written since the REPL started, including those dropped.
+        self.total = 0
+
+    def append(self, data: bytes) -> None:
+        self._buffer += data
+        self.total += len(data)
+        if len(self._buffer) > self.max_bytes:
+            del self._buffer[: len(self._buffer) - self.max_bytes]
+
+    def since(self, offset: int, end: int | None = None) -> str:
+        """What was written after `offset` (up to `end`), as far as still buffered."""
+        dropped = self.total - len(self._buffer)
+        start = offset - dropped
+        stop = len(self._buffer) if end is None else max(end - dropped, 0)
+        text = self._buffer[max(start, 0) : stop].decode("utf-8", errors="replace")
+        return f"[...]{text}" if start < 0 else text
+
+    def tail(self) -> str:
+        return self._buffer.decode("utf-8", errors="replace")
@@ -1,11 +1,13 @@
 import asyncio
-import json
 import os
 import platform
 import signal
-import tempfile
+import statistics
 from asyncio.subprocess import Process
+from collections import deque
 from datetime import datetime
+from time import time
+from typing import Any, cast
 from uuid import UUID, uuid4
 
 import psutil
@@ -13,24 +15,44 @@ from loguru import logger
 from rich.console import Console
 from rich.syntax import Syntax
 
+from app import protocol
+from app.cgroup import CgroupSnapshot, ReplCgroup, cgroups_available
 from app.db import db
 from app.errors import LeanError, ReplError
+from app.lake import lake_env
+from app.memory import ProcessMemory, process_memory
 from app.models import ReplStatus
+from app.prefix import PrefixEnv, PrefixEnvs, shift_messages, shift_sorries
 from app.prisma_client import prisma
+from app.protocol import FrameReader, StderrRing
+from app.sampler import Usage, sampler
 from app.schemas import (
     CheckResponse,
     Command,
     CommandResponse,
     Diagnostics,
     Infotree,
+    Message,
+    PickleEnv,
+    ProofStep,
+    ProofStepResponse,
     Snippet,
+    Sorry,
+    UnpickleEnv,
 )
 from app.settings import settings
+from app.split import split_commands
 from app.utils import is_blank
 
 log_lock = asyncio.Lock()
 console = Console(log_time_format="[%m/%d/%y %H:%M:%S]", force_terminal=True)
 
+# Characters of the latest stderr output reported in errors.
+STDERR_IN_ERRORS = 2000
+
+# Commands whose median latency is the baseline, and the recent latency, of a REPL.
+LATENCY_WINDOW = 5
+
 
 async def log_snippet(uuid: UUID, snippet_id: str, code: str) -> None:
     header = (
@@ -49,6 +71,52 @@ async def log_snippet(uuid: UUID, snippet_id: str, code: str) -> None:
         console.log(syntax)
 
 
+class UsageWindow:
+    """
+    Usage of the REPL over a command, or over the commands of a `send`: from when
+    the REPL starts running the first one to when it answers the last one. With
+    pipelining, the next command is written before, but starts after.
+    """
+
+    __slots__ = (
+        "started_at",
+        "rss_start",
+        "stderr_start",
+        "stderr_end",
+        "cgroup_start",
+        "cpu_max",
+        "mem_max",
+        "rss",
+    )
+
+    def __init__(self) -> None:
+        # None until the REPL starts running the first command.
+        self.started_at: float | None = None
+        self.rss_start = 0
+        self.stderr_start = 0
+        # Set if another command started right after: its output is not ours.
+        self.stderr_end: int | None = None
+        self.cgroup_start: CgroupSnapshot | None = None
+        # Readings at the last answer.
+        self.cpu_max = 0.0
+        self.mem_max = 0
+        self.rss = 0
+
+
+class PendingCommand:
+    __slots__ = ("started", "response", "window")
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, window: UsageWindow | None = None
+    ) -> None:
+        # Loop time when the REPL starts running the command (once the previous
+        # one is answered), then its raw response and the time it was read.
+        self.started: asyncio.Future[float] = loop.create_future()
+        self.response: asyncio.Future[tuple[bytes, float]] = loop.create_future()
+        # Where to account the usage of the REPL while it runs the command.
+        self.window = window
+
+
 class Repl:
     def __init__(
         self,
@@ -58,17 +126,29 @@ class Repl:
         *,
         max_mem: int,
         max_uses: int,
+        prefix_max_bytes: int = 0,
     ) -> None:
         self.uuid = uuid
         self.header = header
         self.use_count = 0
         self.created_at = created_at
+        self.last_used_at = time()
+        # Seconds it took to load the header, what evicting this REPL would cost.
+        self.header_load_time = 0.0
 
         # Stores the response received when running the import header.
         self.header_cmd_response: CheckResponse | None = None
+        # Environment the header was elaborated (or unpickled) into.
+        self.header_env: int | None = None
+        # Header whose environment is loaded in the running process, differs
+        # from `header` once the REPL is rebound to another header.
+        self.loaded_header: str | None = None
+        # Environments of already elaborated command prefixes, None if disabled.
+        self.prefix_envs = (
+            PrefixEnvs(prefix_max_bytes) if prefix_max_bytes > 0 else None
+        )
 
         self.proc: Process | None = None
-        self.error_file = tempfile.TemporaryFile("w+")
         self.max_memory_bytes = max_mem * 1024 * 1024
         self.max_uses = max_uses
 
@@ -77,17 +157,32 @@ class Repl:
         # REPL statistics
         self.cpu_per_exec: dict[int, float] = {}
         self.mem_per_exec: dict[int, int] = {}
-
-        # Vars that hold max CPU / mem usage per proof.
-        self._cpu_max: float = 0.0  # CPU as a percentage of a single core
-        self._mem_max: int = 0
-
-        self._ps_proc: psutil.Process | None = None
-        self._cpu_task: asyncio.Task[None] | None = None
-        self._mem_task: asyncio.Task[None] | None = None
+        # Latencies of the first and of the last commands (header loads excluded).
+        self.first_times: list[float] = []
+        self.last_times: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+        # CPU and memory of the REPL processes, sampled off the event loop.
+        self.usage: Usage | None = None
+        # Cgroup of the REPL if enabled, for exact accounting at command boundaries.
+        self.cgroup: ReplCgroup | None = None
+        # How much the last command grew the REPL at its peak, None after a header.
+        self.peak_growth: int | None = None
+
+        # Commands written to the REPL and not answered yet, in order.
+        self._pending: deque[PendingCommand] = deque()
+        self._write_lock = asyncio.Lock()
+        self._reader: asyncio.Task[None] | None = None
+        self._frames: FrameReader | None = None
+        # Stderr, drained continuously so that the REPL never blocks writing to it.
+        self.stderr = StderrRing(settings.STDERR_BUFFER_KB * 1024)
+        self._stderr_task: asyncio.Task[None] | None = None
+        # Commands submitted through `send` / `run_tactic` and not answered yet.
+        self.in_flight = 0
 
     @classmethod
-    async def create(cls, header: str, max_uses: int, max_mem: int) -> "Repl":
+    async def create(
+        cls, header: str, max_uses: int, max_mem: int, prefix_max_bytes: int = 0
+    ) -> "Repl":
         if db.connected:
             record = await prisma.repl.create(
                 data={
@@ -102,6 +197,7 @@ class Repl:
                 header=record.header,
                 max_uses=record.max_uses,
                 max_mem=record.max_mem,
+                prefix_max_bytes=prefix_max_bytes,
             )
         return cls(
             uuid=uuid4(),
@@ -109,24 +205,75 @@ class Repl:
             header=header,
             max_uses=max_uses,
             max_mem=max_mem,
+            prefix_max_bytes=prefix_max_bytes,
         )
 
     @property
-    def exhausted(self) -> bool:
+    def remaining_uses(self) -> int:
         if self.header and not is_blank(self.header):
             # Header does not count towards uses.
-            return self.use_count >= self.max_uses + 1
-        return self.use_count >= self.max_uses
+            return self.max_uses + 1 - self.use_count
+        return self.max_uses - self.use_count
+
+    @property
+    def exhausted(self) -> bool:
+        # Commands in flight will use the REPL too.
+        return self.remaining_uses - self.in_flight <= 0
+
+    def recycle_reason(
+        self, max_rss: int, latency_factor: float, max_age: float
+    ) -> str | None:
+        """
+        Why this REPL should be replaced, if it should: its memory, a regression of
+        its latency over its first commands, or its age. Zero disables a criterion.
+        """
+        if max_rss > 0 and self.mem_per_exec:
+            rss = self.mem_per_exec[max(self.mem_per_exec)]
+            if rss > max_rss:
+                return f"memory {rss / 1024 / 1024:.0f} MB"
+        if latency_factor > 0 and len(self.last_times) == LATENCY_WINDOW:
+            baseline = statistics.median(self.first_times)
+            recent = statistics.median(self.last_times)
+            if recent > latency_factor * baseline:
+                return f"latency {recent:.3f}s vs {baseline:.3f}s"
+        age = time() - self.created_at.timestamp()
+        if max_age > 0 and age > max_age:
+            return f"age {age:.0f}s"
+        return None
+
+    def rebind(self, header: str) -> None:
+        """Targets another header, loaded in-process by the next `Manager.prep`."""
+        self.header = header
+        # Loaded again even if it is the same header: `prep` never skips it.
+        self.loaded_header = None
+        self.header_cmd_response = None
+        if self.prefix_envs is not None:
+            self.prefix_envs.clear()
+        # Commands of another header are no baseline for this one.
+        self.first_times.clear()
+        self.last_times.clear()
 
     async def start(self) -> None:
         # TODO: try/catch this bit and raise as REPL startup error.
         self._loop = asyncio.get_running_loop()
 
+        if settings.CGROUP_PATH and cgroups_available(settings.CGROUP_PATH):
+            self.cgroup = ReplCgroup.create(
+                settings.CGROUP_PATH,
+                f"repl-{self.uuid.hex}",
+                self.max_memory_bytes,
+                settings.CGROUP_CPUS,
+            )
+        cgroup = self.cgroup
+
         def _preexec() -> None:
             import resource
 
-            # Memory limit
-            if platform.system() != "Darwin":  # Only for Linux
+            # Memory limit: of the actual memory in a cgroup, else of the address
+            # space (which Lean reserves generously).
+            if cgroup is not None:
+                cgroup.attach_self()
+            elif platform.system() != "Darwin":  # Only for Linux
                 resource.setrlimit(
                     resource.RLIMIT_AS, (self.max_memory_bytes, self.max_memory_bytes)
                 )
@@ -137,59 +284,35 @@ class Repl:
 
             os.setsid()
 
+        env = (
+            await lake_env(settings.path_to_mathlib)
+            if settings.RESOLVE_LAKE_ENV and settings.path_to_mathlib
+            else None
+        )
+        # Exec'ed directly in the resolved environment: no `lake` process per REPL.
+        command = (
+            [settings.repl_bin_path]
+            if env is not None
+            else ["lake", "env", settings.repl_bin_path]
+        )
         self.proc = await asyncio.create_subprocess_exec(
-            "lake",
-            "env",
-            settings.repl_bin_path,
+            *command,
             cwd=settings.path_to_mathlib,
-            env=os.environ,
+            env=env if env is not None else os.environ,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
             preexec_fn=_preexec,
+            # Large responses (infotrees) are read in few chunks.
+            limit=settings.READ_BUFFER_KB * 1024,
         )
 
-        self._ps_proc = psutil.Process(self.proc.pid)
-        now = self._loop.time()
-        self._last_check = now
-        self._last_cpu_time = self._sum_cpu_times(self._ps_proc)
-
-        self._cpu_max = 0.0
-        self._mem_max = 0
-        self._cpu_task = self._loop.create_task(self._cpu_monitor())
-        self._mem_task = self._loop.create_task(self._mem_monitor())
+        self._frames = None
+        self._stderr_task = self._loop.create_task(self._drain_stderr())
+        self.usage = sampler.register(self.proc.pid)
 
         logger.info(f"\\[{self.uuid.hex[:8]}] Started")
 
-    @staticmethod
-    def _sum_cpu_times(proc: psutil.Process) -> float:
-        total = proc.cpu_times().user + proc.cpu_times().system
-        for c in proc.children(recursive=True):
-            t = c.cpu_times()
-            total += t.user + t.system
-        return float(total)
-
-    async def _cpu_monitor(self) -> None:
-        while self.is_running and self._ps_proc and self._loop:
-            await asyncio.sleep(1)
-            now = self._loop.time()
-
-            cur_cpu = self._sum_cpu_times(self._ps_proc)
-            delta_cpu = cur_cpu - self._last_cpu_time
-            delta_t = now - self._last_check
-            usage_pct = (delta_cpu / delta_t) * 100
-            self._cpu_max = max(self._cpu_max, usage_pct)
-            self._last_cpu_time = cur_cpu
-            self._last_check = now
-
-    async def _mem_monitor(self) -> None:
-        while self.is_running and self._ps_proc:
-            await asyncio.sleep(1)
-            total = self._ps_proc.memory_info().rss
-            for child in self._ps_proc.children(recursive=True):
-                total += child.memory_info().rss
-            self._mem_max = max(self._mem_max, total)
-
     @property
     def is_running(self) -> bool:
         if not self.proc:
@@ -202,7 +325,12 @@ class Repl:
         timeout: float,
         is_header: bool = False,
         infotree: Infotree | None = None,
+        raw: bool = False,
     ) -> CheckResponse:
+        """
+        With `raw`, the response is passed through undecoded (see
+        `CheckResponse.passthrough`) unless the REPL needs it itself.
+        """
         error = None
         cmd_response = None
         elapsed_time = 0.0
@@ -210,7 +338,7 @@ class Repl:
 
         try:
             cmd_response, elapsed_time, diagnostics = await asyncio.wait_for(
-                self.send(snippet, is_header=is_header, infotree=infotree),
+                self.send(snippet, is_header=is_header, infotree=infotree, raw=raw),
                 timeout=timeout,
             )
         except TimeoutError as e:
@@ -227,6 +355,25 @@ class Repl:
             logger.exception("REPL error: %s", e)
             raise e
 
+        if isinstance(cmd_response, bytes):
+            if not protocol.is_error(cmd_response):
+                return CheckResponse.passthrough(
+                    snippet.id,
+                    cmd_response,
+                    elapsed_time,
+                    diagnostics if len(diagnostics) > 0 else None,
+                )
+            cmd_response = protocol.loads(cmd_response)
+        if "env" not in cmd_response:
+            # REPL-level error (e.g. unknown environment), not the result of the code.
+            message = cast(dict[str, Any], cmd_response).get("message", cmd_response)
+            logger.error(f"\\[{self.uuid.hex[:8]}] REPL error: {message}")
+            return CheckResponse(
+                id=snippet.id,
+                error=str(message),
+                time=elapsed_time,
+                diagnostics=diagnostics if len(diagnostics) > 0 else None,
+            )
         return CheckResponse(
             id=snippet.id,
             error=error,
@@ -240,106 +387,400 @@ class Repl:
         snippet: Snippet,
         is_header: bool = False,
         infotree: Infotree | None = None,
-    ) -> tuple[CommandResponse, float, Diagnostics]:
+        raw: bool = False,
+    ) -> tuple[CommandResponse | bytes, float, Diagnostics]:
         await log_snippet(self.uuid, snippet.id, snippet.code)
 
-        self._cpu_max = 0.0
-        self._mem_max = 0
-
-        if not self.proc or self.proc.returncode is not None:
-            logger.error("REPL process not started or shut down")
-            raise ReplError("REPL process not started or shut down")
-
-        loop = self._loop or asyncio.get_running_loop()
+        window = UsageWindow()
+        env = None
+        if self.use_count != 0 and not is_header:  # remove is_header
+            # Always run on the environment of the header (first environment).
+            env = self.header_env if self.header_env is not None else 0
 
-        if self.proc.stdin is None:
-            raise ReplError("stdin pipe not initialized")
-        if self.proc.stdout is None:
-            raise ReplError("stdout pipe not initialized")
+        if self.prefix_envs is not None and not is_header and not infotree:
+            resp, elapsed_time = await self._send_commands(snippet.code, env, window)
+            return resp, elapsed_time, self._record_use(elapsed_time, window)
 
         input: Command = {"cmd": snippet.code}
-
-        if self.use_count != 0 and not is_header:  # remove is_header
-            input["env"] = 0  # Always run on first environment
-
+        if env is not None:
+            input["env"] = env
         if infotree:
             input["infotree"] = infotree
 
-        payload = (json.dumps(input, ensure_ascii=False) + "\n\n").encode("utf-8")
-
-        start = loop.time()
-        logger.debug("Sending payload to REPL")
+        if raw and not is_header:
+            data, elapsed_time = await self._exchange_raw(input, window=window)
+            if not protocol.is_object(data):
+                logger.error("JSON decode error: %r", data)
+                raise ReplError("JSON decode error")
+            return data, elapsed_time, self._record_use(elapsed_time, window)
+
+        resp, elapsed_time = await self._exchange(input, window=window)
+        if is_header:
+            self.header_env = resp.get("env")
+
+        return (
+            resp,
+            elapsed_time,
+            self._record_use(None if is_header else elapsed_time, window),
+        )
 
-        try:
-            self.proc.stdin.write(payload)
-            await self.proc.stdin.drain()
-        except BrokenPipeError:
-            logger.error("Broken pipe while writing to REPL stdin")
-            raise LeanError("Lean process broken pipe")
-        except Exception as e:
-            logger.error("Failed to write to REPL stdin: %s", e)
-            raise LeanError("Failed to write to REPL stdin")
+    async def _send_commands(
+        self, code: str, env: int | None, window: UsageWindow | None = None
+    ) -> tuple[CommandResponse, float]:
+        """
+        Runs `code` one top-level command at a time, resuming from the environment
+        of the longest prefix of commands this REPL has already elaborated.
+        """
+        assert self.prefix_envs is not None
+        commands = split_commands(code)
+        if len(commands) < 2:
+            input: Command = {"cmd": code}
+            if env is not None:
+                input["env"] = env
+            return await self._exchange(input, window=window)
+
+        # The last command (usually the theorem that differs) is never reused.
+        keys: list[str] = []
+        parent = str(env)
+        for _, text in commands[:-1]:
+            # Trailing blank lines do not change the environment.
+            parent = self.prefix_envs.key(parent, text.rstrip())
+            keys.append(parent)
+
+        start, prefix = self.prefix_envs.longest(keys)
+        messages: list[Message] = []
+        sorries: list[Sorry] = []
+        if prefix is not None:
+            logger.debug(
+                f"\\[{self.uuid.hex[:8]}] Resuming after {start} commands (env {prefix.env})"
+            )
+            env = prefix.env
+            messages = shift_messages(prefix.messages, 0)
+            sorries = shift_sorries(prefix.sorries, 0)
 
-        logger.debug("Reading response from REPL stdout")
-        raw = await self._read_response()
-        elapsed = loop.time() - start
+        elapsed_time = 0.0
+        for i in range(start, len(commands)):
+            line, text = commands[i]
+            input = {"cmd": text}
+            if env is not None:
+                input["env"] = env
+            rss = self._rss()
+            resp, elapsed = await self._exchange(input, window=window)
+            elapsed_time += elapsed
+            if "env" not in resp:
+                # REPL-level error (e.g. unknown environment): reported as is.
+                return resp, round(elapsed_time, 6)
+
+            env = resp["env"]
+            messages += shift_messages(resp.get("messages", []), line)
+            sorries += shift_sorries(resp.get("sorries", []), line)
+            if i < len(keys):
+                self.prefix_envs.put(
+                    keys[i],
+                    PrefixEnv(
+                        env, list(messages), list(sorries), max(self._rss() - rss, 0)
+                    ),
+                )
 
-        logger.debug("Raw response from REPL: %r", raw)
+        assert env is not None
+        result: CommandResponse = {"env": env}
+        if messages:
+            result["messages"] = messages
+        if sorries:
+            result["sorries"] = sorries
+        return result, round(elapsed_time, 6)
+
+    def memory(self) -> ProcessMemory:
+        """USS and PSS of the REPL, which unlike RSS do not double count shared pages."""
+        if self.usage is None:
+            return {"uss": 0, "pss": 0}
+        return {"uss": self.usage.uss, "pss": self.usage.pss}
+
+    async def measure_memory(self) -> ProcessMemory:
+        """
+        `memory()` measured now, off the event loop: the sampler has no reading yet
+        right after a start, and an outdated one right after a header load.
+        """
+        if self.proc is None or self.proc.returncode is not None:
+            return {"uss": 0, "pss": 0}
         try:
-            resp: CommandResponse = json.loads(raw)
-        except json.JSONDecodeError:
-            logger.error("JSON decode error: %r", raw)
-            raise ReplError("JSON decode error")
+            proc = psutil.Process(self.proc.pid)
+        except psutil.Error:
+            return {"uss": 0, "pss": 0}
+        return await asyncio.to_thread(process_memory, proc)
+
+    def _rss(self) -> int:
+        return self.usage.current_rss() if self.usage is not None else 0
+
+    async def pickle_env(self, path: str, timeout: float) -> None:
+        """Pickles the environment of the header to `path` (an `.olean` file)."""
+        if self.header_env is None:
+            raise ReplError("No header environment to pickle")
+        input: PickleEnv = {"pickleTo": path, "env": self.header_env}
+        resp, _ = await asyncio.wait_for(self._exchange(input), timeout=timeout)
+        if "env" not in resp:
+            raise ReplError(f"Failed to pickle environment: {resp}")
+
+    async def unpickle_env(self, path: str, timeout: float) -> CheckResponse:
+        """Restores the header environment from a pickle instead of running the header."""
+        window = UsageWindow()
+        input: UnpickleEnv = {"unpickleEnvFrom": path}
+        resp, elapsed_time = await asyncio.wait_for(
+            self._exchange(input, window=window), timeout=timeout
+        )
+        if "env" not in resp:
+            raise ReplError(f"Failed to unpickle environment: {resp}")
+        self.header_env = resp["env"]
 
-        self.error_file.seek(0)
-        err = self.error_file.read().strip()
-        self.error_file.seek(0)
-        self.error_file.truncate(0)
-        if err:
-            logger.error("Stderr: %s", err)
-            raise LeanError(err)
+        return CheckResponse(
+            id="unpickle",
+            response=resp,
+            time=elapsed_time,
+            diagnostics=self._record_use(None, window),
+        )
 
-        elapsed_time = round(elapsed, 6)
+    async def run_tactic(
+        self, step: ProofStep, timeout: float
+    ) -> tuple[ProofStepResponse, float, Diagnostics]:
+        """Runs a tactic script against a proof state of this REPL."""
+        window = UsageWindow()
+        self.in_flight += 1
+        try:
+            resp, elapsed_time = await self._exchange(step, timeout, window)
+            return (
+                cast(ProofStepResponse, resp),
+                elapsed_time,
+                self._record_use(elapsed_time, window),
+            )
+        finally:
+            self.in_flight -= 1
+
+    def _begin_usage(self, window: UsageWindow) -> None:
+        """When the REPL starts running a command: restarts the peaks if first."""
+        if window.started_at is not None:
+            return
+        if self.usage is not None:
+            self.usage.reset()
+        window.rss_start = self._rss()
+        window.started_at = time()
+        window.stderr_start = self.stderr.total
+        if self.cgroup is not None:
+            try:
+                window.cgroup_start = self.cgroup.begin()
+            except OSError:
+                window.cgroup_start = None
+
+    def _end_usage(self, window: UsageWindow, pipelined: bool) -> None:
+        """
+        When the REPL answers a command, before the next one (`pipelined`) starts
+        and restarts the peaks.
+        """
+        cpu_max = self.usage.cpu_max if self.usage is not None else 0.0
+        mem_max = self.usage.mem_max if self.usage is not None else 0
+        if self.cgroup is not None and window.cgroup_start is not None:
+            # Exact, even for commands shorter than the sampling interval.
+            try:
+                cpu, peak = self.cgroup.command_usage(
+                    window.cgroup_start, time() - (window.started_at or time())
+                )
+                cpu_max = max(cpu_max, cpu)
+                mem_max = peak or mem_max
+            except OSError:
+                pass
+        window.cpu_max = cpu_max
+        window.mem_max = mem_max
+        # Peaks are sampled every SAMPLE_INTERVAL: short commands also get a reading
+        # of the memory left behind (Lean keeps every environment).
+        window.rss = max(mem_max, self._rss())
+        window.stderr_end = self.stderr.total if pipelined else None
+
+    def _record_use(
+        self, elapsed_time: float | None, window: UsageWindow
+    ) -> Diagnostics:
+        """`elapsed_time` is None for header loads, which are no latency reference."""
         diagnostics: Diagnostics = {
             "repl_uuid": str(self.uuid),
-            "cpu_max": self._cpu_max,
-            "memory_max": self._mem_max,
+            "cpu_max": window.cpu_max,
+            "memory_max": window.mem_max,
         }
 
-        self.cpu_per_exec[self.use_count] = self._cpu_max
-        self.mem_per_exec[self.use_count] = self._mem_max
+        stderr = self.stderr.since(window.stderr_start, window.stderr_end).strip()
+        if stderr:
+            diagnostics["stderr"] = stderr
+
+        self.cpu_per_exec[self.use_count] = window.cpu_max
+        rss = window.rss
+        self.mem_per_exec[self.use_count] = rss
+        self.peak_growth = None
+        if elapsed_time is not None:
+            self.peak_growth = max(rss - window.rss_start, 0)
+            if len(self.first_times) < LATENCY_WINDOW:
+                self.first_times.append(elapsed_time)
+            else:
+                self.last_times.append(elapsed_time)
 
         self.use_count += 1
-        return resp, elapsed_time, diagnostics
+        self.last_used_at = time()
+        return diagnostics
+
+    async def _exchange(
+        self,
+        input: Command | PickleEnv | UnpickleEnv | ProofStep,
+        timeout: float | None = None,
+        window: UsageWindow | None = None,
+    ) -> tuple[CommandResponse, float]:
+        """Writes a command and waits for its decoded response (see `_exchange_raw`)."""
+        raw, elapsed = await self._exchange_raw(input, timeout, window)
+        try:
+            resp: CommandResponse = protocol.loads(raw)
+        except ValueError:
+            logger.error("JSON decode error: %r", raw)
+            raise ReplError("JSON decode error")
+        return resp, elapsed
+
+    async def _exchange_raw(
+        self,
+        input: Command | PickleEnv | UnpickleEnv | ProofStep,
+        timeout: float | None = None,
+        window: UsageWindow | None = None,
+    ) -> tuple[bytes, float]:
+        """
+        Writes a command and waits for its response. Commands are pipelined: the
+        next one is written while the REPL still runs the previous ones, and the
+        elapsed time, `timeout` and the usage accounted to `window` count from when
+        the REPL starts running it.
+        """
+        if not self.proc or self.proc.returncode is not None:
+            logger.error("REPL process not started or shut down")
+            raise ReplError("REPL process not started or shut down")
+
+        loop = self._loop or asyncio.get_running_loop()
+
+        if self.proc.stdin is None:
+            raise ReplError("stdin pipe not initialized")
+        if self.proc.stdout is None:
+            raise ReplError("stdout pipe not initialized")
+
+        payload = protocol.dumps(input) + b"\n\n"
+
+        command = PendingCommand(loop, window)
+        async with self._write_lock:
+            if not self._pending:
+                self._start(command, loop.time())
+            self._pending.append(command)
+            logger.debug("Sending payload to REPL")
+            try:
+                self.proc.stdin.write(payload)
+                await self.proc.stdin.drain()
+            except BrokenPipeError:
+                logger.error("Broken pipe while writing to REPL stdin")
+                self._pending.remove(command)
+                raise self._lean_error("Lean process broken pipe")
+            except Exception as e:
+                logger.error("Failed to write to REPL stdin: %s", e)
+                self._pending.remove(command)
+                raise LeanError("Failed to write to REPL stdin")
+        if self._reader is None or self._reader.done():
+            self._reader = loop.create_task(self._read_loop())
+
+        # Shielded: a caller giving up must not break the matching of later responses.
+        start = await asyncio.shield(command.started)
+        raw, end = await asyncio.wait_for(asyncio.shield(command.response), timeout)
+        elapsed = end - start
+
+        logger.debug("Raw response from REPL: %r", raw)
+        return raw, round(elapsed, 6)
+
+    def _start(self, command: PendingCommand, now: float) -> None:
+        """The REPL starts running `command`: its usage is accounted from now on."""
+        if command.window is not None:
+            self._begin_usage(command.window)
+        command.started.set_result(now)
+
+    def _lean_error(self, message: str) -> LeanError:
+        """A `LeanError` with what the REPL last wrote to stderr, often the cause."""
+        tail = self.stderr.tail().strip()[-STDERR_IN_ERRORS:]
+        if tail:
+            logger.error(f"\\[{self.uuid.hex[:8]}] Stderr: {tail}")
+            return LeanError(f"{message}: {tail}")
+        return LeanError(message)
+
+    async def _drain_stderr(self) -> None:
+        if not self.proc or self.proc.stderr is None:
+            return
+        try:
+            while chunk := await self.proc.stderr.read(1 << 16):
+                self.stderr.append(chunk)
+        except Exception as e:
+            logger.error(f"\\[{self.uuid.hex[:8]}] Failed to read REPL stderr: {e}")
+
+    async def _read_loop(self) -> None:
+        """Matches responses to the pending commands, in the order they were written."""
+        loop = self._loop or asyncio.get_running_loop()
+        error: Exception = LeanError("REPL process exited")
+        try:
+            while True:
+                raw = await self._read_response()
+                if not raw:
+                    if self._pending:
+                        # Let the drainer catch up with the last words of the REPL.
+                        if self._stderr_task is not None:
+                            await asyncio.wait([self._stderr_task], timeout=1)
+                        error = self._lean_error("REPL process exited")
+                    break
+                now = loop.time()
+                if not self._pending:
+                    logger.error(f"\\[{self.uuid.hex[:8]}] Unexpected output: {raw!r}")
+                    continue
+                command = self._pending.popleft()
+                if command.window is not None:
+                    self._end_usage(command.window, pipelined=bool(self._pending))
+                if not command.response.done():
+                    command.response.set_result((raw, now))
+                if self._pending and not self._pending[0].started.done():
+                    self._start(self._pending[0], now)
+        except Exception as e:
+            error = e
+        finally:
+            while self._pending:
+                command = self._pending.popleft()
+                for future in (command.started, command.response):
+                    if not future.done():
+                        future.set_exception(error)
+                        # Retrieved here: no caller may be waiting anymore.
+                        future.exception()
 
     async def _read_response(self) -> bytes:
+        """Reads one response, up to its terminating blank line. Empty at EOF."""
         if not self.proc or self.proc.stdout is None:
             logger.error("REPL process not started or stdout pipe not initialized")
             raise ReplError("REPL process not started or stdout pipe not initialized")
 
-        lines: list[bytes] = []
+        if self._frames is None:
+            self._frames = FrameReader(self.proc.stdout, settings.READ_BUFFER_KB * 1024)
         try:
-            while True:
-                chunk = await self.proc.stdout.readline()
-                # EOF or blank line as terminator
-                if not chunk or not chunk.strip():
-                    break
-                lines.append(chunk)
+            return await self._frames.read_frame()
         except Exception as e:
             logger.error("Failed to read from REPL stdout: %s", e)
             raise LeanError("Failed to read from REPL stdout")
-        return b"".join(lines)
 
     async def close(self) -> None:
         if self.proc:
             assert self.proc.stdin is not None, "stdin pipe not initialized"
             self.proc.stdin.close()
-            os.killpg(os.getpgid(self.proc.pid), signal.SIGKILL)
+            try:
+                os.killpg(os.getpgid(self.proc.pid), signal.SIGKILL)
+            except ProcessLookupError:
+                pass  # Already exited (crashed or OOM-killed)
             await self.proc.wait()
-            if self._cpu_task:
-                self._cpu_task.cancel()
-            if self._mem_task:
-                self._mem_task.cancel()
+            if self.usage is not None:
+                sampler.unregister(self.usage)
+            if self.cgroup is not None:
+                self.cgroup.remove()
+            if self._reader:
+                self._reader.cancel()
+            if self._stderr_task:
+                self._stderr_task.cancel()
 
             if db.connected:
                 await prisma.repl.update(
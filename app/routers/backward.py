@@ -1,12 +1,65 @@
+from typing import AsyncIterator
+
 from fastapi import APIRouter, Depends
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
 
+from app import protocol
+from app.cache import Flights, ResultCache
 from app.manager import Manager
-from app.routers.check import get_manager, run_checks
-from app.schemas import BackwardResponse, Snippet, VerifyRequestBody, VerifyResponse
+from app.routers.check import (
+    get_cache,
+    get_flights,
+    get_manager,
+    iter_checks,
+    json_array,
+    json_response,
+    run_checks,
+)
+from app.schemas import (
+    BackwardResponse,
+    CheckResponse,
+    Snippet,
+    VerifyRequestBody,
+    VerifyResponse,
+)
+from app.settings import settings
 
 router = APIRouter()
 
 
+def to_snippets(body: VerifyRequestBody) -> list[Snippet]:
+    return [
+        Snippet(id=str(code.custom_id), code=code.get_proof_content() or "no-id")
+        for code in body.codes
+    ]
+
+
+def to_backward(resp: CheckResponse) -> BackwardResponse:
+    response = None
+    if resp.response is not None:
+        response = dict(resp.response)
+        response["time"] = resp.time
+
+    return BackwardResponse(
+        custom_id=resp.id,
+        error=resp.error,
+        response=response,
+    )
+
+
+_backward = TypeAdapter(BackwardResponse)
+
+
+def backward_json(resp: CheckResponse) -> bytes:
+    """JSON of `to_backward(resp)` without None values (see `CheckResponse.to_json`)."""
+    data = _backward.dump_json(to_backward(resp), exclude_none=True)
+    if resp.raw is None:
+        return data
+    response = protocol.splice(resp.raw, "time", protocol.dumps(resp.time))
+    return protocol.splice(data, "response", response)
+
+
 @router.post(
     "/one_pass_verify_batch",
     response_model=VerifyResponse,
@@ -16,15 +69,13 @@ router = APIRouter()
 async def one_pass_verify_batch(
     body: VerifyRequestBody,
     manager: Manager = Depends(get_manager),
+    cache: ResultCache | None = Depends(get_cache),
+    flights: Flights = Depends(get_flights),
     # access: require_access_dep, # TODO: later implement authentication
-) -> VerifyResponse:
+) -> Response:
     """Backward compatible endpoint: accepts both 'proof' / 'code' fields."""
 
-    codes = body.codes
-    snippets = [
-        Snippet(id=str(code.custom_id), code=code.get_proof_content() or "no-id")
-        for code in codes
-    ]
+    snippets = to_snippets(body)
 
     timeout = body.timeout
     debug = False
@@ -32,22 +83,46 @@ async def one_pass_verify_batch(
     infotree = body.infotree_type
 
     checks_response = await run_checks(
-        snippets, float(timeout), debug, manager, reuse, infotree
+        snippets,
+        float(timeout),
+        debug,
+        manager,
+        reuse,
+        infotree,
+        cache if not body.disable_cache else None,
+        raw=settings.PASSTHROUGH_RESPONSES,
+        flights=flights if not body.disable_cache else None,
     )
 
-    results: list[BackwardResponse] = []
+    results = json_array(backward_json(resp) for resp in checks_response)
+    return json_response(b'{"results":' + results + b"}")
 
-    for resp in checks_response:
-        response = None
-        if resp.response is not None:
-            response = dict(resp.response)
-            response["time"] = resp.time
 
-        result = BackwardResponse(
-            custom_id=resp.id,
-            error=resp.error,
-            response=response,
-        )
-        results.append(result)
+@router.post(
+    "/verify/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def one_pass_verify_batch_stream(
+    body: VerifyRequestBody,
+    manager: Manager = Depends(get_manager),
+    cache: ResultCache | None = Depends(get_cache),
+    flights: Flights = Depends(get_flights),
+) -> StreamingResponse:
+    """Streaming `/verify`: one result per line (NDJSON) as soon as each proof is checked."""
+
+    async def lines() -> AsyncIterator[bytes]:
+        async for _, resp in iter_checks(
+            to_snippets(body),
+            float(body.timeout),
+            False,
+            manager,
+            not body.disable_cache,
+            body.infotree_type,
+            cache if not body.disable_cache else None,
+            raw=settings.PASSTHROUGH_RESPONSES,
+            flights=flights if not body.disable_cache else None,
+        ):
+            yield backward_json(resp) + b"\n"
 
-    return VerifyResponse(results=results)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
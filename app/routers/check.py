@@ -1,16 +1,24 @@
 import asyncio
 import json
-from typing import cast
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, Iterable, cast
+from uuid import uuid4
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from loguru import logger
 
 from app.auth import require_key
+from app.cache import Flights, ResultCache
 from app.db import db
 from app.errors import NoAvailableReplError
+from app.infotrees import InfotreeStore, select
 from app.manager import Manager
+from app.packing import Pack, make_packs
 from app.prisma_client import prisma
+from app.scheduler import schedule
 from app.schemas import CheckRequest, CheckResponse, ChecksRequest, Infotree, Snippet
+from app.settings import settings
 from app.split import split_snippet
 
 router = APIRouter()
@@ -21,24 +29,134 @@ def get_manager(request: Request) -> Manager:
     return cast(Manager, request.app.state.manager)
 
 
-async def run_checks(
+def get_cache(request: Request) -> ResultCache | None:
+    """Dependency: retrieve the result cache from app state (None if disabled)"""
+    return cast(ResultCache | None, getattr(request.app.state, "cache", None))
+
+
+def get_flights(request: Request) -> Flights:
+    """Dependency: retrieve the table of running checks from app state"""
+    return cast(Flights, request.app.state.flights)
+
+
+def get_infotrees(request: Request) -> InfotreeStore | None:
+    """Dependency: retrieve the infotree store from app state (None if disabled)"""
+    return cast(InfotreeStore | None, getattr(request.app.state, "infotrees", None))
+
+
+def json_response(content: bytes) -> Response:
+    """
+    Serialized results are returned as is: FastAPI would validate them against the
+    `response_model` and serialize them again.
+    """
+    return Response(content, media_type="application/json")
+
+
+def json_array(items: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(items) + b"]"
+
+
+def log_result(resp: CheckResponse) -> str:
+    if resp.raw is not None:
+        return resp.to_json().decode("utf-8", errors="replace")
+    return json.dumps(resp.model_dump(exclude_none=True), indent=2)
+
+
+async def iter_checks(
     snippets: list[Snippet],
     timeout: float,
     debug: bool,
     manager: Manager,
     reuse: bool,
     infotree: Infotree | None = None,
-) -> list[CheckResponse]:
+    cache: ResultCache | None = None,
+    pack: int = 0,
+    raw: bool = False,
+    infotrees: InfotreeStore | None = None,
+    flights: Flights | None = None,
+) -> AsyncGenerator[tuple[int, CheckResponse]]:
+    """
+    Yields `(index, response)` for each snippet as soon as its check completes.
+    With `pack` > 1, small snippets of a header are run up to `pack` at a time in
+    a single REPL command (see `Pack`). With `raw`, REPL responses are passed
+    through undecoded (see `CheckResponse.passthrough`) where the server does not
+    process them: serialize the results with `CheckResponse.to_json`. With
+    `infotrees`, infotrees are stored there and responses carry their handle. With
+    `flights`, identical snippets checked concurrently are run once.
+    """
+
+    async def detach_infotree(resp: CheckResponse) -> CheckResponse:
+        if (
+            infotrees is None
+            or infotree is None
+            or resp.error
+            or resp.infotree_handle is not None
+        ):
+            return resp
+        data = resp.response_json()
+        if data is None:
+            return resp
+        # Off the event loop: the infotree is decoded, encoded and compressed.
+        response, handle = await asyncio.to_thread(infotrees.detach, data)
+        if handle is None:
+            return resp
+        return CheckResponse(
+            id=resp.id,
+            time=resp.time,
+            response=response,
+            diagnostics=resp.diagnostics,
+            infotree_handle=handle,
+        )
+
     async def run_one(snippet: Snippet) -> CheckResponse:
         header, body = split_snippet(snippet.code)
+        if cache is None:
+            return await run_uncached(snippet, header, body, None)
+
+        key = cache.key(header, body, infotree)
+        cached = await cache.get(key, snippet.id, raw)
+        if cached is not None:
+            return await detach_infotree(cached)
+        return await run_uncached(snippet, header, body, key)
+
+    async def run_uncached(
+        snippet: Snippet, header: str, body: str, key: str | None
+    ) -> CheckResponse:
+        if flights is None:
+            return await check(snippet, header, body, key)
+        # Keyed on the timeout too: a check that timed out says nothing of a longer one.
+        # And on the form of the response, which coalesced checks share: `check` strips
+        # the diagnostics of the leader unless debugging.
+        form = (
+            (":raw" if raw else "")
+            + (":handle" if infotrees is not None else "")
+            + (":debug" if debug else "")
+        )
+        resp = await flights.single_flight(
+            f"{flights.key(header, body, infotree)}:{timeout}{form}",
+            snippet.id,
+            lambda: check(snippet, header, body, key),
+        )
+        if not debug:
+            resp.diagnostics = None
+        return resp
+
+    async def check(
+        snippet: Snippet,
+        header: str,
+        body: str,
+        key: str | None = None,
+        decode: bool = False,
+    ) -> CheckResponse:
+        # Failures are reported per snippet: they must not abort the rest of the batch.
         try:
             repl = await manager.get_repl(header, snippet.id, reuse=reuse)
         except NoAvailableReplError:
             logger.exception("No available REPLs")
-            raise HTTPException(429, "No available REPLs") from None
+            return CheckResponse(id=snippet.id, error="No available REPLs")
         except Exception as e:
             logger.exception("Failed to get REPL: %s", e)
-            raise HTTPException(500, str(e)) from e
+            return CheckResponse(id=snippet.id, error=str(e))
 
         try:
             prep = await manager.prep(repl, snippet.id, timeout, debug)
@@ -68,14 +186,21 @@ async def run_checks(
                     "repl_uuid": uuid_hex,
                 },
             )
+        except asyncio.CancelledError:
+            # Client went away mid-command: the REPL state is unknown.
+            await manager.destroy_repl(repl)
+            raise
         except Exception as e:
             logger.error("REPL prep failed")
             await manager.destroy_repl(repl)
-            raise HTTPException(500, str(e)) from e
+            return CheckResponse(id=snippet.id, error=str(e))
 
         try:
             resp = await repl.send_timeout(
-                Snippet(id=snippet.id, code=body), timeout, infotree=infotree
+                Snippet(id=snippet.id, code=body),
+                timeout,
+                infotree=infotree,
+                raw=raw and not decode,
             )
         except TimeoutError as e:
             error = f"Lean REPL command timed out in {timeout} seconds"
@@ -101,18 +226,25 @@ async def run_checks(
                     "repl_uuid": uuid_hex,
                 },
             )
+        except asyncio.CancelledError:
+            await manager.destroy_repl(repl)
+            raise
         except Exception as e:
             logger.exception("Snippet execution failed")
             await manager.destroy_repl(repl)
-            raise HTTPException(500, str(e)) from e
+            return CheckResponse(id=snippet.id, error=str(e))
         else:
+            await manager.release_repl(repl)
+            if cache is not None and key is not None:
+                await cache.put(key, resp)
+            # The cache keeps the infotree: hits are detached again, to the same handle.
+            resp = await detach_infotree(resp)
             logger.info(
                 "[{}] Result for [bold magenta]{}[/bold magenta] body →\n{}",
                 repl.uuid.hex[:8],
                 snippet.id,
-                json.dumps(resp.model_dump(exclude_none=True), indent=2),
+                log_result(resp),
             )
-            await manager.release_repl(repl)
             if db.connected:
                 await prisma.proof.create(
                     data={
@@ -121,9 +253,7 @@ async def run_checks(
                         "diagnostics": json.dumps(
                             resp.diagnostics if resp.diagnostics else None
                         ),
-                        "response": json.dumps(
-                            resp.response if resp.response else None
-                        ),
+                        "response": (resp.response_json() or b"null").decode(),
                         "time": resp.time,
                         "error": resp.error,
                         "repl": {
@@ -135,7 +265,146 @@ async def run_checks(
                 resp.diagnostics = None
             return resp
 
-    return await asyncio.gather(*(run_one(s) for s in snippets))
+    async def run_pack(pack: Pack) -> list[tuple[int, CheckResponse]]:
+        if len(pack) == 1:
+            index, snippet, _ = pack.items[0]
+            return [(index, await run_one(snippet))]
+
+        results: list[tuple[int, CheckResponse]] = []
+        keys: dict[int, str | None] = {}
+        pending = Pack(pack.header)
+        for index, snippet, body in pack.items:
+            keys[index] = key = (
+                cache.key(pack.header, body, infotree) if cache is not None else None
+            )
+            cached = (
+                await cache.get(key, snippet.id, raw)
+                if cache is not None and key is not None
+                else None
+            )
+            if cached is not None:
+                results.append((index, cached))
+            else:
+                pending.add(index, snippet, body)
+        return results + await run_packed(pending, keys)
+
+    async def run_packed(
+        pending: Pack, keys: dict[int, str | None]
+    ) -> list[tuple[int, CheckResponse]]:
+        if len(pending) < 2:
+            return [
+                (index, await run_uncached(snippet, pending.header, body, keys[index]))
+                for index, snippet, body in pending.items
+            ]
+
+        code = pending.code()
+        # Decoded: the response of the pack is split into those of its snippets.
+        packed = await check(
+            Snippet(id=f"pack-{uuid4().hex[:8]}", code=code),
+            pending.header,
+            code,
+            decode=True,
+        )
+        splits, failed = (
+            pending.split(packed.response)
+            if packed.response is not None and not packed.error
+            else ([], 0)
+        )
+        results: list[tuple[int, CheckResponse]] = []
+        for k, (index, snippet, body) in enumerate(pending.items[:failed]):
+            resp = CheckResponse(
+                id=snippet.id,
+                time=round(packed.time / len(pending), 6),
+                response=splits[k],
+                diagnostics=packed.diagnostics,
+            )
+            key = keys[index]
+            if cache is not None and key is not None:
+                await cache.put(key, resp)
+            results.append((index, resp))
+        if failed == len(pending):
+            return results
+
+        # The first failing snippet is checked on its own, so that its errors are
+        # exactly those of an unpacked run, and the snippets after it are packed again.
+        index, snippet, body = pending.items[failed]
+        results.append(
+            (index, await run_uncached(snippet, pending.header, body, keys[index]))
+        )
+        rest = Pack(pending.header)
+        for index, snippet, body in pending.items[failed + 1 :]:
+            rest.add(index, snippet, body)
+        if packed.error:
+            # The pack as a whole failed (e.g. timed out): no more packing.
+            return results + [
+                (index, await run_uncached(snippet, rest.header, body, keys[index]))
+                for index, snippet, body in rest.items
+            ]
+        return results + await run_packed(rest, keys)
+
+    if pack > 1 and infotree is None:
+        async with aclosing(
+            schedule(
+                make_packs(list(enumerate(snippets)), pack),
+                lambda p: p.header,
+                run_pack,
+                concurrency=manager.max_repls,
+                on_error=lambda p, e: [
+                    (index, CheckResponse(id=snippet.id, error=str(e)))
+                    for index, snippet, _ in p.items
+                ],
+            )
+        ) as packs:
+            async for _, results in packs:
+                for i, resp in results:
+                    yield i, resp
+        return
+
+    # The batch is admitted as a whole and fed to the pool at its capacity, grouped by
+    # header, instead of every snippet competing for a REPL at once.
+    # Closed with the caller's iteration: its workers must not outlive it.
+    async with aclosing(
+        schedule(
+            snippets,
+            lambda s: split_snippet(s.code)[0],
+            run_one,
+            concurrency=manager.max_repls,
+            on_error=lambda s, e: CheckResponse(id=s.id, error=str(e)),
+        )
+    ) as checks:
+        async for i, resp in checks:
+            yield i, resp
+
+
+async def run_checks(
+    snippets: list[Snippet],
+    timeout: float,
+    debug: bool,
+    manager: Manager,
+    reuse: bool,
+    infotree: Infotree | None = None,
+    cache: ResultCache | None = None,
+    pack: int = 0,
+    raw: bool = False,
+    infotrees: InfotreeStore | None = None,
+    flights: Flights | None = None,
+) -> list[CheckResponse]:
+    results: list[CheckResponse | None] = [None] * len(snippets)
+    async for i, resp in iter_checks(
+        snippets,
+        timeout,
+        debug,
+        manager,
+        reuse,
+        infotree,
+        cache,
+        pack,
+        raw,
+        infotrees,
+        flights,
+    ):
+        results[i] = resp
+    return cast(list[CheckResponse], results)
 
 
 @router.post(
@@ -152,15 +421,57 @@ async def run_checks(
 async def check_batch(
     request: ChecksRequest,
     manager: Manager = Depends(get_manager),
-) -> list[CheckResponse]:
-    return await run_checks(
+    cache: ResultCache | None = Depends(get_cache),
+    infotrees: InfotreeStore | None = Depends(get_infotrees),
+    flights: Flights = Depends(get_flights),
+) -> Response:
+    results = await run_checks(
         request.snippets,
         float(request.timeout),
         request.debug,
         manager,
         request.reuse,
         request.infotree,
+        cache if request.cache else None,
+        request.pack,
+        settings.PASSTHROUGH_RESPONSES,
+        infotrees if request.infotree_handle else None,
+        flights if request.cache else None,
     )
+    return json_response(json_array(resp.to_json() for resp in results))
+
+
+@router.post(
+    "/checks/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def check_batch_stream(
+    request: ChecksRequest,
+    manager: Manager = Depends(get_manager),
+    cache: ResultCache | None = Depends(get_cache),
+    infotrees: InfotreeStore | None = Depends(get_infotrees),
+    flights: Flights = Depends(get_flights),
+) -> StreamingResponse:
+    """Streams one `CheckResponse` per line (NDJSON) as soon as each snippet is checked."""
+
+    async def lines() -> AsyncIterator[bytes]:
+        async for _, resp in iter_checks(
+            request.snippets,
+            float(request.timeout),
+            request.debug,
+            manager,
+            request.reuse,
+            request.infotree,
+            cache if request.cache else None,
+            request.pack,
+            settings.PASSTHROUGH_RESPONSES,
+            infotrees if request.infotree_handle else None,
+            flights if request.cache else None,
+        ):
+            yield resp.to_json() + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @router.post(
@@ -177,8 +488,11 @@ async def check_batch(
 async def check_single(
     request: CheckRequest,
     manager: Manager = Depends(get_manager),
+    cache: ResultCache | None = Depends(get_cache),
+    infotrees: InfotreeStore | None = Depends(get_infotrees),
+    flights: Flights = Depends(get_flights),
     _: str = Depends(require_key),
-) -> CheckResponse:
+) -> Response:
     resp_list = await run_checks(
         [request.snippet],
         float(request.timeout),
@@ -186,5 +500,37 @@ async def check_single(
         manager,
         request.reuse,
         request.infotree,
+        cache if request.cache else None,
+        raw=settings.PASSTHROUGH_RESPONSES,
+        infotrees=infotrees if request.infotree_handle else None,
+        flights=flights if request.cache else None,
     )
-    return resp_list[0]
+    return json_response(resp_list[0].to_json())
+
+
+@router.get(
+    "/infotrees/{handle}",
+    response_class=Response,
+    responses={200: {"content": {"application/json": {}}}},
+)
+async def get_infotree(
+    handle: str,
+    path: str = Query(
+        "",
+        description="Subtree to return: list indices and keys separated by `/`, "
+        "e.g. `0/children/2`",
+    ),
+    infotrees: InfotreeStore | None = Depends(get_infotrees),
+) -> Response:
+    """Info tree stored for a check with `infotree_handle`, or one of its subtrees."""
+    data = await asyncio.to_thread(infotrees.get, handle) if infotrees else None
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Infotree {handle} not found")
+    if path:
+        try:
+            data = await asyncio.to_thread(select, data, path)
+        except LookupError:
+            raise HTTPException(
+                status_code=404, detail=f"No subtree {path} in infotree {handle}"
+            )
+    return json_response(data)
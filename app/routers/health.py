@@ -1,4 +1,12 @@
-from fastapi import APIRouter
+import asyncio
+from typing import Any
+
+from fastapi import APIRouter, Depends
+
+from app.cache import Flights, ResultCache
+from app.infotrees import InfotreeStore
+from app.manager import Manager
+from app.routers.check import get_cache, get_flights, get_infotrees, get_manager
 
 router = APIRouter()
 
@@ -13,3 +21,21 @@ async def read_root() -> dict[str, str]:
 @router.get("/health/", include_in_schema=False)
 async def get_health() -> dict[str, str]:
     return {"status": "ok"}
+
+
+@router.get("/stats")
+@router.get("/stats/", include_in_schema=False)
+async def get_stats(
+    manager: Manager = Depends(get_manager),
+    cache: ResultCache | None = Depends(get_cache),
+    infotrees: InfotreeStore | None = Depends(get_infotrees),
+    flights: Flights = Depends(get_flights),
+) -> dict[str, Any]:
+    return {
+        "pool": manager.stats(),
+        "cache": cache.stats() if cache is not None else None,
+        "flights": flights.stats(),
+        "infotrees": (
+            await asyncio.to_thread(infotrees.stats) if infotrees is not None else None
+        ),
+    }
@@ -0,0 +1,71 @@
+import asyncio
+from typing import cast
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+
+from app.jobs import JobRunner
+from app.routers.check import json_array, json_response
+from app.schemas import ChecksRequest, Job, JobResults
+
+router = APIRouter()
+
+
+def get_jobs(request: Request) -> JobRunner:
+    """Dependency: retrieve the job runner from app state"""
+    return cast(JobRunner, request.app.state.jobs)
+
+
+async def find_job(job_id: str, jobs: JobRunner) -> Job:
+    job = await asyncio.to_thread(jobs.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.post(
+    "/jobs",
+    response_model=Job,
+    response_model_exclude_none=True,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+@router.post(
+    "/jobs/",
+    response_model=Job,
+    response_model_exclude_none=True,
+    status_code=status.HTTP_202_ACCEPTED,
+    include_in_schema=False,  # To not clutter OpenAPI spec.
+)
+async def submit_job(
+    request: ChecksRequest, jobs: JobRunner = Depends(get_jobs)
+) -> Job:
+    """Queues a batch of snippets: poll the returned job until it is `done`."""
+    return await jobs.submit(request)
+
+
+@router.get("/jobs/{job_id}", response_model=Job, response_model_exclude_none=True)
+async def get_job(job_id: str, jobs: JobRunner = Depends(get_jobs)) -> Job:
+    return await find_job(job_id, jobs)
+
+
+@router.get(
+    "/jobs/{job_id}/results",
+    response_model=JobResults,
+    response_model_exclude_none=True,
+)
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0, description="Submission index of the first snippet"),
+    limit: int = Query(100, ge=1, le=1000, description="Number of snippets"),
+    jobs: JobRunner = Depends(get_jobs),
+) -> Response:
+    """Pages through a job's results; snippets not checked yet are left out."""
+    job = await find_job(job_id, jobs)
+    # Stored serialized (`CheckResponse.to_json`): returned as is.
+    results = await asyncio.to_thread(jobs.store.results_json, job_id, offset, limit)
+    return json_response(
+        b'{"job":'
+        + job.model_dump_json(exclude_none=True).encode("utf-8")
+        + b',"results":'
+        + json_array(results)
+        + b"}"
+    )
@@ -0,0 +1,240 @@
+import asyncio
+import textwrap
+from collections import deque
+from typing import Any, TypeAlias, cast
+
+from fastapi import APIRouter, Depends
+from loguru import logger
+
+from app.errors import NoAvailableReplError
+from app.manager import Manager
+from app.repl import Repl
+from app.routers.check import get_manager
+from app.schemas import (
+    CheckResponse,
+    Diagnostics,
+    ProofStep,
+    ProofStepResponse,
+    Snippet,
+    TacticResponse,
+    TacticsRequest,
+    TacticsResponse,
+)
+from app.settings import settings
+from app.split import split_snippet
+
+router = APIRouter()
+
+TacticResult: TypeAlias = tuple[ProofStepResponse, float, Diagnostics]
+
+
+def is_complete(resp: ProofStepResponse) -> bool:
+    errors = [m for m in resp.get("messages", []) if m["severity"] == "error"]
+    return not resp["goals"] and not errors and not resp.get("sorries")
+
+
+def proof_state(statement: CheckResponse) -> tuple[int | None, str | None]:
+    """The proof state of the statement's single `sorry`, or why there is none."""
+    if statement.error or statement.response is None:
+        return None, statement.error or "Statement failed to elaborate"
+    messages = statement.response.get("messages", [])
+    if any(m["severity"] == "error" for m in messages):
+        return None, "Statement failed to elaborate"
+    sorries = statement.response.get("sorries", [])
+    if len(sorries) != 1:
+        return None, f"Statement must have a single `sorry`, found {len(sorries)}"
+    state = sorries[0].get("proofState")
+    if state is None:
+        return None, "The REPL returned no proof state for the `sorry`"
+    return state, None
+
+
+async def run_tactics(
+    request: TacticsRequest, manager: Manager, pipeline_depth: int = 1
+) -> TacticsResponse:
+    """
+    Elaborates the statement once per REPL, then runs the tactic scripts against the
+    proof state of its `sorry`. Scripts are spread over up to `MAX_REPLS` REPLs, with
+    up to `pipeline_depth` scripts written to each REPL at a time.
+    """
+    header, body = split_snippet(request.statement.code)
+    timeout = float(request.timeout)
+    attempts = deque(enumerate(request.tactics))
+    results: list[TacticResponse | None] = [None] * len(request.tactics)
+    statement: CheckResponse | None = None
+    # Why the statement cannot be proved in tactic mode, ends all workers.
+    failure: str | None = None
+    # Last error that ended a single worker, reported on scripts left unrun.
+    worker_error: str | None = None
+
+    async def elaborate(repl: Repl) -> tuple[int | None, bool]:
+        """The proof state of the statement, and whether the REPL is still alive."""
+        nonlocal statement, failure
+        prep = await manager.prep(repl, request.statement.id, timeout, request.debug)
+        if prep and prep.error:
+            # `prep` destroyed the REPL.
+            resp, alive = prep, False
+        else:
+            resp = await repl.send_timeout(
+                Snippet(id=request.statement.id, code=body), timeout
+            )
+            alive = True
+        if statement is None:
+            statement = resp
+        state, error = proof_state(resp)
+        if error is not None:
+            failure = error
+        return state, alive
+
+    def requeue(
+        in_flight: deque[tuple[int, Snippet, asyncio.Task[TacticResult]]],
+    ) -> None:
+        while in_flight:
+            i, attempt, task = in_flight.pop()
+            task.cancel()
+            attempts.appendleft((i, attempt))
+
+    async def worker() -> None:
+        nonlocal worker_error
+        repl: Repl | None = None
+        state = 0
+        in_flight: deque[tuple[int, Snippet, asyncio.Task[TacticResult]]] = deque()
+        # Whether the REPL was just elaborated: with MAX_USES=1 the statement takes
+        # its only use, and it still runs a script, or none ever would.
+        elaborated_now = False
+        try:
+            while (attempts or in_flight) and failure is None:
+                if repl is None:
+                    try:
+                        repl = await manager.get_repl(
+                            header, request.statement.id, reuse=request.reuse
+                        )
+                    except NoAvailableReplError:
+                        # The other workers go on with the REPLs they hold.
+                        worker_error = "No available REPLs"
+                        return
+                    try:
+                        elaborated, alive = await elaborate(repl)
+                    except Exception as e:
+                        logger.exception("Statement elaboration failed")
+                        worker_error = (
+                            f"Statement timed out in {timeout} seconds"
+                            if isinstance(e, TimeoutError)
+                            else str(e)
+                        )
+                        await manager.destroy_repl(repl)
+                        repl = None
+                        return
+                    if elaborated is None:
+                        if not alive:
+                            repl = None
+                        return
+                    state = elaborated
+                    elaborated_now = True
+
+                # Keep the REPL busy: the next scripts are written while it runs one.
+                while (
+                    attempts
+                    and len(in_flight) < pipeline_depth
+                    and (
+                        repl.remaining_uses > len(in_flight)
+                        or (elaborated_now and repl.max_uses <= 1 and not in_flight)
+                    )
+                ):
+                    i, attempt = attempts.popleft()
+                    step: ProofStep = {
+                        "proofState": state,
+                        "tactic": textwrap.dedent(attempt.code),
+                    }
+                    task = asyncio.create_task(repl.run_tactic(step, timeout))
+                    in_flight.append((i, attempt, task))
+                elaborated_now = False
+
+                if not in_flight:
+                    # The statement took the last use of a reused REPL: on to another.
+                    await manager.release_repl(repl)
+                    repl = None
+                    continue
+
+                i, attempt, task = in_flight.popleft()
+                try:
+                    resp, elapsed, diagnostics = await task
+                except Exception as e:
+                    # The REPL may be stuck mid-tactic: replace it, and run the
+                    # scripts queued behind this one on the next REPL.
+                    error = (
+                        f"Tactic timed out in {timeout} seconds"
+                        if isinstance(e, TimeoutError)
+                        else str(e)
+                    )
+                    results[i] = TacticResponse(id=attempt.id, error=error)
+                    requeue(in_flight)
+                    await manager.destroy_repl(repl)
+                    repl = None
+                    continue
+
+                if "proofState" not in resp:
+                    # Lean errors in tactic mode come back as a bare `message`.
+                    error = str(cast(dict[str, Any], resp).get("message", resp))
+                    results[i] = TacticResponse(
+                        id=attempt.id, time=elapsed, error=error
+                    )
+                else:
+                    results[i] = TacticResponse(
+                        id=attempt.id,
+                        time=elapsed,
+                        complete=is_complete(resp),
+                        response=resp,
+                        diagnostics=diagnostics if request.debug else None,
+                    )
+                if repl.exhausted and not in_flight:
+                    await manager.release_repl(repl)
+                    repl = None
+        except asyncio.CancelledError:
+            requeue(in_flight)
+            if repl is not None:
+                await manager.destroy_repl(repl)
+                repl = None
+            raise
+        finally:
+            if repl is not None:
+                await manager.release_repl(repl)
+
+    workers = max(1, min(manager.max_repls, len(request.tactics)))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+    if statement is None:
+        statement = CheckResponse(
+            id=request.statement.id,
+            error=failure or worker_error or "Statement was not run",
+        )
+    elif not request.debug:
+        statement.diagnostics = None
+    return TacticsResponse(
+        statement=statement,
+        results=[
+            r
+            or TacticResponse(
+                id=t.id, error=failure or worker_error or "Tactic was not run"
+            )
+            for r, t in zip(results, request.tactics)
+        ],
+    )
+
+
+@router.post(
+    "/tactics",
+    response_model=TacticsResponse,
+    response_model_exclude_none=True,
+)
+@router.post(
+    "/tactics/",
+    response_model=TacticsResponse,
+    response_model_exclude_none=True,
+    include_in_schema=False,  # To not clutter OpenAPI spec.
+)
+async def check_tactics(
+    request: TacticsRequest,
+    manager: Manager = Depends(get_manager),
+) -> TacticsResponse:
+    return await run_tactics(request, manager, settings.PIPELINE_DEPTH)
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from time import monotonic, perf_counter
+from typing import TypedDict
+
+import psutil
+from loguru import logger
+
+from app.memory import process_memory, smaps_rollup
+from app.settings import settings
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class SamplerStats(TypedDict):
+    interval: float
+    repls: int
+    passes: int
+    last_pass: float  # Seconds the last pass took
+    overhead: float  # Share of wall time spent sampling
+
+
+class Usage:
+    """
+    Resource usage of the process group of a REPL, published by the sampler.
+    Peaks are kept both since the start of the current command and for the REPL.
+    """
+
+    __slots__ = (
+        "pgid",
+        "pids",
+        "cpu",
+        "cpu_max",
+        "peak_cpu",
+        "rss",
+        "mem_max",
+        "peak_mem",
+        "uss",
+        "pss",
+        "_cpu_time",
+        "_sampled_at",
+    )
+
+    def __init__(self, pgid: int) -> None:
+        self.pgid = pgid
+        self.pids: list[int] = [pgid]
+        self.cpu = 0.0  # Percentage of a single core
+        self.cpu_max = 0.0
+        self.peak_cpu = 0.0
+        self.rss = 0
+        self.mem_max = 0
+        self.peak_mem = 0
+        self.uss = 0
+        self.pss = 0
+        self._cpu_time: float | None = None
+        self._sampled_at = 0.0
+
+    def reset(self) -> None:
+        """Starts the peaks of a new command."""
+        self.cpu_max = 0.0
+        self.mem_max = 0
+
+    def current_rss(self) -> int:
+        """RSS of the group now: reads the known pids of the group only, no walk."""
+        total = 0
+        for pid in self.pids:
+            try:
+                with open(f"/proc/{pid}/statm", "rb") as f:
+                    total += int(f.read().split()[1]) * PAGE_SIZE
+            except (OSError, ValueError, IndexError):
+                return self.rss
+        return total
+
+    def update(
+        self, cpu_time: float, rss: int, now: float, pids: list[int] | None = None
+    ) -> None:
+        if pids is not None:
+            self.pids = pids
+        if self._cpu_time is not None and now > self._sampled_at:
+            self.cpu = (cpu_time - self._cpu_time) / (now - self._sampled_at) * 100
+            self.cpu_max = max(self.cpu_max, self.cpu)
+            self.peak_cpu = max(self.peak_cpu, self.cpu)
+        self._cpu_time = cpu_time
+        self._sampled_at = now
+        self.rss = rss
+        self.mem_max = max(self.mem_max, rss)
+        self.peak_mem = max(self.peak_mem, rss)
+
+
+class Sampler:
+    """
+    Samples CPU and memory of every REPL from one worker thread, so that the
+    event loop never blocks on `/proc`. On Linux, each pass reads
+    `/proc/<pid>/stat` once for all processes and sums them per REPL process
+    group; elsewhere it falls back to psutil.
+    """
+
+    def __init__(self, interval: float, pss: bool = False) -> None:
+        self.interval = interval
+        # Also read USS and PSS (costlier), for the memory budget.
+        self.pss = pss
+
+        self._groups: dict[int, Usage] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+        self.passes = 0
+        self.last_pass = 0.0
+        self._busy_time = 0.0
+        self._started_at = 0.0
+
+    def register(self, pgid: int, start: bool = True) -> Usage:
+        """Samples the process group `pgid`, from now on if `start` (see `start`)."""
+        usage = Usage(pgid)
+        with self._lock:
+            self._groups[pgid] = usage
+        if start:
+            self.start()
+        return usage
+
+    def start(self) -> None:
+        """Starts the worker thread, unless running."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._started_at = monotonic()
+                self._thread = threading.Thread(
+                    target=self._run, name="repl-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def unregister(self, usage: Usage) -> None:
+        with self._lock:
+            if self._groups.get(usage.pgid) is usage:
+                del self._groups[usage.pgid]
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            start = perf_counter()
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"[Sampler] Sampling pass failed: {e}")
+            self.last_pass = perf_counter() - start
+            self._busy_time += self.last_pass
+            self.passes += 1
+
+    def sample(self) -> None:
+        """One pass over all registered REPLs."""
+        with self._lock:
+            groups = dict(self._groups)
+        if not groups:
+            return
+        if sys.platform == "linux":
+            self._sample_proc(groups)
+        else:
+            self._sample_psutil(groups)
+
+    def _sample_proc(self, groups: dict[int, Usage]) -> None:
+        totals: dict[int, tuple[float, int, list[int]]] = {}
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue  # Exited meanwhile
+            # The command name may contain spaces and parentheses.
+            fields = stat[stat.rindex(b")") + 2 :].split()
+            pgid = int(fields[2])
+            if pgid not in groups:
+                continue
+            cpu_time, rss, pids = totals.get(pgid, (0.0, 0, []))
+            cpu_time += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            rss += int(fields[21]) * PAGE_SIZE
+            pids.append(int(entry.name))
+            totals[pgid] = (cpu_time, rss, pids)
+
+        now = monotonic()
+        for pgid, (cpu_time, rss, pids) in totals.items():
+            usage = groups[pgid]
+            usage.update(cpu_time, rss, now, pids)
+            if self.pss:
+                uss = pss = 0
+                for pid in pids:
+                    measured = smaps_rollup(pid)
+                    if measured is not None:
+                        uss += measured["uss"]
+                        pss += measured["pss"]
+                usage.uss, usage.pss = uss, pss
+
+    def _sample_psutil(self, groups: dict[int, Usage]) -> None:
+        for pgid, usage in groups.items():
+            try:
+                proc = psutil.Process(pgid)
+                procs = [proc, *proc.children(recursive=True)]
+                cpu_time = 0.0
+                rss = 0
+                for p in procs:
+                    times = p.cpu_times()
+                    cpu_time += times.user + times.system
+                    rss += p.memory_info().rss
+            except psutil.Error:
+                continue
+            usage.update(cpu_time, rss, monotonic(), [p.pid for p in procs])
+            if self.pss:
+                memory = process_memory(proc)
+                usage.uss, usage.pss = memory["uss"], memory["pss"]
+
+    def stats(self) -> SamplerStats:
+        elapsed = monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "interval": self.interval,
+            "repls": len(self._groups),
+            "passes": self.passes,
+            "last_pass": self.last_pass,
+            "overhead": self._busy_time / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+sampler = Sampler(settings.SAMPLE_INTERVAL, pss=settings.MEMORY_BUDGET_MB > 0)
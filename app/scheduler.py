@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, Awaitable, Callable, Generic, Sequence, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class HeaderGroups(Generic[T]):
+    """Pending items of a batch, grouped by header in submission order."""
+
+    def __init__(self, items: Sequence[T], group: Callable[[T], str]) -> None:
+        self._groups: dict[str, deque[tuple[int, T]]] = {}
+        for i, item in enumerate(items):
+            self._groups.setdefault(group(item), deque()).append((i, item))
+
+    def pop(self, preferred: str | None = None) -> tuple[str, int, T] | None:
+        """
+        Next item of the `preferred` header (the one the worker's REPL has loaded),
+        or else of the largest remaining group.
+        """
+        if preferred is None or preferred not in self._groups:
+            if not self._groups:
+                return None
+            preferred = max(self._groups, key=lambda h: len(self._groups[h]))
+        queue = self._groups[preferred]
+        i, item = queue.popleft()
+        if not queue:
+            del self._groups[preferred]
+        return preferred, i, item
+
+
+async def schedule(
+    items: Sequence[T],
+    group: Callable[[T], str],
+    run: Callable[[T], Awaitable[R]],
+    concurrency: int,
+    on_error: Callable[[T, Exception], R],
+) -> AsyncGenerator[tuple[int, R]]:
+    """
+    Runs a whole batch with at most `concurrency` items in flight, and yields
+    `(index, result)` pairs as soon as each item completes.
+
+    Workers stick to one header as long as it has pending items, so that REPLs
+    released by a worker are reused by the next item of the same header.
+    An exception raised by `run` is turned into the result of its item by `on_error`,
+    so that it does not abort the rest of the batch.
+    """
+    groups = HeaderGroups(items, group)
+    results: asyncio.Queue[tuple[int, R]] = asyncio.Queue()
+
+    async def worker() -> None:
+        header: str | None = None
+        while (next_item := groups.pop(header)) is not None:
+            header, i, item = next_item
+            try:
+                result = await run(item)
+            except Exception as e:
+                logger.exception(f"Item {i} of the batch failed")
+                result = on_error(item, e)
+            results.put_nowait((i, result))
+
+    workers = [
+        asyncio.create_task(worker())
+        for _ in range(max(1, min(concurrency, len(items))))
+    ]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for w in workers:
+            w.cancel()
@@ -1,6 +1,15 @@
-from typing import Any, Literal, NotRequired, Type, TypeAlias, TypedDict
+from typing import Any, Literal, NotRequired, Type, TypeAlias, TypedDict, cast
 
-from pydantic import BaseModel, ConfigDict, Field, model_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    PrivateAttr,
+    ValidationInfo,
+    model_validator,
+)
+
+from app import protocol
 
 Infotree: TypeAlias = Literal["original", "synthetic"]
 
@@ -49,6 +58,15 @@ class Command(TypedDict):
     infotree: NotRequired[Infotree]
 
 
+class PickleEnv(TypedDict):
+    pickleTo: str
+    env: int
+
+
+class UnpickleEnv(TypedDict):
+    unpickleEnvFrom: str
+
+
 class Pos(TypedDict):
     line: int
     column: int
@@ -86,6 +104,7 @@ class Diagnostics(TypedDict, total=False):
     repl_uuid: str
     cpu_max: float
     memory_max: float
+    stderr: str  # What the REPL wrote to stderr during the command
 
 
 class CommandResponse(TypedDict):
@@ -96,6 +115,13 @@ class CommandResponse(TypedDict):
     infotree: NotRequired[Any]
 
 
+class ProofStepResponse(TypedDict):
+    proofState: int
+    goals: list[str]
+    messages: NotRequired[list[Message]]
+    sorries: NotRequired[list[Sorry]]
+
+
 from typing import TypeVar
 
 T = TypeVar("T", bound="CheckRequest")
@@ -109,18 +135,63 @@ class CheckResponse(BaseModel):
     error: str | None = None
     response: CommandResponse | None = None
     diagnostics: Diagnostics | None = None
+    infotree_handle: str | None = Field(
+        default=None,
+        description="Handle of the info tree, left out of `response`, to fetch it "
+        "with `GET /api/infotrees/{handle}`",
+    )
+
+    # JSON of the REPL response, when passed through undecoded (`response` is None).
+    _raw: bytes | None = PrivateAttr(None)
 
     @model_validator(mode="before")
     @classmethod
     def require_error_or_response(
-        cls: Type[U], values: dict[str, Any]
+        cls: Type[U], values: dict[str, Any], info: ValidationInfo
     ) -> dict[str, Any]:
-        if not (values.get("error") or values.get("response")):
+        passthrough = info.context is not None and info.context.get("passthrough")
+        if not (values.get("error") or values.get("response") or passthrough):
             raise ValueError("either `error` or `response` must be set")
         return values
 
-
-class BaseRequest(BaseModel):
+    @classmethod
+    def passthrough(
+        cls,
+        id: str,
+        raw: bytes,
+        time: float = 0.0,
+        diagnostics: Diagnostics | None = None,
+    ) -> "CheckResponse":
+        """
+        A response carrying the JSON of the REPL response as is: it is neither
+        decoded nor validated, only spliced into the output by `to_json`.
+        """
+        resp = cls.model_validate(
+            {"id": id, "time": time, "diagnostics": diagnostics},
+            context={"passthrough": True},
+        )
+        resp._raw = raw
+        return resp
+
+    @property
+    def raw(self) -> bytes | None:
+        return self._raw
+
+    def response_json(self) -> bytes | None:
+        """JSON of the REPL response, whether passed through or decoded."""
+        if self._raw is not None:
+            return self._raw
+        return protocol.dumps(self.response) if self.response is not None else None
+
+    def to_json(self) -> bytes:
+        """The JSON of `model_dump_json(exclude_none=True)`, on a single line."""
+        data = self.model_dump_json(exclude_none=True).encode("utf-8")
+        if self._raw is None:
+            return data
+        return protocol.splice(data, "response", self._raw)
+
+
+class ReplRequest(BaseModel):
     timeout: int = Field(
         30, description="Maximum time in seconds before aborting the check", ge=0
     )
@@ -130,16 +201,32 @@ class BaseRequest(BaseModel):
     reuse: bool = Field(
         True, description="Whether to attempt using a REPL if available"
     )
+
+
+class BaseRequest(ReplRequest):
+    cache: bool = Field(
+        True, description="Whether to return the cached result of an identical snippet"
+    )
     infotree: Infotree | None = Field(
         None,
         description="Level of detail for the info tree: 'original' | 'synthetic'",
     )
+    infotree_handle: bool = Field(
+        False,
+        description="Store the info tree server-side and return a handle to fetch it "
+        "with `GET /api/infotrees/{handle}`, instead of the info tree itself",
+    )
 
 
 class ChecksRequest(BaseRequest):
     snippets: list[Snippet] = Field(
         description="List of snippets to validate (batch or single element)"
     )
+    pack: int = Field(
+        0,
+        description="Run up to this many small snippets of a header in one REPL command",
+        ge=0,
+    )
 
     @model_validator(mode="before")
     @classmethod
@@ -192,3 +279,87 @@ class CheckRequest(BaseRequest):
             },
         }
     )
+
+
+JobStatus: TypeAlias = Literal["queued", "running", "done", "failed"]
+
+
+class Job(BaseModel):
+    id: str = Field(..., description="Identifier to poll the job with")
+    status: JobStatus
+    total: int = Field(..., description="Number of snippets in the job")
+    done: int = Field(default=0, description="Number of snippets already checked")
+    created_at: float
+    error: str | None = Field(default=None, description="Why the job failed as a whole")
+
+
+class JobResults(BaseModel):
+    job: Job
+    results: list[CheckResponse] = Field(
+        description="Checked snippets of the requested page, in submission order"
+    )
+
+
+V = TypeVar("V", bound="TacticsRequest")
+
+
+class TacticResponse(BaseModel):
+    id: str = Field(..., description="Identifier of the tactic script")
+    time: float = 0.0
+    error: str | None = None
+    complete: bool | None = Field(
+        default=None,
+        description="No goals left, without errors nor `sorry` (not a kernel check)",
+    )
+    response: ProofStepResponse | None = None
+    diagnostics: Diagnostics | None = None
+
+
+class TacticsRequest(ReplRequest):
+    statement: Snippet = Field(
+        description="Theorem statement with a single `sorry`, elaborated once"
+    )
+    tactics: list[Snippet] = Field(
+        description="Tactic scripts to run against the proof state of the `sorry`"
+    )
+
+    @model_validator(mode="before")
+    @classmethod
+    def check_tactics(cls: Type[V], values: dict[str, Any]) -> dict[str, Any]:
+        # Options of /check(s) that tactic scripts do not support.
+        for name in ("cache", "infotree", "infotree_handle"):
+            if name in values:
+                raise ValueError(f"`{name}` is not supported by /tactics")
+        arr = values.get("tactics")
+        if not arr:
+            raise ValueError("`tactics` must be provided and non empty")
+        ids: list[Any] = [
+            cast(dict[str, Any], t).get("id") if isinstance(t, dict) else None
+            for t in arr
+        ]
+        if None in ids:
+            raise ValueError("`tactics[].id` is required")
+        if len(set(ids)) != len(ids):
+            raise ValueError("`tactics` must have unique ids")
+        return values
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "statement": {
+                    "id": "add-comm",
+                    "code": "import Mathlib\ntheorem t (a b : Nat) : a + b = b + a := by\n  sorry",
+                },
+                "tactics": [
+                    {"id": "omega", "code": "omega"},
+                    {"id": "simp", "code": "simp [Nat.add_comm]"},
+                ],
+                "timeout": 20,
+            },
+        }
+    )
+
+
+class TacticsResponse(BaseModel):
+    statement: CheckResponse = Field(description="Result of elaborating the statement")
+    results: list[TacticResponse] = Field(description="One result per tactic script")
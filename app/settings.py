@@ -1,6 +1,6 @@
 import os
 import re
-from typing import cast
+from typing import Literal, cast
 
 from pydantic import Field, field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -18,6 +18,85 @@ class Settings(BaseSettings):
         default_factory=lambda: {"import Mathlib\nimport Aesop": 1}
     )
     MAX_WAIT: int = 60
+    # Number of started, header-loaded idle REPLs to keep per header.
+    SPARE_REPLS: dict[str, int] = Field(default_factory=dict)
+    # Reallocate MAX_REPLS across headers according to their recent demand.
+    AUTOSCALE: bool = False
+    AUTOSCALE_INTERVAL: int = 30
+    AUTOSCALE_WINDOW: int = 300
+    AUTOSCALE_MIN_WARM: int = 1
+    # Load another header into an idle REPL instead of killing it when the pool is full.
+    REBIND_REPLS: bool = True
+    # Which idle REPL to evict when the pool is full: oldest, lru, lfu or cost.
+    EVICTION_POLICY: Literal["oldest", "lru", "lfu", "cost"] = "oldest"
+
+    # In-process cache of REPL results, 0 entries disables it.
+    CACHE_MAX_ENTRIES: int = 10_000
+    CACHE_MAX_MB: int = 512
+    # SQLite file shared by all workers of the host to persist the cache, None disables it.
+    CACHE_DB_PATH: str | None = None
+    CACHE_DB_MAX_MB: int = 8192
+    CACHE_DB_MMAP_MB: int = 256
+    CACHE_DB_COMPACT_INTERVAL: int = 600
+
+    # Directory of pickled header environments, None disables header pickling.
+    PICKLE_DIR: str | None = None
+
+    # Per-REPL budget of reused command prefix environments, 0 disables prefix reuse.
+    PREFIX_CACHE_MB: int = 0
+
+    # Tactic scripts written ahead to a REPL while it runs one, 1 disables pipelining.
+    # Snippets of /check(s) are not pipelined: each holds its REPL.
+    PIPELINE_DEPTH: int = 2
+
+    # Recycle a REPL (replacement started first) once its RSS exceeds this many MB,
+    # once the median latency of its last commands exceeds this factor times that of
+    # its first commands, or once it is older than this many seconds. 0 disables each.
+    RECYCLE_MEM_MB: int = 0
+    RECYCLE_LATENCY_FACTOR: float = 0.0
+    RECYCLE_MAX_AGE: int = 0
+
+    # Resolve the `lake env` environment once and exec the REPL binary directly in it,
+    # rather than through `lake env` for every REPL.
+    RESOLVE_LAKE_ENV: bool = True
+
+    # Chunk size (and stream buffer limit) of the reader of REPL responses, in KiB.
+    READ_BUFFER_KB: int = 1024
+
+    # Stderr kept per REPL (the latest output), reported in diagnostics and errors.
+    STDERR_BUFFER_KB: int = 64
+
+    # Splice the JSON of REPL responses into HTTP responses as is, rather than
+    # decoding, validating and serializing it again, unless the server processes it.
+    PASSTHROUGH_RESPONSES: bool = True
+
+    # Store of the info trees of requests with `infotree_handle` (compressed, the oldest
+    # dropped beyond INFOTREE_STORE_MB, 0 disables it). None keeps it in memory: set a
+    # SQLite file for all workers of the host to share it.
+    INFOTREE_DB_PATH: str | None = None
+    INFOTREE_STORE_MB: int = 1024
+
+    # Delegated cgroup v2 directory to run each REPL in its own cgroup, capping its
+    # actual memory to MAX_MEM (instead of its address space) and, if CGROUP_CPUS is
+    # set, its CPU to that many cores. None (or an unusable directory) uses rlimits.
+    CGROUP_PATH: str | None = None
+    CGROUP_CPUS: float = 0
+
+    # Seconds between two passes of the CPU and memory sampler of all REPLs.
+    SAMPLE_INTERVAL: float = 1.0
+
+    # Host-wide memory budget of all REPLs (PSS), on top of MAX_REPLS. 0 disables it.
+    MEMORY_BUDGET_MB: int = 0
+    # Memory reserved for a command of a header whose commands were never measured.
+    MEMORY_RESERVE_MB: int = 1024
+
+    # SQLite file of the job queue, shared by all workers of the host and resumed after
+    # a restart. ":memory:" keeps a queue private to each worker, lost on restart.
+    JOBS_DB_PATH: str = ":memory:"
+    # Seconds finished jobs and their results are kept for.
+    JOBS_RETENTION: int = 86400
+    # Seconds without a heartbeat after which a running job of a dead worker is resumed.
+    JOBS_LEASE: int = 60
 
     DATABASE_USER: str = "root"
     DATABASE_PASSWORD: str = "root"
@@ -49,3 +49,98 @@ def split_snippet(code: str) -> Tuple[str, str]:
     header = "\n".join(result_header)
     body = "\n".join(body_lines)
     return header, body
+
+
+# Keywords that start a top-level command, possibly after modifiers and attributes.
+COMMAND_KEYWORDS = {
+    "abbrev",
+    "attribute",
+    "axiom",
+    "class",
+    "def",
+    "end",
+    "example",
+    "inductive",
+    "instance",
+    "lemma",
+    "mutual",
+    "namespace",
+    "noncomputable",
+    "open",
+    "opaque",
+    "private",
+    "protected",
+    "section",
+    "set_option",
+    "structure",
+    "theorem",
+    "universe",
+    "variable",
+}
+
+
+def _keyword(line: str) -> str | None:
+    """First word of an unindented line."""
+    if not line or line[0].isspace():
+        return None
+    return line.split(maxsplit=1)[0]
+
+
+def _starts_command(line: str) -> bool:
+    if not line or line[0].isspace():
+        return False
+    if line.startswith(("@[", "/--", "#")):
+        return True
+    return _keyword(line) in COMMAND_KEYWORDS
+
+
+def _is_modifier(line: str) -> bool:
+    """Whether a line ends with `in`, scoping it to the next command (`open Nat in`)."""
+    code = line.split("--", 1)[0].rstrip()
+    return code == "in" or code.endswith((" in", "\tin"))
+
+
+def _only_prefixes(line: str) -> bool:
+    """Whether an unindented line only holds a doc comment or attributes (no declaration)."""
+    if line.startswith("/--"):
+        end = line.find("-/", 3)
+        return end < 0 or not line[end + 2 :].strip()
+    if line.startswith("@["):
+        end = line.find("]")
+        return end < 0 or not line[end + 1 :].strip()
+    return False
+
+
+def split_commands(body: str) -> list[tuple[int, str]]:
+    """
+    Splits a snippet body into its top-level commands, as `(first line index, text)`.
+
+    A command starts at an unindented line opening with a command keyword, an
+    attribute, a doc comment or a `#` command. Doc comments, attributes and
+    commands ending with `in` (`set_option ... in`) stay with the command they
+    precede, a `mutual ... end` block is a single command, and block comments are
+    never split. Joining the texts with newlines gives back the body.
+    """
+    commands: list[tuple[int, list[str]]] = []
+    comment_depth = 0
+    # Whether the current command only holds prefixes of the next one so far.
+    pending = False
+    mutual = False
+
+    for i, line in enumerate(body.splitlines()):
+        if comment_depth == 0 and not mutual and _starts_command(line):
+            if pending and commands:
+                commands[-1][1].append(line)
+            else:
+                commands.append((i, [line]))
+            pending = _only_prefixes(line) or _is_modifier(line)
+            mutual = _keyword(line) == "mutual"
+        elif commands:
+            commands[-1][1].append(line)
+            if mutual and comment_depth == 0 and _keyword(line) == "end":
+                mutual = False
+        else:
+            commands.append((i, [line]))
+        comment_depth = max(comment_depth + line.count("/-") - line.count("-/"), 0)
+
+    return [(i, "\n".join(lines)) for i, lines in commands]
@@ -2,6 +2,7 @@ import asyncio
 import difflib
 import importlib
 import json
+from pathlib import Path
 from typing import Any, Literal
 
 import pytest
@@ -18,9 +19,10 @@ from app.settings import Settings
         {"MAX_REPLS": 5, "MAX_USES": 10, "INIT_REPLS": {}, "DATABASE_URL": None},
     ]
 )
-def client(request: FixtureRequest) -> TestClient:
+def client(request: FixtureRequest, tmp_path: Path) -> TestClient:
     overrides = getattr(request, "param", {})
     s = Settings(_env_file=None)
+    s.JOBS_DB_PATH = str(tmp_path / "jobs.sqlite")
     for k, v in overrides.items():
         setattr(s, k, v)
     app = create_app(s)
@@ -34,9 +36,10 @@ def client(request: FixtureRequest) -> TestClient:
         {"MAX_REPLS": 5, "MAX_USES": 10, "INIT_REPLS": {}, "DATABASE_URL": None},
     ]
 )
-def root_client(request: FixtureRequest) -> TestClient:
+def root_client(request: FixtureRequest, tmp_path: Path) -> TestClient:
     overrides = getattr(request, "param", {})
     s = Settings(_env_file=None)
+    s.JOBS_DB_PATH = str(tmp_path / "jobs.sqlite")
     for k, v in overrides.items():
         setattr(s, k, v)
     app = create_app(s)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+import pytest
+from loguru import logger
+from pydantic import TypeAdapter
+
+from app import protocol
+from app.protocol import FrameReader
+from app.routers.check import json_array
+from app.schemas import CheckResponse
+
+# Raw REPL outputs (responses separated by blank lines) to benchmark on, e.g.
+# recorded with `tee` on the REPL stdout. A synthetic infotree is used if empty.
+RECORDINGS = Path(__file__).parent / "recordings"
+
+
+def synthetic_output(nodes: int) -> bytes:
+    """An infotree-sized response, pretty-printed like the REPL prints it."""
+
+    def node(i: int) -> dict[str, Any]:
+        return {
+            "node": {
+                "stx": {"pp": f"exact foo_{i} (bar {i})", "range": [i, i + 20]},
+                "goalsBefore": [f"x : ℕ\n⊢ x + {i} = {i} + x"],
+                "goalsAfter": [],
+            },
+            "kind": "TacticInfo",
+            "children": [],
+        }
+
+    resp = {"env": 1, "infotree": [node(i) for i in range(nodes)]}
+    return json.dumps(resp, indent=2, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+async def readline_frames(stream: asyncio.StreamReader) -> bytes:
+    """The former reader: `readline` until a blank line."""
+    lines: list[bytes] = []
+    while True:
+        chunk = await stream.readline()
+        if not chunk:
+            break
+        if not chunk.strip():
+            if lines:
+                break
+            continue
+        lines.append(chunk)
+    return b"".join(lines)
+
+
+async def throughput(
+    output: bytes,
+    read: Callable[[asyncio.StreamReader], Awaitable[bytes]],
+    decode: Callable[[bytes], Any],
+    limit: int,
+) -> float:
+    """MB/s of reading and decoding all responses of `output`."""
+    stream = asyncio.StreamReader(limit=limit)
+    stream.feed_data(output)
+    stream.feed_eof()
+    start = perf_counter()
+    while frame := await read(stream):
+        decode(frame)
+    return len(output) / (perf_counter() - start) / 1e6
+
+
+@pytest.mark.perfs
+@pytest.mark.asyncio
+async def test_parse_throughput() -> None:
+    outputs = {p.name: p.read_bytes() for p in sorted(RECORDINGS.glob("*"))}
+    if not outputs:
+        outputs["synthetic"] = synthetic_output(50_000)
+    limit = 1 << 20
+
+    for name, output in outputs.items():
+        frames = FrameReader(asyncio.StreamReader(), limit)
+
+        async def read_frame(stream: asyncio.StreamReader) -> bytes:
+            frames.stream = stream
+            return await frames.read_frame()
+
+        before = await throughput(output, readline_frames, json.loads, limit)
+        after = await throughput(output, read_frame, protocol.loads, limit)
+        logger.info(
+            f"{name} ({len(output) / 1e6:.1f} MB): readline + json {before:.0f} MB/s, "
+            f"frames + {protocol.JSON_LIBRARY} {after:.0f} MB/s"
+        )
+        assert after >= before * 0.9
+
+
+def decoded(frames: list[bytes]) -> bytes:
+    """The former path: decode, validate, then serialize like FastAPI's `response_model`."""
+    results = [
+        CheckResponse(id=str(i), time=0.1, response=protocol.loads(frame))
+        for i, frame in enumerate(frames)
+    ]
+    adapter = TypeAdapter(list[CheckResponse])
+    return adapter.dump_json(adapter.validate_python(results), exclude_none=True)
+
+
+def passthrough(frames: list[bytes]) -> bytes:
+    return json_array(
+        CheckResponse.passthrough(str(i), frame, 0.1).to_json()
+        for i, frame in enumerate(frames)
+    )
+
+
+@pytest.mark.perfs
+def test_serialization_cost() -> None:
+    message = {
+        "severity": "info",
+        "pos": {"line": 1, "column": 0},
+        "endPos": {"line": 1, "column": 6},
+        "data": "Nat : Type",
+    }
+    small = json.dumps({"env": 0, "messages": [message]}, indent=2).encode()
+    batches = {
+        "small x 1000": [small] * 1000,
+        "infotree x 10": [synthetic_output(5_000).strip()] * 10,
+    }
+    for p in sorted(RECORDINGS.glob("*")):
+        batches[p.name] = [
+            f for f in p.read_bytes().split(protocol.FRAME_END) if f.strip()
+        ]
+
+    for name, frames in batches.items():
+        # Microseconds per result, best of a few runs.
+        costs: dict[str, float] = {}
+        for serialize in (decoded, passthrough):
+            for _ in range(5):
+                start = perf_counter()
+                body = serialize(frames)
+                cost = (perf_counter() - start) / len(frames) * 1e6
+                costs[serialize.__name__] = min(
+                    costs.get(serialize.__name__, cost), cost
+                )
+            assert json.loads(body)[0]["id"] == "0"
+        logger.info(
+            f"{name}: decoded + {protocol.JSON_LIBRARY} {costs['decoded']:.0f} µs/result, "
+            f"passthrough {costs['passthrough']:.0f} µs/result"
+        )
+        assert costs["passthrough"] <= costs["decoded"] * 1.1
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from statistics import mean, median
+from time import perf_counter
+from uuid import uuid4
+
+import pytest
+from loguru import logger
+
+from app.repl import Repl
+from app.schemas import Snippet
+from app.settings import settings
+
+
+async def _spawn_times(count: int) -> list[float]:
+    """Seconds from spawning a REPL to its first answer, for `count` REPLs."""
+    times: list[float] = []
+    for _ in range(count):
+        repl = await Repl.create("", max_uses=2, max_mem=settings.MAX_MEM)
+        start = perf_counter()
+        try:
+            await repl.start()
+            resp = await repl.send_timeout(Snippet(id=uuid4().hex, code="#eval 1"), 60)
+            assert resp.error is None, resp.error
+            times.append(perf_counter() - start)
+        finally:
+            await repl.close()
+    return times
+
+
+@pytest.mark.perfs
+@pytest.mark.asyncio
+async def test_spawn_latency(perf_rows: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Startup time of REPLs run through `lake env` vs exec'ed directly."""
+    results: dict[str, list[float]] = {}
+    for resolve in (False, True):
+        monkeypatch.setattr(settings, "RESOLVE_LAKE_ENV", resolve)
+        # The first spawn resolves (or warms up) the Lake environment.
+        await _spawn_times(1)
+        results["direct" if resolve else "lake env"] = await _spawn_times(perf_rows)
+
+    for mode, times in results.items():
+        logger.info(
+            f"{mode}: mean {mean(times):.3f}s, median {median(times):.3f}s "
+            f"over {len(times)} REPLs"
+        )
+    assert median(results["direct"]) <= median(results["lake env"])
@@ -464,3 +464,63 @@ async def test_infotree(client: TestClient) -> None:
     }
 
     assert_json_equal(resp.json(), expected, ignore_keys=["time", "env"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "client",
+    [
+        {"MAX_REPLS": 2, "MAX_USES": 10, "INIT_REPLS": {}, "DATABASE_URL": None},
+    ],
+    indirect=True,
+)
+async def test_tactics(client: TestClient) -> None:
+    payload = {
+        "statement": {
+            "id": "two-eq",
+            "code": "theorem two_eq : 1 + 1 = 2 := by\n  sorry",
+        },
+        "tactics": [
+            {"id": "rfl", "code": "rfl"},
+            {"id": "skip", "code": "skip"},
+            {"id": "bad", "code": "exact Nat.succ_ne_zero"},
+        ],
+    }
+    resp = client.post("tactics", json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+
+    data = resp.json()
+    assert data["statement"]["response"]["sorries"][0]["proofState"] == 0
+    results = {r["id"]: r for r in data["results"]}
+    assert [r["id"] for r in data["results"]] == ["rfl", "skip", "bad"]
+    assert results["rfl"]["complete"] is True
+    assert results["rfl"]["response"]["goals"] == []
+    assert results["skip"]["complete"] is False
+    assert results["skip"]["response"]["goals"] == ["⊢ 1 + 1 = 2"]
+    assert results["bad"].get("complete") is not True
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "client",
+    [
+        {"MAX_REPLS": 2, "MAX_USES": 10, "INIT_REPLS": {}, "DATABASE_URL": None},
+    ],
+    indirect=True,
+)
+async def test_tactics_without_sorry(client: TestClient) -> None:
+    payload = {
+        "statement": {"id": "no-sorry", "code": "theorem t : True := trivial"},
+        "tactics": [{"id": "a", "code": "trivial"}],
+    }
+    resp = client.post("tactics", json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+
+    data = resp.json()
+    assert data["results"] == [
+        {
+            "id": "a",
+            "time": 0.0,
+            "error": "Statement must have a single `sorry`, found 0",
+        }
+    ]
@@ -0,0 +1,47 @@
+from app.autoscale import DemandTracker
+
+
+def test_demand_over_window() -> None:
+    demand = DemandTracker(window=10)
+    demand.record_arrival("import Mathlib", now=0)
+    demand.record_arrival("import Mathlib", now=5)
+    demand.record_wait("import Mathlib", 2.0, now=5)
+
+    current = demand.demand(now=6)["import Mathlib"]
+    assert current["rate"] == 0.2
+    assert current["mean_wait"] == 2.0
+
+    assert demand.demand(now=100) == {}
+
+
+def test_allocate_proportionally() -> None:
+    demand = DemandTracker(window=10)
+    for i in range(30):
+        demand.record_arrival("import Mathlib", now=i / 10)
+    for i in range(10):
+        demand.record_arrival("", now=i / 10)
+
+    allocation = demand.allocate(budget=8, min_warm=1, now=5)
+    assert sum(allocation.values()) == 8
+    assert allocation["import Mathlib"] > allocation[""] >= 1
+
+
+def test_allocate_min_warm_for_known_headers() -> None:
+    demand = DemandTracker(window=10)
+    for i in range(10):
+        demand.record_arrival("import Mathlib", now=i / 10)
+
+    allocation = demand.allocate(
+        budget=4, min_warm=1, headers=["import Mathlib\nimport Aesop"], now=5
+    )
+    assert allocation == {"import Mathlib": 3, "import Mathlib\nimport Aesop": 1}
+
+
+def test_allocate_budget_smaller_than_headers() -> None:
+    demand = DemandTracker(window=10)
+    demand.record_arrival("import Mathlib", now=0)
+    demand.record_arrival("import Mathlib", now=0)
+    demand.record_arrival("import Aesop", now=0)
+
+    assert demand.allocate(budget=1, min_warm=1, now=1) == {"import Mathlib": 1}
+    assert demand.allocate(budget=0, min_warm=1, now=1) == {}
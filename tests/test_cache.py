@@ -0,0 +1,204 @@
+import asyncio
+import json
+from pathlib import Path
+
+from app.cache import CacheEntry, DiskCache, Flights, ResultCache
+from app.schemas import CheckResponse
+
+
+def make_cache(
+    max_entries: int = 10, max_bytes: int = 1024, disk: DiskCache | None = None
+) -> ResultCache:
+    return ResultCache(
+        max_entries=max_entries,
+        max_bytes=max_bytes,
+        lean_version="v4.15.0",
+        disk=disk,
+    )
+
+
+def test_key_depends_on_content() -> None:
+    cache = make_cache()
+    key = cache.key("import Mathlib", "#check Nat")
+    assert key == cache.key("import Mathlib", "#check Nat")
+    assert key != cache.key("", "#check Nat")
+    assert key != cache.key("import Mathlib", "#check Nat", infotree="original")
+
+    other = ResultCache(max_entries=10, max_bytes=1024, lean_version="v4.19.0")
+    assert key != other.key("import Mathlib", "#check Nat")
+
+
+async def test_hit_relabels_id() -> None:
+    cache = make_cache()
+    key = cache.key("", "#check Nat")
+    assert await cache.get(key, "a") is None
+
+    await cache.put(key, CheckResponse(id="a", time=0.5, response={"env": 0}))
+    hit = await cache.get(key, "b")
+
+    assert hit is not None
+    assert hit.id == "b"
+    assert hit.time == 0.5
+    assert hit.response == {"env": 0}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+async def test_raw_hit_is_passed_through() -> None:
+    cache = make_cache()
+    key = cache.key("", "#check Nat")
+    await cache.put(key, CheckResponse(id="a", time=0.5, response={"env": 0}))
+    hit = await cache.get(key, "b", raw=True)
+
+    assert hit is not None
+    assert hit.response is None
+    assert json.loads(hit.to_json()) == {"id": "b", "time": 0.5, "response": {"env": 0}}
+
+    # A passed-through response is cached as is.
+    await cache.put(cache.key("", "#check Int"), hit)
+    again = await cache.get(cache.key("", "#check Int"), "c")
+    assert again is not None and again.response == {"env": 0}
+
+
+async def test_errors_are_not_cached() -> None:
+    cache = make_cache()
+    key = cache.key("", "#check Nat")
+    await cache.put(key, CheckResponse(id="a", error="timed out"))
+    assert len(cache) == 0
+    # REPL-level errors, passed through.
+    error = b'{"message": "unknown environment."}'
+    await cache.put(key, CheckResponse.passthrough("a", error))
+    assert len(cache) == 0
+
+
+async def test_lru_eviction() -> None:
+    cache = make_cache(max_entries=2)
+    keys = [cache.key("", f"#check {i}") for i in range(3)]
+    await cache.put(keys[0], CheckResponse(id="0", response={"env": 0}))
+    await cache.put(keys[1], CheckResponse(id="1", response={"env": 0}))
+    assert await cache.get(keys[0], "0") is not None  # Refreshes first entry.
+
+    await cache.put(keys[2], CheckResponse(id="2", response={"env": 0}))
+    assert await cache.get(keys[1], "1") is None
+    assert await cache.get(keys[0], "0") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+async def test_byte_bound() -> None:
+    cache = make_cache(max_bytes=25)  # Fits two `{"env": i}` payloads.
+    keys = [cache.key("", f"#check {i}") for i in range(3)]
+    for i, key in enumerate(keys):
+        await cache.put(key, CheckResponse(id=str(i), response={"env": i}))
+    assert cache.stats()["bytes"] <= 25
+    assert await cache.get(keys[2], "2") is not None
+    assert await cache.get(keys[0], "0") is None
+
+
+async def test_disk_cache_survives_restart(tmp_path: Path) -> None:
+    path = str(tmp_path / "results.sqlite")
+    disk = DiskCache(path, max_bytes=1024, mmap_bytes=0)
+    cache = make_cache(disk=disk)
+    key = cache.key("", "#check Nat")
+    await cache.put(key, CheckResponse(id="a", time=0.5, response={"env": 0}))
+    disk.close()
+
+    restarted = make_cache(disk=DiskCache(path, max_bytes=1024, mmap_bytes=0))
+    hit = await restarted.get(key, "b")
+    assert hit is not None
+    assert hit.id == "b"
+    assert hit.response == {"env": 0}
+    assert len(restarted) == 1  # Promoted to memory.
+
+
+def test_disk_cache_compaction(tmp_path: Path) -> None:
+    disk = DiskCache(str(tmp_path / "results.sqlite"), max_bytes=25, mmap_bytes=0)
+    for i in range(3):
+        disk.put(str(i), CacheEntry(b'{"env": 0}', 0.0))
+    disk.get("0")  # Most recently accessed, kept by compaction.
+
+    assert disk.compact() == 1
+    assert disk.get("1") is None
+    assert disk.get("0") is not None
+    assert disk.stats()["entries"] == 2
+
+
+async def test_single_flight_coalesces_identical_checks() -> None:
+    flights = Flights()
+    started = asyncio.Event()
+    release = asyncio.Event()
+    runs = 0
+
+    async def check() -> CheckResponse:
+        nonlocal runs
+        runs += 1
+        started.set()
+        await release.wait()
+        return CheckResponse(id="a", time=1.0, response={"env": 0})
+
+    leader = asyncio.create_task(flights.single_flight("k", "a", check))
+    await started.wait()
+    follower = asyncio.create_task(flights.single_flight("k", "b", check))
+    await asyncio.sleep(0)
+    release.set()
+
+    first, second = await asyncio.gather(leader, follower)
+    assert runs == 1
+    assert (first.id, second.id) == ("a", "b")
+    assert second.response == first.response
+    assert second.response is not first.response
+    assert flights.stats()["coalesced"] == 1
+    assert flights.stats()["in_flight"] == 0
+
+
+async def test_single_flight_retries_when_leader_is_cancelled() -> None:
+    flights = Flights()
+    started = asyncio.Event()
+    runs = 0
+
+    async def hang() -> CheckResponse:
+        started.set()
+        await asyncio.Event().wait()
+        raise AssertionError
+
+    async def check() -> CheckResponse:
+        nonlocal runs
+        runs += 1
+        return CheckResponse(id="b", response={"env": 0})
+
+    leader = asyncio.create_task(flights.single_flight("k", "a", hang))
+    await started.wait()
+    follower = asyncio.create_task(flights.single_flight("k", "b", check))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    resp = await follower
+    assert runs == 1
+    assert resp.id == "b"
+
+
+async def test_single_flight_followers_do_not_see_leader_mutations() -> None:
+    flights = Flights()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def check() -> CheckResponse:
+        started.set()
+        await release.wait()
+        return CheckResponse(
+            id="a", response={"env": 0}, diagnostics={"repl_uuid": "r"}
+        )
+
+    async def lead() -> CheckResponse:
+        resp = await flights.single_flight("k", "a", check)
+        resp.diagnostics = None
+        return resp
+
+    leader = asyncio.create_task(lead())
+    await started.wait()
+    follower = asyncio.create_task(flights.single_flight("k", "b", check))
+    await asyncio.sleep(0)
+    release.set()
+
+    first, second = await asyncio.gather(leader, follower)
+    assert first.diagnostics is None
+    assert second.diagnostics == {"repl_uuid": "r"}
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import pytest
+
+from app.cgroup import ReplCgroup, cgroups_available
+
+
+def test_cgroups_available(tmp_path: Path) -> None:
+    assert not cgroups_available(str(tmp_path))
+
+    parent = tmp_path / "delegated"
+    parent.mkdir()
+    (parent / "cgroup.subtree_control").write_text("cpu memory pids\n")
+    assert cgroups_available(str(parent))
+
+
+def test_create_sets_limits(tmp_path: Path) -> None:
+    cgroup = ReplCgroup.create(str(tmp_path), "repl-1", 8 << 30, cpus=1.5)
+
+    assert cgroup is not None
+    assert (tmp_path / "repl-1" / "memory.max").read_text() == str(8 << 30)
+    assert (tmp_path / "repl-1" / "cpu.max").read_text() == "150000 100000"
+    assert ReplCgroup.create(str(tmp_path / "missing"), "repl-2", 1) is None
+
+
+def test_command_usage(tmp_path: Path) -> None:
+    path = tmp_path / "repl"
+    path.mkdir()
+    (path / "cpu.stat").write_text("usage_usec 1000000\nuser_usec 900000\n")
+    (path / "memory.peak").write_text("4096\n")
+    cgroup = ReplCgroup(str(path))
+    # As on kernels before 6.12: the peak is not reset per command.
+    cgroup._resettable = False
+
+    start = cgroup.begin()
+    (path / "cpu.stat").write_text("usage_usec 1250000\nuser_usec 1100000\n")
+    cpu, peak = cgroup.command_usage(start, wall=0.5)
+    assert cpu == 50
+    # Below the peak of an earlier command: unknown.
+    assert peak == 0
+
+    (path / "memory.peak").write_text("8192\n")
+    assert cgroup.command_usage(start, wall=0.5)[1] == 8192
+
+    for name in ("cpu.stat", "memory.peak"):
+        (path / name).unlink()
+    cgroup.remove()
+    assert not path.exists()
+
+
+def test_only_memory_max_is_required(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    write = ReplCgroup._write
+
+    def no_swap(self: ReplCgroup, name: str, value: str) -> None:
+        if name in ("memory.swap.max", "memory.oom.group"):
+            raise PermissionError(name)
+        write(self, name, value)
+
+    monkeypatch.setattr(ReplCgroup, "_write", no_swap)
+    cgroup = ReplCgroup.create(str(tmp_path), "repl-1", 1 << 30)
+
+    assert cgroup is not None
+    assert (tmp_path / "repl-1" / "memory.max").read_text() == str(1 << 30)
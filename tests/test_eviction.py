@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from app.autoscale import HeaderDemand
+from app.eviction import get_policy
+from app.repl import Repl
+
+
+def make_repl(header: str, *, age: int = 0, max_uses: int = 10) -> Repl:
+    return Repl(
+        uuid4(),
+        datetime.now() - timedelta(seconds=age),
+        header,
+        max_mem=8192,
+        max_uses=max_uses,
+    )
+
+
+def demand(rate: float) -> HeaderDemand:
+    return {"rate": rate, "mean_wait": 0.0, "weight": rate}
+
+
+def test_oldest() -> None:
+    old, new = make_repl("", age=10), make_repl("")
+    victim, _ = get_policy("oldest").select([new, old], {})
+    assert victim is old
+
+
+def test_lru() -> None:
+    idle, recent = make_repl(""), make_repl("")
+    idle.last_used_at, recent.last_used_at = 1.0, 2.0
+    victim, score = get_policy("lru").select([recent, idle], {})
+    assert victim is idle
+    assert score == 1.0
+
+
+def test_lfu() -> None:
+    mathlib, one_off = make_repl("import Mathlib"), make_repl("import Foo")
+    victim, _ = get_policy("lfu").select(
+        [mathlib, one_off], {"import Mathlib": demand(2.0)}
+    )
+    assert victim is one_off
+
+
+def test_cost_keeps_expensive_repl_with_uses_left() -> None:
+    mathlib = make_repl("import Mathlib", age=10)
+    mathlib.header_load_time = 10.0
+    mathlib.use_count = 2  # Header + one proof: 9 uses left.
+
+    one_off = make_repl("import Foo")
+    one_off.header_load_time = 2.0
+    one_off.use_count = 10  # One use left.
+
+    victim, score = get_policy("cost").select(
+        [mathlib, one_off], {"import Mathlib": demand(0.5)}
+    )
+    assert victim is one_off
+    assert score == 2.0
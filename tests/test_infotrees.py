@@ -0,0 +1,91 @@
+import json
+import os
+import zlib
+from pathlib import Path
+from typing import Any
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.infotrees import COMPRESSION_LEVEL, InfotreeStore, select
+from app.routers.check import router
+
+TREE: list[dict[str, Any]] = [
+    {"node": {"kind": "TacticInfo", "stx": "simp"}, "children": []},
+    {"node": {"kind": "TermInfo"}, "children": [{"node": "leaf", "children": []}]},
+]
+
+
+def test_detach_stores_infotree() -> None:
+    store = InfotreeStore(":memory:", max_bytes=1 << 20)
+    response = json.dumps({"env": 0, "infotree": TREE}, indent=2).encode()
+
+    resp, handle = store.detach(response)
+
+    assert resp == {"env": 0}
+    assert handle is not None
+    data = store.get(handle)
+    assert data is not None and json.loads(data) == TREE
+    # Identical infotrees are stored once.
+    assert store.detach(response)[1] == handle
+    assert store.stats()["entries"] == 1
+    assert store.detach(b'{"env": 1}') == ({"env": 1}, None)
+
+
+def test_store_is_bounded() -> None:
+    store = InfotreeStore(":memory:", max_bytes=3000)
+    # Random hex digits: about 1.1 KB each, compressed.
+    handles = [store.put(json.dumps(os.urandom(1024).hex()).encode()) for _ in range(4)]
+
+    assert None not in handles
+    assert store.get(handles[0]) is None  # type: ignore[arg-type]
+    assert store.get(handles[-1]) is not None  # type: ignore[arg-type]
+    assert store.stats()["bytes"] <= 3000
+    assert store.stats()["evictions"] == 2
+    # Larger than the whole store: left inline.
+    tree = json.dumps(os.urandom(4096).hex()).encode()
+    resp, handle = store.detach(b'{"env": 0, "infotree": ' + tree + b"}")
+    assert handle is None and "infotree" in resp
+
+
+def test_size_is_shared(tmp_path: Path) -> None:
+    path = str(tmp_path / "infotrees.sqlite")
+    first = InfotreeStore(path, max_bytes=1 << 20)
+    second = InfotreeStore(path, max_bytes=1 << 20)
+    first.put(json.dumps(TREE).encode())
+    second.put(json.dumps(TREE[0]).encode())
+    second.put(json.dumps(TREE).encode())
+    first.close()
+
+    size = sum(
+        len(zlib.compress(json.dumps(tree).encode(), COMPRESSION_LEVEL))
+        for tree in (TREE, TREE[0])
+    )
+    assert second.stats()["bytes"] == size
+    assert InfotreeStore(path, max_bytes=1 << 20).stats()["bytes"] == size
+
+
+def test_select_subtree() -> None:
+    data = json.dumps(TREE).encode()
+
+    assert json.loads(select(data, "1/children/0/node")) == "leaf"
+    assert select(data, "") == data
+    for path in ("2", "0/parent", "0/node/kind/0", "x"):
+        with pytest.raises(LookupError):
+            select(data, path)
+
+
+def test_fetch_by_handle() -> None:
+    store = InfotreeStore(":memory:", max_bytes=1 << 20)
+    handle = store.put(json.dumps(TREE).encode())
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.state.infotrees = store
+    client = TestClient(app)
+
+    assert client.get(f"/api/infotrees/{handle}").json() == TREE
+    resp = client.get(f"/api/infotrees/{handle}", params={"path": "0/node"})
+    assert resp.json() == TREE[0]["node"]
+    assert client.get(f"/api/infotrees/{handle}?path=5").status_code == 404
+    assert client.get("/api/infotrees/unknown").status_code == 404
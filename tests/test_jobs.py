@@ -0,0 +1,128 @@
+import asyncio
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+import pytest
+
+import app.jobs
+from app.jobs import JobRunner, JobStore
+from app.schemas import CheckResponse, ChecksRequest, Snippet
+
+
+def make_request(n: int) -> ChecksRequest:
+    return ChecksRequest.model_validate(
+        {"snippets": [{"id": f"s{i}", "code": f"def f{i} := {i}"} for i in range(n)]}
+    )
+
+
+def test_results_survive_restart(tmp_path: Path) -> None:
+    path = str(tmp_path / "jobs.sqlite")
+    store = JobStore(path)
+    job = store.create(make_request(3))
+    store.add_result(job.id, 2, CheckResponse(id="s2", response={"env": 0}))
+    store.add_result(job.id, 2, CheckResponse(id="s2", response={"env": 0}))
+    store.close()
+
+    store = JobStore(path)
+    assert store.unfinished() == [job.id]
+    restored = store.get(job.id)
+    assert restored is not None
+    assert (restored.status, restored.total, restored.done) == ("queued", 3, 1)
+    request, done = store.load(job.id)
+    assert [s.id for s in request.snippets] == ["s0", "s1", "s2"]
+    assert done == {2}
+    assert [r.id for r in store.results(job.id, 0, 2)] == []
+    assert [r.id for r in store.results(job.id, 1, 2)] == ["s2"]
+    assert store.results_json(job.id, 0, 3) == [
+        b'{"id":"s2","time":0.0,"response":{"env":0}}'
+    ]
+
+
+def test_purge_finished_jobs() -> None:
+    store = JobStore(":memory:")
+    finished = store.create(make_request(1))
+    queued = store.create(make_request(1))
+    store.set_status(finished.id, "done")
+
+    assert store.purge(before=0) == 0
+    assert store.purge(before=float("inf")) == 1
+    assert store.get(finished.id) is None
+    assert store.get(queued.id) is not None
+
+
+async def test_runner_resumes_pending_snippets(monkeypatch: pytest.MonkeyPatch) -> None:
+    checked: list[str] = []
+
+    async def fake_iter_checks(
+        snippets: list[Snippet], *args: Any
+    ) -> AsyncIterator[tuple[int, CheckResponse]]:
+        for i, snippet in enumerate(snippets):
+            checked.append(snippet.id)
+            yield i, CheckResponse(id=snippet.id, response={"env": 0})
+
+    monkeypatch.setattr(app.jobs, "iter_checks", fake_iter_checks)
+    store = JobStore(":memory:")
+    runner = JobRunner(store, manager=None)  # type: ignore[arg-type]
+    job = store.create(make_request(3))
+    store.add_result(job.id, 1, CheckResponse(id="s1", response={"env": 0}))
+
+    task = asyncio.create_task(runner.run())
+    second = await runner.submit(make_request(1))
+    for _ in range(100):
+        if not store.unfinished():
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+    assert checked == ["s0", "s2", "s0"]
+    for job_id in (job.id, second.id):
+        finished = store.get(job_id)
+        assert finished is not None and finished.status == "done"
+    assert [r.id for r in store.results(job.id, 0, 10)] == ["s0", "s1", "s2"]
+
+
+def test_claim_is_exclusive_until_lease_expires(tmp_path: Path) -> None:
+    path = str(tmp_path / "jobs.sqlite")
+    first, second = JobStore(path), JobStore(path)
+    job = first.create(make_request(1))
+
+    assert first.claim("a", lease=60) == job.id
+    assert second.claim("b", lease=60) is None
+    assert first.renew(job.id, "a")
+    # Worker `a` stopped renewing its lease: `b` takes the job over.
+    assert second.claim("b", lease=0) == job.id
+    assert not first.renew(job.id, "a")
+    first.set_status(job.id, "failed", "late", owner="a")
+    second.release(job.id, "b")
+    restored = second.get(job.id)
+    assert restored is not None and restored.status == "queued"
+    assert first.claim("a", lease=60) == job.id
+
+
+async def test_lost_lease_closes_checks(monkeypatch: pytest.MonkeyPatch) -> None:
+    closed = asyncio.Event()
+
+    async def fake_iter_checks(
+        snippets: list[Snippet], *args: Any
+    ) -> AsyncIterator[tuple[int, CheckResponse]]:
+        try:
+            yield 0, CheckResponse(id=snippets[0].id, response={"env": 0})
+            await asyncio.Event().wait()
+        finally:
+            closed.set()
+
+    async def lose_lease(job_id: str) -> None:
+        return None
+
+    monkeypatch.setattr(app.jobs, "iter_checks", fake_iter_checks)
+    store = JobStore(":memory:")
+    runner = JobRunner(store, manager=None)  # type: ignore[arg-type]
+    monkeypatch.setattr(runner, "_renew", lose_lease)
+    job = store.create(make_request(2))
+    assert store.claim(runner.owner, lease=60) == job.id
+
+    await runner._run_job(job.id)
+
+    assert closed.is_set()
+    running = store.get(job.id)
+    assert running is not None and running.done == 1
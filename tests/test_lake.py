@@ -0,0 +1,47 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from app import lake
+from app.lake import fingerprint, lake_env
+
+
+def test_fingerprint_follows_manifest(tmp_path: Path) -> None:
+    (tmp_path / "lean-toolchain").write_text("leanprover/lean4:v4.15.0\n")
+    before = fingerprint(str(tmp_path))
+
+    assert fingerprint(str(tmp_path)) == before
+    (tmp_path / "lake-manifest.json").write_text('{"packages": []}')
+    assert fingerprint(str(tmp_path)) != before
+
+
+async def test_lake_env_is_resolved_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    resolved: list[str] = []
+
+    async def resolve(project_dir: str) -> dict[str, str]:
+        resolved.append(project_dir)
+        return {"LEAN_PATH": f"/lib/{len(resolved)}"}
+
+    monkeypatch.setattr(lake, "_resolve", resolve)
+    monkeypatch.setattr(lake, "_resolved", {})
+    (tmp_path / "lean-toolchain").write_text("leanprover/lean4:v4.15.0\n")
+
+    env = await lake_env(str(tmp_path))
+    assert env is not None and env["LEAN_PATH"] == "/lib/1"
+    assert env["PATH"] == os.environ["PATH"]
+    env = await lake_env(str(tmp_path))
+    assert env is not None and env["LEAN_PATH"] == "/lib/1"
+    assert len(resolved) == 1
+
+    # A toolchain update invalidates the cached environment.
+    (tmp_path / "lean-toolchain").write_text("leanprover/lean4:v4.16.0\n")
+    env = await lake_env(str(tmp_path))
+    assert env is not None and env["LEAN_PATH"] == "/lib/2"
+
+
+async def test_lake_env_failure_falls_back(tmp_path: Path) -> None:
+    # Not a Lake project (or no `lake` at all): REPLs go through `lake env`.
+    assert await lake_env(str(tmp_path / "missing")) is None
@@ -1,3 +1,8 @@
+import asyncio
+from datetime import datetime, timedelta
+from time import time
+from typing import Any
+
 import pytest
 
 from app.errors import NoAvailableReplError
@@ -43,3 +48,205 @@ async def test_get_repl_with_reuse() -> None:
 
     assert manager._busy == {repl3}
     assert manager._free == []
+
+
+@pytest.mark.asyncio
+async def test_release_hands_off_to_matching_waiter() -> None:
+    manager = Manager(max_repls=1, max_uses=3)
+
+    repl = await manager.get_repl("import A")
+    other = asyncio.create_task(manager.get_repl("import B"))
+    same = asyncio.create_task(manager.get_repl("import A"))
+    await asyncio.sleep(0.01)
+
+    # The waiter for the released header is served, even though it arrived later.
+    await manager.release_repl(repl)
+    assert await same is repl
+    assert not other.done()
+
+    # Only eviction can serve the other header.
+    await manager.release_repl(repl)
+    replacement = await other
+    assert replacement is not repl
+    assert replacement.header == "import B"
+    assert manager._busy == {replacement}
+    assert manager._free == []
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_served_in_order() -> None:
+    manager = Manager(max_repls=1, max_uses=5)
+
+    repl = await manager.get_repl("import A")
+    first = asyncio.create_task(manager.get_repl("import A", snippet_id="first"))
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(manager.get_repl("import A", snippet_id="second"))
+    await asyncio.sleep(0.01)
+    assert manager.stats()["waiting"] == {"import A": 2}
+
+    await manager.release_repl(repl)
+    assert await first is repl
+    assert not second.done()
+
+    await manager.release_repl(repl)
+    assert await second is repl
+    assert manager.stats()["waiting"] == {}
+
+
+@pytest.mark.asyncio
+async def test_timed_out_waiter_is_dropped() -> None:
+    manager = Manager(max_repls=1, max_uses=3)
+
+    repl = await manager.get_repl("import A")
+    with pytest.raises(NoAvailableReplError):
+        await manager.get_repl("import A", timeout=0.05)
+
+    await manager.release_repl(repl)
+    assert manager._free == [repl]
+
+
+@pytest.mark.asyncio
+async def test_repl_handed_off_at_timeout_is_returned(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = Manager(max_repls=1, max_uses=3)
+    repl = await manager.get_repl("import A")
+
+    async def wait_for(future: Any, timeout: float) -> Any:
+        # The REPL is released to the waiter in the iteration the timeout fires.
+        await manager.release_repl(repl)
+        raise TimeoutError
+
+    monkeypatch.setattr("app.manager.asyncio.wait_for", wait_for)
+    assert await manager.get_repl("import A", timeout=0.05) is repl
+    assert manager._busy == {repl}
+
+
+@pytest.mark.asyncio
+async def test_rebind_only_for_reuse(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(Manager, "_can_rebind", staticmethod(lambda r, h: True))
+    manager = Manager(max_repls=1, max_uses=5, rebind=True)
+
+    repl = await manager.get_repl("import A")
+    repl.loaded_header = "import A"
+    await manager.release_repl(repl)
+    # A fresh process, even though the idle one has the header.
+    fresh = await manager.get_repl("import A", reuse=False)
+    assert fresh is not repl
+
+    fresh.loaded_header = "import A"
+    await manager.release_repl(fresh)
+    assert await manager.get_repl("import B") is fresh
+    assert fresh.header == "import B" and fresh.loaded_header is None
+
+
+@pytest.mark.asyncio
+async def test_recycle_reason() -> None:
+    manager = Manager(max_repls=1, max_uses=100)
+    repl = await manager.get_repl()
+
+    assert repl.recycle_reason(100, 2.0, 60) is None
+    repl.mem_per_exec = {0: 50, 1: 150}
+    assert repl.recycle_reason(100, 0, 0) == "memory 0 MB"
+    assert repl.recycle_reason(0, 0, 0) is None
+
+    repl.first_times = [1.0] * 5
+    repl.last_times.extend([1.5] * 5)
+    assert repl.recycle_reason(0, 2.0, 0) is None
+    repl.last_times.extend([2.5] * 3)
+    assert repl.recycle_reason(0, 2.0, 0) == "latency 2.500s vs 1.000s"
+
+    repl.created_at = datetime.now() - timedelta(seconds=120)
+    assert repl.recycle_reason(0, 0, 60) == "age 120s"
+
+
+@pytest.mark.asyncio
+async def test_recycled_repl_is_replaced_before_closing(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = Manager(max_repls=1, max_uses=100, recycle_max_age=60)
+    warmed = asyncio.Event()
+
+    async def prep(*args: Any, **kwargs: Any) -> None:
+        await warmed.wait()
+
+    monkeypatch.setattr(manager, "prep", prep)
+
+    repl = await manager.get_repl("import A")
+    repl.created_at = datetime.now() - timedelta(seconds=120)
+    await manager.release_repl(repl)
+
+    # The old REPL keeps serving while its replacement warms up.
+    assert await manager.get_repl("import A") is repl
+    assert manager._total == 2
+    warmed.set()
+    await asyncio.sleep(0.01)
+    replacement = manager._free[0]
+    assert replacement is not repl
+    assert replacement.header == "import A"
+
+    # Replaced while busy: closed on release.
+    await manager.release_repl(repl)
+    assert manager._free == [replacement]
+    assert manager._busy == set()
+
+
+@pytest.mark.asyncio
+async def test_no_recycling_while_header_backs_off() -> None:
+    manager = Manager(max_repls=1, max_uses=100, recycle_max_age=60)
+
+    repl = await manager.get_repl("import A")
+    repl.created_at = datetime.now() - timedelta(seconds=120)
+    manager._warm_backoff["import A"] = time() + 60
+    await manager.release_repl(repl)
+
+    assert manager._total == 1
+    assert manager._free == [repl] and not manager._retiring
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_throttles_starts() -> None:
+    manager = Manager(max_repls=4, max_uses=3, memory_budget_mb=3, memory_reserve_mb=1)
+
+    # A starting REPL counts 1 MB, plus 1 MB reserved for its command.
+    repl = await manager.get_repl("import A")
+    with pytest.raises(NoAvailableReplError):
+        await manager.get_repl("import B", timeout=0.05)
+
+    await manager.release_repl(repl)
+    assert await manager.get_repl("import A") is repl
+    stats = manager.stats()["memory"]
+    # Deferred once, however often the budget was probed meanwhile.
+    assert stats is not None and stats["throttled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_spares_fill_allocation_while_warming(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = Manager(max_repls=4, max_uses=3, autoscale=False, spare_repls={})
+    warmed = asyncio.Event()
+
+    async def prep(*args: Any, **kwargs: Any) -> None:
+        await warmed.wait()
+
+    monkeypatch.setattr(manager, "prep", prep)
+    replenisher = asyncio.create_task(manager._replenish_loop())
+
+    serving = await manager.get_repl("import A")
+    manager.allocation = {"import A": 2}
+    manager._request_replenish()
+    await asyncio.sleep(0.01)
+    assert manager._total == 2
+
+    # Raised while a spare is still warming: one more is started, not none.
+    manager.allocation = {"import A": 3}
+    manager._request_replenish()
+    await asyncio.sleep(0.01)
+    assert manager._total == 3
+
+    warmed.set()
+    await asyncio.sleep(0.01)
+    assert manager._total == 3
+    assert len(manager._free) == 2 and manager._busy == {serving}
+    replenisher.cancel()
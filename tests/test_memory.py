@@ -0,0 +1,58 @@
+from typing import cast
+
+import psutil
+
+from app.memory import MemoryBudget, ProcessMemory, process_memory
+from app.repl import Repl
+
+MB = 1024 * 1024
+
+
+class FakeRepl:
+    def __init__(self, header: str, pss: int) -> None:
+        self.header = header
+        self.loaded_header = header
+        self.is_running = True
+        self.pss = pss
+
+    def memory(self) -> ProcessMemory:
+        return {"uss": self.pss, "pss": self.pss}
+
+
+def fake_repl(header: str, pss: int) -> Repl:
+    return cast(Repl, FakeRepl(header, pss))
+
+
+def test_process_memory() -> None:
+    memory = process_memory(psutil.Process())
+
+    assert 0 < memory["uss"] <= memory["pss"]
+
+
+def test_admission_reserves_header_headroom() -> None:
+    budget = MemoryBudget(10 * MB, default_reserve=2 * MB)
+    light = fake_repl("import Light", 3 * MB)
+    heavy = fake_repl("import Heavy", 3 * MB)
+    budget.record_growth("import Light", 1 * MB)
+    budget.record_growth("import Heavy", 4 * MB)
+    budget.record_footprint("import Heavy", 3 * MB)
+
+    # 6 MB used, a light command reserves 1 MB and a heavy one 4 MB.
+    assert budget.admits("import Light", False, [light, heavy], [light])
+    assert not budget.admits("import Heavy", False, [light, heavy], [light, heavy])
+    # Starting a REPL also costs its header footprint.
+    assert not budget.admits("import Heavy", True, [light, heavy], [])
+    # Probes are not deferred requests: the manager counts those.
+    assert budget.throttled == 0
+
+
+def test_loading_repl_counts_its_footprint() -> None:
+    budget = MemoryBudget(10 * MB, default_reserve=2 * MB)
+    budget.record_footprint("import A", 5 * MB)
+    repl = fake_repl("import A", 1 * MB)
+    repl.loaded_header = None
+
+    assert budget.used([repl]) == 5 * MB
+    stats = budget.stats([repl], [repl])
+    assert stats["used"] == 5 * MB
+    assert stats["reserved"] == 2 * MB
@@ -0,0 +1,99 @@
+from app.packing import make_packs, packable
+from app.schemas import CommandResponse, Pos, Snippet
+
+
+def snippets(*codes: str) -> list[tuple[int, Snippet]]:
+    return [(i, Snippet(id=str(i), code=code)) for i, code in enumerate(codes)]
+
+
+def test_packable() -> None:
+    assert packable("theorem t : 1 = 1 := rfl")
+    assert not packable("")
+    assert not packable("@[simp] theorem t : 1 = 1 := rfl")
+    assert not packable("instance : Inhabited Foo := ⟨⟨⟩⟩")
+    assert not packable("namespace Foo\ndef x := 1\nend Foo")
+
+
+def test_make_packs_groups_by_header_and_avoids_name_leaks() -> None:
+    packs = make_packs(
+        snippets(
+            "import Mathlib\ndef f := 1",
+            "def g := 2",
+            "import Mathlib\n#check f",  # Uses `f` declared by snippet 0
+            "import Mathlib\n#check Nat",
+            "@[simp] theorem t : 1 = 1 := rfl",
+            "def h := 3",
+        ),
+        size=8,
+    )
+    assert [[i for i, _, _ in p.items] for p in packs] == [[0], [1, 5], [2, 3], [4]]
+    assert [p.header for p in packs] == ["import Mathlib", "", "import Mathlib", ""]
+
+
+def test_make_packs_respects_size() -> None:
+    packs = make_packs(snippets(*(f"#check {i}" for i in range(5))), size=2)
+    assert [len(p) for p in packs] == [2, 2, 1]
+
+
+def test_split_relabels_positions_and_finds_first_failure() -> None:
+    (pack,) = make_packs(
+        snippets("#check 1", "theorem t : 1 = 2 := by\n  sorry", "#check x"), size=8
+    )
+    assert pack.code().splitlines() == [
+        "section",
+        "#check 1",
+        "end",
+        "section",
+        "theorem t : 1 = 2 := by",
+        "  sorry",
+        "end",
+        "section",
+        "#check x",
+        "end",
+    ]
+
+    def pos(line: int, column: int = 0) -> Pos:
+        return {"line": line, "column": column}
+
+    resp: CommandResponse = {
+        "env": 3,
+        "messages": [
+            {"severity": "info", "pos": pos(2), "endPos": pos(2, 6), "data": "1 : Nat"},
+            {
+                "severity": "warning",
+                "pos": pos(5),
+                "endPos": pos(5, 7),
+                "data": "sorry",
+            },
+            {"severity": "error", "pos": pos(9), "endPos": pos(9, 8), "data": "x?"},
+        ],
+        "sorries": [
+            {"pos": pos(6, 2), "endPos": pos(6, 7), "goal": "⊢ 1 = 2", "proofState": 0}
+        ],
+    }
+    splits, failed = pack.split(resp)
+
+    assert failed == 2
+    assert splits[0]["messages"][0]["pos"] == pos(1)
+    assert splits[1]["messages"][0]["pos"] == pos(1)
+    assert splits[1]["sorries"][0]["pos"] == pos(2, 2)
+    assert splits[2]["messages"][0]["endPos"] == pos(1, 8)
+    assert all(s["env"] == 3 for s in splits)
+
+
+def test_split_fails_on_messages_outside_bodies() -> None:
+    (pack,) = make_packs(snippets("#check 1", "#check 2"), size=8)
+    pack.code()
+    resp: CommandResponse = {
+        "env": 1,
+        "messages": [
+            {
+                "severity": "warning",
+                "pos": {"line": 3, "column": 0},
+                "endPos": {"line": 3, "column": 3},
+                "data": "unexpected",
+            }
+        ],
+    }
+    _, failed = pack.split(resp)
+    assert failed == 0
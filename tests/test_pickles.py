@@ -0,0 +1,35 @@
+from pathlib import Path
+
+from app.pickles import HeaderPickles, detect_toolchain
+
+
+def test_path_keyed_by_header_and_toolchain(tmp_path: Path) -> None:
+    pickles = HeaderPickles(str(tmp_path), "leanprover/lean4:v4.15.0")
+    other = HeaderPickles(str(tmp_path), "leanprover/lean4:v4.19.0")
+
+    path = pickles.path("import Mathlib")
+    assert path == pickles.path("import Mathlib")
+    assert path != pickles.path("import Mathlib\nimport Aesop")
+    assert path != other.path("import Mathlib")
+
+
+def test_commit_and_discard(tmp_path: Path) -> None:
+    pickles = HeaderPickles(str(tmp_path), "v4.15.0")
+    assert pickles.get("import Mathlib") is None
+
+    tmp = pickles.tmp_path("import Mathlib")
+    Path(tmp).write_bytes(b"olean")
+    pickles.commit(tmp, "import Mathlib")
+
+    path = pickles.get("import Mathlib")
+    assert path is not None
+    assert not Path(tmp).exists()
+
+    pickles.discard(path)
+    assert pickles.get("import Mathlib") is None
+
+
+def test_detect_toolchain(tmp_path: Path) -> None:
+    assert detect_toolchain(str(tmp_path), "v4.15.0") == "v4.15.0"
+    (tmp_path / "lean-toolchain").write_text("leanprover/lean4:v4.19.0\n")
+    assert detect_toolchain(str(tmp_path), "v4.15.0") == "leanprover/lean4:v4.19.0"
@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Any
+from uuid import uuid4
+
+from app.prefix import PrefixEnv, PrefixEnvs
+from app.repl import Repl
+from app.schemas import CommandResponse, Pos
+
+
+def test_evicts_least_recently_used() -> None:
+    envs = PrefixEnvs(max_bytes=10)
+    envs.put("a", PrefixEnv(1, [], [], 4))
+    envs.put("b", PrefixEnv(2, [], [], 4))
+    assert envs.longest(["a"]) == (1, envs._entries["a"])
+    envs.put("c", PrefixEnv(3, [], [], 4))
+
+    assert "b" not in envs._entries
+    assert envs.longest(["a", "x", "c"])[0] == 3
+    assert envs.longest(["b"]) == (0, None)
+
+
+async def test_resumes_from_longest_prefix() -> None:
+    repl = Repl(uuid4(), datetime.now(), max_mem=1024, max_uses=10, prefix_max_bytes=1)
+    sent: list[Any] = []
+
+    async def exchange(
+        input: Any, timeout: float | None = None, window: Any = None
+    ) -> tuple[CommandResponse, float]:
+        sent.append(input)
+        resp: CommandResponse = {"env": len(sent) + 10}
+        if input["cmd"].startswith("theorem"):
+            pos: Pos = {"line": 1, "column": 0}
+            resp["messages"] = [
+                {"severity": "error", "pos": pos, "endPos": pos, "data": "oops"}
+            ]
+        return resp, 0.1
+
+    repl._exchange = exchange  # type: ignore[method-assign]
+
+    first, _ = await repl._send_commands("def f := 1\ndef g := 2\ntheorem t := x", 0)
+    assert [s["env"] for s in sent] == [0, 11, 12]
+    assert first["env"] == 13
+    assert first["messages"][0]["pos"]["line"] == 3
+
+    sent.clear()
+    second, _ = await repl._send_commands("def f := 1\ndef g := 2\n\ntheorem u := y", 0)
+    assert sent == [{"cmd": "theorem u := y", "env": 12}]
+    assert second["messages"][0]["pos"]["line"] == 4
+
+    sent.clear()
+    await repl._send_commands("def f := 1\ndef g := 2\ntheorem t := x", 5)
+    assert [s["env"] for s in sent] == [5, 11, 12]
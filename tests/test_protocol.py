@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+from app import protocol
+from app.protocol import FrameReader, StderrRing
+
+
+def reader(*chunks: bytes, chunk_size: int = 4) -> FrameReader:
+    stream = asyncio.StreamReader()
+    for chunk in chunks:
+        stream.feed_data(chunk)
+    stream.feed_eof()
+    return FrameReader(stream, chunk_size)
+
+
+async def test_frames_across_chunks() -> None:
+    frames = reader(b'\n{"env": 0,\n "messages": []}\n\n', b'{"env"', b": 1}\n\n\n")
+
+    assert await frames.read_frame() == b'{"env": 0,\n "messages": []}'
+    assert await frames.read_frame() == b'{"env": 1}'
+    assert await frames.read_frame() == b""
+
+
+async def test_unterminated_frame_at_eof() -> None:
+    frames = reader(b'{"env": 0}\n')
+
+    assert await frames.read_frame() == b'{"env": 0}'
+    assert await frames.read_frame() == b""
+
+
+async def test_lines_beyond_stream_limit() -> None:
+    # `readline` would fail on a single line this long.
+    resp = {"env": 0, "infotree": ["x" * 100_000]}
+    frames = reader(json.dumps(resp).encode() + b"\n\n", chunk_size=1 << 16)
+
+    assert protocol.loads(await frames.read_frame()) == resp
+
+
+def test_codec_roundtrip() -> None:
+    cmd = {"cmd": "theorem t : ∀ n : ℕ, n = n := by simp", "env": 0}
+
+    assert protocol.loads(protocol.dumps(cmd)) == cmd
+    assert "∀".encode() in protocol.dumps(cmd)
+
+
+def test_stderr_ring() -> None:
+    ring = StderrRing(8)
+    ring.append(b"warning\n")
+    start = ring.total
+    ring.append(b"abc")
+
+    assert ring.since(start) == "abc"
+    assert ring.tail() == "ning\nabc"
+    # Output of the command beyond the buffer is dropped, oldest first.
+    ring.append(b"0123456789")
+    assert ring.since(start) == "[...]23456789"
+    # Up to where the next command started.
+    end = ring.total
+    ring.append(b"xy")
+    assert ring.since(start, end) == "[...]456789"
+
+
+def test_splice() -> None:
+    pretty = json.dumps({"env": 0, "messages": ["a\nb"]}, indent=2).encode()
+
+    spliced = protocol.splice(b'{"id": "a"}', "response", pretty)
+    assert b"\n" not in spliced
+    assert json.loads(spliced) == {
+        "id": "a",
+        "response": {"env": 0, "messages": ["a\nb"]},
+    }
+    assert json.loads(protocol.splice(b"{ }\n", "time", b"0.5")) == {"time": 0.5}
+
+    assert protocol.is_object(pretty)
+    # A response cut short by the REPL dying.
+    assert not protocol.is_object(pretty[:-3])
+
+    assert protocol.is_error(b'{"message": "unknown environment."}')
+    assert protocol.is_error(b'\n{\n  "message": "unknown proof state"}')
+    assert not protocol.is_error(pretty)
+    assert not protocol.is_error(b'{"messages": [], "env": 0}')
@@ -1,8 +1,15 @@
-from typing import AsyncGenerator
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Any, AsyncGenerator
+from uuid import uuid4
 
 import pytest
 
-from app.repl import Repl
+from app.errors import LeanError
+from app.repl import Repl, UsageWindow
+from app.schemas import Snippet
 
 
 @pytest.fixture
@@ -19,3 +26,143 @@ async def test_start(repl: Repl) -> None:
     await repl.start()
 
     assert repl.proc is not None
+
+
+# Stands in for the Lean REPL: answers each command after `delay` seconds, in order,
+# after writing `stderr` bytes to stderr. The command `error` gets a REPL-level error.
+FAKE_REPL = """
+import json, sys, time
+env = 0
+buffer = ""
+for line in sys.stdin:
+    if line.strip():
+        buffer += line
+        continue
+    if not buffer:
+        continue
+    command = json.loads(buffer)
+    buffer = ""
+    time.sleep(command.get("delay", 0))
+    sys.stderr.write("e" * command.get("stderr", 0) + "\\n")
+    sys.stderr.flush()
+    if command.get("exit"):
+        sys.exit(1)
+    if command["cmd"] == "error":
+        print(json.dumps({"message": "unknown environment."}) + "\\n", flush=True)
+        continue
+    print(json.dumps({"env": env, "cmd": command["cmd"]}) + "\\n", flush=True)
+    env += 1
+"""
+
+
+@pytest.fixture
+async def fake_repl() -> AsyncGenerator[Repl, None]:
+    repl_instance = Repl(uuid4(), datetime.now(), max_mem=1024, max_uses=10)
+    repl_instance.proc = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-c",
+        FAKE_REPL,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    repl_instance._stderr_task = asyncio.create_task(repl_instance._drain_stderr())
+    yield repl_instance
+    await repl_instance.close()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_commands(fake_repl: Repl) -> None:
+    commands: list[Any] = [{"cmd": str(i), "delay": 0.2} for i in range(3)]
+    results = await asyncio.gather(
+        *(fake_repl._exchange(c, timeout=0.5) for c in commands)
+    )
+
+    # Answered in order, each timed from when the REPL started running it.
+    assert [r["env"] for r, _ in results] == [0, 1, 2]
+    assert [r["cmd"] for r, _ in results] == ["0", "1", "2"]  # type: ignore[typeddict-item]
+    assert all(0.15 < elapsed < 0.4 for _, elapsed in results)
+
+
+@pytest.mark.asyncio
+async def test_timed_out_command_keeps_order(fake_repl: Repl) -> None:
+    slow_command: Any = {"cmd": "slow", "delay": 0.3}
+    slow = asyncio.create_task(fake_repl._exchange(slow_command, timeout=0.1))
+    fast = asyncio.create_task(fake_repl._exchange({"cmd": "fast"}, timeout=1))
+
+    with pytest.raises(TimeoutError):
+        await slow
+    resp, _ = await fast
+    assert resp["cmd"] == "fast"  # type: ignore[typeddict-item]
+
+
+@pytest.mark.asyncio
+async def test_stderr_is_drained(fake_repl: Repl) -> None:
+    # Far more than a pipe buffer: the REPL would block if nobody read it.
+    command: Any = {"cmd": "chatty", "stderr": 1 << 20}
+    window = UsageWindow()
+    resp, _ = await fake_repl._exchange(command, timeout=5, window=window)
+    await asyncio.sleep(0.1)
+    diagnostics = fake_repl._record_use(0.0, window)
+
+    assert resp["cmd"] == "chatty"  # type: ignore[typeddict-item]
+    # Bounded, with the latest output.
+    assert diagnostics["stderr"].startswith("[...]eee")
+    assert len(diagnostics["stderr"]) <= fake_repl.stderr.max_bytes + 5
+
+
+@pytest.mark.asyncio
+async def test_pipelined_usage_starts_with_command(fake_repl: Repl) -> None:
+    commands: list[Any] = [
+        {"cmd": "first", "delay": 0.2},
+        {"cmd": "second", "delay": 0.1, "stderr": 3},
+    ]
+    windows = [UsageWindow(), UsageWindow()]
+    await asyncio.gather(
+        *(
+            fake_repl._exchange(c, timeout=1, window=w)
+            for c, w in zip(commands, windows)
+        )
+    )
+    await asyncio.sleep(0.1)
+    first, second = (fake_repl._record_use(0.0, w) for w in windows)
+
+    # Written together, but the second one only started once the first was answered.
+    assert windows[0].started_at is not None and windows[1].started_at is not None
+    assert windows[1].started_at - windows[0].started_at > 0.15
+    assert "stderr" not in first
+    assert second["stderr"] == "eee"
+
+
+@pytest.mark.parametrize("raw", [False, True])
+async def test_repl_level_error(fake_repl: Repl, raw: bool) -> None:
+    resp = await fake_repl.send_timeout(Snippet(id="x", code="error"), 1, raw=raw)
+
+    assert resp.error == "unknown environment."
+    assert resp.response is None and resp.raw is None
+
+
+@pytest.mark.asyncio
+async def test_measure_memory_without_sample(fake_repl: Repl) -> None:
+    assert fake_repl.memory()["pss"] == 0
+    assert (await fake_repl.measure_memory())["pss"] > 0
+
+
+@pytest.mark.asyncio
+async def test_exit_reports_stderr(fake_repl: Repl) -> None:
+    command: Any = {"cmd": "crash", "stderr": 3, "exit": True}
+    with pytest.raises(LeanError, match="REPL process exited: eee"):
+        await fake_repl._exchange(command, timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_raw_response_is_passed_through(fake_repl: Repl) -> None:
+    resp = await fake_repl.send_timeout(Snippet(id="a", code="raw"), 5, raw=True)
+
+    assert resp.response is None
+    assert resp.raw is not None
+    result = json.loads(resp.to_json())
+    assert result["id"] == "a"
+    assert result["response"] == {"env": 0, "cmd": "raw"}
+    assert result["diagnostics"]["repl_uuid"] == str(fake_repl.uuid)
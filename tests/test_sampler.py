@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from time import sleep
+
+from app.sampler import Sampler
+
+
+def test_sampler_sums_process_group() -> None:
+    # A busy child in its own session, as REPLs are.
+    proc = subprocess.Popen(
+        [sys.executable, "-c", "while True: pass"], start_new_session=True
+    )
+    sampler = Sampler(interval=0.05)
+    try:
+        # Sampled by hand first: the worker thread would race these passes.
+        usage = sampler.register(proc.pid, start=False)
+        sampler.sample()
+        sleep(0.2)
+        sampler.sample()
+
+        assert usage.pids == [proc.pid]
+        assert usage.rss > 0 and usage.mem_max == usage.peak_mem
+        assert usage.cpu > 10
+        assert usage.current_rss() > 0
+
+        usage.reset()
+        assert usage.cpu_max == 0 and usage.mem_max == 0
+        assert usage.peak_cpu > 10
+
+        sampler.start()
+        sleep(0.2)
+        stats = sampler.stats()
+        assert stats["repls"] == 1
+        assert stats["passes"] > 0
+        assert 0 < stats["overhead"] < 1
+    finally:
+        sampler.stop()
+        proc.kill()
+        proc.wait()
+
+    sampler.unregister(usage)
+    assert sampler.stats()["repls"] == 0
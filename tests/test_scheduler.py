@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from app.scheduler import HeaderGroups, schedule
+
+
+def test_groups_stick_to_preferred_header() -> None:
+    groups = HeaderGroups(["a1", "b1", "a2", "b2", "b3"], group=lambda s: s[0])
+
+    assert groups.pop() == ("b", 1, "b1")  # Largest group first.
+    assert groups.pop("a") == ("a", 0, "a1")
+    assert groups.pop("a") == ("a", 2, "a2")
+    assert groups.pop("a") == ("b", 3, "b2")
+    assert groups.pop("b") == ("b", 4, "b3")
+    assert groups.pop("b") is None
+
+
+@pytest.mark.asyncio
+async def test_schedule_bounds_concurrency() -> None:
+    running = 0
+    peak = 0
+
+    async def run(item: int) -> int:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01 * (item % 3))
+        running -= 1
+        return item * 2
+
+    items = list(range(20))
+    results = dict(
+        [
+            r
+            async for r in schedule(
+                items, str, run, concurrency=4, on_error=lambda i, e: -1
+            )
+        ]
+    )
+
+    assert results == {i: i * 2 for i in items}
+    assert peak == 4
+
+
+@pytest.mark.asyncio
+async def test_schedule_reports_failures_per_item() -> None:
+    async def run(item: int) -> str:
+        if item == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    results = dict(
+        [
+            r
+            async for r in schedule(
+                [0, 1, 2], str, run, concurrency=2, on_error=lambda i, e: str(e)
+            )
+        ]
+    )
+
+    assert results == {0: "ok", 1: "boom", 2: "ok"}
@@ -1,4 +1,4 @@
-from app.split import split_snippet
+from app.split import split_commands, split_snippet
 
 
 def test_only_imports() -> None:
@@ -27,3 +27,61 @@ def test_duplicate_imports() -> None:
     header, body = split_snippet(code)
     assert header.splitlines() == ["import Mathlib", "import Z"]
     assert body.splitlines() == ["Z"]
+
+
+def test_split_commands() -> None:
+    body = (
+        "open Nat\n"
+        "\n"
+        "/-- doc\n"
+        "  continued -/\n"
+        "@[simp]\n"
+        "theorem a : 1 = 1 := by\n"
+        "  rfl\n"
+        "/- def hidden := 0\n"
+        "-/\n"
+        "@[simp] lemma b : 2 = 2 := rfl\n"
+        "#check a"
+    )
+    commands = split_commands(body)
+    assert [i for i, _ in commands] == [0, 2, 9, 10]
+    assert commands[1][1].splitlines()[-3:] == ["  rfl", "/- def hidden := 0", "-/"]
+    assert "\n".join(text for _, text in commands) == body
+
+
+def test_split_commands_single() -> None:
+    assert split_commands("theorem t : True := by\n  trivial") == [
+        (0, "theorem t : True := by\n  trivial")
+    ]
+
+
+def test_split_commands_keeps_modifiers() -> None:
+    body = (
+        "set_option maxHeartbeats 400000 in\n"
+        "theorem a : 1 = 1 := rfl\n"
+        "open Nat in  -- scoped\n"
+        "@[simp]\n"
+        "theorem b : 2 = 2 := rfl\n"
+        "open Nat\n"
+        "#check succ"
+    )
+    commands = split_commands(body)
+    assert [i for i, _ in commands] == [0, 2, 5, 6]
+    assert "\n".join(text for _, text in commands) == body
+
+
+def test_split_commands_keeps_mutual_blocks() -> None:
+    body = (
+        "mutual\n"
+        "def even : Nat → Bool\n"
+        "  | 0 => true\n"
+        "  | n + 1 => odd n\n"
+        "def odd : Nat → Bool\n"
+        "  | 0 => false\n"
+        "  | n + 1 => even n\n"
+        "end\n"
+        "theorem t : even 0 = true := rfl"
+    )
+    commands = split_commands(body)
+    assert [i for i, _ in commands] == [0, 8]
+    assert commands[0][1].splitlines()[-1] == "end"
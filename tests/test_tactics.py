@@ -0,0 +1,139 @@
+import asyncio
+from typing import Any
+
+import pytest
+from pydantic import ValidationError
+
+from app.routers.tactics import run_tactics
+from app.schemas import CheckResponse, TacticsRequest
+
+
+class FakeManager:
+    """Manager whose REPLs all fail to load the header."""
+
+    max_repls = 2
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+
+    async def get_repl(self, header: str, snippet_id: str, reuse: bool) -> Any:
+        return object()
+
+    async def prep(
+        self, repl: Any, snippet_id: str, timeout: float, debug: bool
+    ) -> CheckResponse:
+        self.calls.append("destroy")  # As `Manager.prep` on header errors.
+        return CheckResponse(id=snippet_id, error="unknown package 'Foo'")
+
+    async def release_repl(self, repl: Any) -> None:
+        self.calls.append("release")
+
+    async def destroy_repl(self, repl: Any) -> None:
+        self.calls.append("destroy")
+
+
+async def test_failed_header_is_not_released() -> None:
+    manager = FakeManager()
+    request = TacticsRequest.model_validate(
+        {
+            "statement": {"id": "t", "code": "import Foo\ntheorem t : True := sorry"},
+            "tactics": [{"id": "a", "code": "trivial"}, {"id": "b", "code": "simp"}],
+        }
+    )
+
+    resp = await run_tactics(request, manager)  # type: ignore[arg-type]
+
+    assert resp.statement.error == "unknown package 'Foo'"
+    assert {r.error for r in resp.results} == {"unknown package 'Foo'"}
+    assert "release" not in manager.calls
+
+
+class FakeRepl:
+    """REPL whose statement has one `sorry`, closed by every script."""
+
+    def __init__(self, max_uses: int, use_count: int = 0) -> None:
+        self.max_uses = max_uses
+        self.use_count = use_count
+        self.in_flight = 0
+
+    @property
+    def remaining_uses(self) -> int:
+        return self.max_uses - self.use_count
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining_uses - self.in_flight <= 0
+
+    async def send_timeout(self, snippet: Any, timeout: float) -> CheckResponse:
+        self.use_count += 1
+        pos = {"line": 1, "column": 0}
+        sorry = {"pos": pos, "endPos": pos, "goal": "⊢ True", "proofState": 0}
+        return CheckResponse.model_validate(
+            {"id": snippet.id, "response": {"env": 0, "sorries": [sorry]}}
+        )
+
+    async def run_tactic(self, step: Any, timeout: float) -> tuple[Any, float, Any]:
+        self.in_flight += 1
+        await asyncio.sleep(0)
+        self.in_flight -= 1
+        self.use_count += 1
+        return {"proofState": 1, "goals": []}, 0.1, {}
+
+
+class PoolManager:
+    """Hands out `repls` first, then new REPLs of `max_uses` uses."""
+
+    def __init__(self, max_uses: int, repls: list[FakeRepl]) -> None:
+        self.max_repls = 1
+        self.max_uses = max_uses
+        self.repls = repls
+        self.released: list[FakeRepl] = []
+
+    async def get_repl(self, header: str, snippet_id: str, reuse: bool) -> Any:
+        return self.repls.pop(0) if self.repls else FakeRepl(self.max_uses)
+
+    async def prep(
+        self, repl: Any, snippet_id: str, timeout: float, debug: bool
+    ) -> None:
+        return None
+
+    async def release_repl(self, repl: FakeRepl) -> None:
+        self.released.append(repl)
+
+    async def destroy_repl(self, repl: FakeRepl) -> None:
+        raise AssertionError("No REPL fails")
+
+
+def tactics_request(n: int) -> TacticsRequest:
+    return TacticsRequest.model_validate(
+        {
+            "statement": {"id": "t", "code": "theorem t : True := sorry"},
+            "tactics": [{"id": str(i), "code": "trivial"} for i in range(n)],
+        }
+    )
+
+
+async def test_single_use_repls_run_a_script_each() -> None:
+    manager = PoolManager(max_uses=1, repls=[])
+
+    resp = await run_tactics(tactics_request(3), manager, pipeline_depth=2)  # type: ignore[arg-type]
+
+    assert [r.complete for r in resp.results] == [True] * 3
+    assert len(manager.released) == 3
+
+
+async def test_reused_repl_with_one_use_left_is_released() -> None:
+    reused = FakeRepl(max_uses=3, use_count=2)
+    manager = PoolManager(max_uses=3, repls=[reused])
+
+    resp = await run_tactics(tactics_request(3), manager, pipeline_depth=2)  # type: ignore[arg-type]
+
+    assert [r.complete for r in resp.results] == [True] * 3
+    assert manager.released[0] is reused and reused.use_count == 3
+
+
+def test_check_options_are_rejected() -> None:
+    request = tactics_request(1).model_dump()
+    for option in ({"cache": False}, {"infotree": "original"}):
+        with pytest.raises(ValidationError):
+            TacticsRequest.model_validate(request | option)